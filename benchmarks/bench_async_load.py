@@ -0,0 +1,98 @@
+"""
+Load benchmark for /ai-agent/message against a local fake Dialogflow server.
+
+Compares the old blocking path (a sync gRPC client called from the async
+route, reproduced here) with the async path, at increasing request concurrency. With the
+blocking path throughput stays flat at ~1/latency; the async path should
+scale roughly linearly with concurrency.
+
+Run from the repo root:
+    python -m benchmarks.bench_async_load
+"""
+import asyncio
+import os
+import time
+import uuid
+
+import grpc
+
+from benchmarks.fake_dialogflow import FakeDialogflowServer
+
+LATENCY = 0.05
+REQUESTS_PER_LEVEL = 100
+CONCURRENCY_LEVELS = [1, 4, 16, 64]
+
+
+async def run_level(client, concurrency, total):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            response = await client.post(
+                "/ai-agent/message",
+                json={"message": f"hello {i}", "session_id": f"bench-{i}"},
+            )
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def main():
+    server = FakeDialogflowServer(latency=LATENCY)
+    port = server.start()
+    os.environ["DIALOGFLOW_API_ENDPOINT"] = f"127.0.0.1:{port}"
+    os.environ["DIALOGFLOW_INSECURE_CHANNEL"] = "1"
+
+    import httpx
+    from google.cloud.dialogflowcx import SessionsClient
+    from google.cloud.dialogflowcx_v3.services.sessions.transports import SessionsGrpcTransport
+    from domain import ai_agent
+    from integeration.replies import extract_reply
+    from main import app
+
+    dialogflow = ai_agent.dialogflow_instance
+    blocking_client = SessionsClient(transport=SessionsGrpcTransport(channel=grpc.insecure_channel(f"127.0.0.1:{port}")))
+
+    print("=" * 50)
+    print(f"ASYNC LOAD BENCHMARK (fake upstream latency {LATENCY * 1000:.0f} ms)")
+    print("=" * 50)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        results = {}
+        for mode in ("blocking", "async"):
+            if mode == "blocking":
+                # Reproduce the old behaviour: sync gRPC call on the event loop
+                original = ai_agent.AiAgent.generate_response_async
+
+                async def blocking(self):
+                    session_id = self.session_id or str(uuid.uuid4())
+                    request = dialogflow.build_detect_intent_request(
+                        dialogflow.build_query_input(self.message), dialogflow.registry.default.session_path(session_id)
+                    )
+                    response = blocking_client.detect_intent(request=request)
+                    return ai_agent.AiAgentResponse.from_reply(extract_reply(response), session_id)
+
+                ai_agent.AiAgent.generate_response_async = blocking
+            for concurrency in CONCURRENCY_LEVELS:
+                total = min(REQUESTS_PER_LEVEL, concurrency * 10)
+                rps = await run_level(client, concurrency, total)
+                results[(mode, concurrency)] = rps
+                print(f"  {mode:>8} concurrency={concurrency:<3} {rps:8.1f} req/s")
+            if mode == "blocking":
+                ai_agent.AiAgent.generate_response_async = original
+
+    print()
+    print(f"{'concurrency':>12} {'blocking rps':>14} {'async rps':>12} {'speedup':>9}")
+    for concurrency in CONCURRENCY_LEVELS:
+        blocking_rps = results[("blocking", concurrency)]
+        async_rps = results[("async", concurrency)]
+        print(f"{concurrency:>12} {blocking_rps:>14.1f} {async_rps:>12.1f} {async_rps / blocking_rps:>8.1f}x")
+    print(f"\nUpstream requests served: {server.request_count}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+Throughput of Dialogflow calls over a pool of 1..N gRPC channels.
+
+The fake server caps each connection at MAX_STREAMS concurrent HTTP/2
+streams, as the real endpoint does, so with one channel at most MAX_STREAMS
+calls are in flight and the rest queue on the client. More channels lift
+that ceiling.
+
+Run from the repo root:
+    python -m benchmarks.bench_channel_pool
+"""
+import asyncio
+import os
+import time
+
+from benchmarks.fake_dialogflow import FakeDialogflowServer
+
+LATENCY = 0.05
+MAX_STREAMS = 16
+CONCURRENCY = 128
+REQUESTS = 1280
+CONFIGS = [(1, 'round_robin'), (2, 'round_robin'), (4, 'round_robin'), (4, 'least_in_flight'), (8, 'least_in_flight')]
+
+
+async def run(dialogflow, concurrency, total):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await dialogflow.detect_intent_async(f"hello {i}", session_id=f"bench-{i % 64}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def main():
+    server = FakeDialogflowServer(latency=LATENCY, max_concurrent_streams=MAX_STREAMS)
+    os.environ["DIALOGFLOW_API_ENDPOINT"] = f"127.0.0.1:{server.start()}"
+    os.environ["DIALOGFLOW_INSECURE_CHANNEL"] = "1"
+
+    from integeration import Dialogflow
+    from integeration.channel_pool import ChannelPool
+
+    dialogflow = Dialogflow()
+    print(f"fake upstream: {LATENCY * 1000:.0f} ms latency, {MAX_STREAMS} streams per connection; "
+          f"{REQUESTS} calls at concurrency {CONCURRENCY}")
+    print(f"{'channels':>9} {'policy':>16} {'req/s':>9} {'connections':>12}")
+    agent = dialogflow.registry.default
+    for size, policy in CONFIGS:
+        agent.async_clients = ChannelPool(
+            f"{agent.name}/async", lambda: dialogflow._new_client(agent), size=size, policy=policy
+        )
+        await dialogflow.warm_up(timeout=5)
+        server.peers.clear()
+        rps = await run(dialogflow, CONCURRENCY, REQUESTS)
+        print(f"{size:>9} {policy:>16} {rps:>9.1f} {len(server.peers):>12}")
+        for client in agent.async_clients.clients:
+            await client.transport.close()
+    server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""
+Cold start: how long a fresh process takes to import the app and answer its
+first request against a local fake Dialogflow server.
+
+Each run is a fresh interpreter that measures:
+
+    import      `import main` (modules, singletons, import-time probing)
+    startup     FastAPI lifespan startup
+    first reply first POST /ai-agent/message returning 200
+    total       interpreter start to first reply, measured by the parent
+
+Run from the repo root:
+    python -m benchmarks.bench_cold_start [runs]
+"""
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RUNS = 5
+
+
+async def first_reply(app):
+    body = json.dumps({"message": "hello", "session_id": "cold-start"}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/ai-agent/message", "raw_path": b"/ai-agent/message",
+        "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 10000), "server": ("bench", 80),
+    }
+    status = {}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await app(scope, receive, send)
+    return status["code"]
+
+
+def child():
+    start = time.perf_counter()
+    from main import app
+    imported = time.perf_counter()
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            started = time.perf_counter()
+            code = await first_reply(app)
+            return started, time.perf_counter(), code
+
+    started, replied, code = asyncio.run(run())
+    print(json.dumps({
+        "import": imported - start,
+        "startup": started - imported,
+        "first reply": replied - started,
+        "status": code,
+    }), flush=True)
+    # Skip interpreter teardown (grpc shutdown can hang on exit)
+    os._exit(0)
+
+
+def main():
+    from benchmarks.fake_dialogflow import FakeDialogflowServer
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    server = FakeDialogflowServer(latency=0)
+    env = dict(os.environ, DIALOGFLOW_API_ENDPOINT=f"127.0.0.1:{server.start()}", DIALOGFLOW_INSECURE_CHANNEL="1")
+    results = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-W", "ignore", "-m", "benchmarks.bench_cold_start", "--child"],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        total = time.perf_counter() - start
+        result = json.loads(output.strip().splitlines()[-1])
+        if result.pop("status") != 200:
+            raise SystemExit(f"first request failed: {output}")
+        result["total"] = total
+        results.append(result)
+
+    print(f"{'stage':<12} {'median ms':>10} {'min ms':>8}")
+    for key in ("import", "startup", "first reply", "total"):
+        values = [r[key] * 1000 for r in results]
+        print(f"{key:<12} {statistics.median(values):>10.1f} {min(values):>8.1f}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        child()
+    else:
+        main()
@@ -0,0 +1,92 @@
+"""
+Tail latency with a degraded primary region, with and without hedging, and
+failover when the primary goes down.
+
+Two fake servers stand in for two regions of the same agent: the primary
+answers most calls in LATENCY but a TAIL_FRACTION of them in TAIL_LATENCY;
+the secondary always answers in LATENCY. With hedging on, a call the
+primary hasn't answered after HEDGE_MS is sent to the secondary too.
+
+Run from the repo root:
+    python -m benchmarks.bench_failover
+"""
+import asyncio
+import json
+import os
+import statistics
+import time
+
+import grpc
+
+from benchmarks.fake_dialogflow import FakeDialogflowServer
+
+LATENCY = 0.02
+TAIL_LATENCY = 1.0
+TAIL_FRACTION = 0.1
+HEDGE_MS = 100
+CONCURRENCY = 16
+REQUESTS = 400
+
+
+async def run(dialogflow, agent, total):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await dialogflow.detect_intent_async(f"hello {i}", session_id=f"bench-{i}", agent=agent)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(total)))
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "p99": latencies[int(len(latencies) * 0.99)],
+    }
+
+
+async def main():
+    primary = FakeDialogflowServer(latency=LATENCY, tail_latency=TAIL_LATENCY, tail_fraction=TAIL_FRACTION)
+    secondary = FakeDialogflowServer(latency=LATENCY)
+    os.environ["DIALOGFLOW_AGENTS"] = json.dumps({
+        "default": "primary",
+        "agents": {
+            "primary": {"api_endpoint": f"127.0.0.1:{primary.start()}", "secondary": "secondary"},
+            "secondary": {"api_endpoint": f"127.0.0.1:{secondary.start()}"},
+        },
+    })
+    os.environ["DIALOGFLOW_INSECURE_CHANNEL"] = "1"
+    os.environ["DIALOGFLOW_HEDGE_P95_MS"] = str(HEDGE_MS)
+
+    from integeration import Dialogflow, agents
+
+    dialogflow = Dialogflow()
+    agent = dialogflow.registry.default
+    await dialogflow.warm_up(timeout=5)
+    print(f"primary: {LATENCY * 1000:.0f} ms, {TAIL_FRACTION:.0%} of calls {TAIL_LATENCY * 1000:.0f} ms; "
+          f"secondary: {LATENCY * 1000:.0f} ms; hedge after {HEDGE_MS} ms")
+    print(f"{'hedging':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'secondary calls':>16}")
+    for hedging in (False, True):
+        agents.DIALOGFLOW_HEDGING = hedging
+        # Prime the primary's latency window so it reads as degraded
+        await run(dialogflow, agent, 50)
+        secondary.request_count = 0
+        result = await run(dialogflow, agent, REQUESTS)
+        print(f"{'on' if hedging else 'off':>8} {result['p50'] * 1000:>8.1f} {result['p95'] * 1000:>8.1f} "
+              f"{result['p99'] * 1000:>8.1f} {secondary.request_count:>16}")
+
+    agents.DIALOGFLOW_HEDGING = False
+    primary.fail_with = grpc.StatusCode.UNAVAILABLE
+    secondary.request_count = 0
+    result = await run(dialogflow, agent, REQUESTS // 4)
+    print(f"primary UNAVAILABLE: p50 {result['p50'] * 1000:.1f} ms, "
+          f"{secondary.request_count}/{REQUESTS // 4} calls answered by the secondary")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+    # The fake servers run on daemon threads; skip stopping them and the
+    # interpreter teardown (grpc shutdown can hang on exit)
+    os._exit(0)
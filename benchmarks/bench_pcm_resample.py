@@ -0,0 +1,113 @@
+"""
+In-process PCM WAV conversion to 16kHz mono LINEAR16: the NumPy fast path
+(integeration/pcm.py) against pydub's AudioSegment
+set_frame_rate/set_channels/set_sample_width chain.
+
+Fixtures are synthesized WAVs of SECONDS of speech-band tones in the layouts
+that make Dialogflow reject a WAV (stereo, 8/24-bit, float, rates outside
+8-48kHz) or that clients commonly send. Reports median latency and, as the
+tones are known, the error against an ideal 16kHz rendering: pydub resamples
+with audioop.ratecv (linear interpolation, no anti-aliasing filter).
+
+Run from the repo root:
+    python -m benchmarks.bench_pcm_resample
+"""
+import io
+import statistics
+import struct
+import time
+
+import numpy as np
+
+from integeration.audio_headers import parse_wav
+from integeration.pcm import convert_pcm
+
+ITERATIONS = 10
+SECONDS = 30
+TONES = (220, 440, 1800, 3100)
+# (name, sample rate, channels, bytes per sample, WAVE format tag)
+LAYOUTS = (
+    ("44k1_stereo_16", 44100, 2, 2, 1),
+    ("48k_stereo_24", 48000, 2, 3, 1),
+    ("48k_mono_float", 48000, 1, 4, 3),
+    ("96k_mono_16", 96000, 1, 2, 1),
+    ("8k_mono_8", 8000, 1, 1, 1),
+)
+
+
+def tones(rate, seconds=SECONDS):
+    t = np.arange(rate * seconds) / rate
+    return sum(np.sin(2 * np.pi * f * t) for f in TONES) / len(TONES) * 0.5
+
+
+def encode(signal, width, format_tag):
+    if format_tag == 3:
+        return signal.astype('<f4').tobytes()
+    if width == 1:
+        return np.round(signal * 127 + 128).astype(np.uint8).tobytes()
+    scaled = np.round(signal * (2 ** (8 * width - 1) - 1)).astype('<i4')
+    if width == 3:
+        return scaled.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    return scaled.astype(f'<i{width}').tobytes()
+
+
+def make_wav(rate, channels, width, format_tag):
+    data = encode(np.repeat(tones(rate), channels), width, format_tag)
+    block_align = channels * width
+    fmt = struct.pack('<HHIIHH', format_tag, channels, rate, rate * block_align, block_align, width * 8)
+    return b'RIFF' + struct.pack('<I', 36 + len(data)) + b'WAVEfmt ' + struct.pack('<I', 16) + fmt + b'data' + struct.pack('<I', len(data)) + data
+
+
+def convert_numpy(wav):
+    return convert_pcm(memoryview(wav), parse_wav(wav))
+
+
+def convert_pydub(wav):
+    from pydub import AudioSegment
+
+    segment = AudioSegment.from_wav(io.BytesIO(wav)).set_frame_rate(16000).set_channels(1).set_sample_width(2)
+    output = io.BytesIO()
+    segment.export(output, format="wav")
+    return output.getvalue()
+
+
+def error_db(converted):
+    """RMS error against the ideal 16kHz tones, in dB relative to the signal."""
+    info = parse_wav(converted)
+    samples = np.frombuffer(converted, dtype='<i2', count=info.frames, offset=info.data_offset) / 32767
+    ideal = tones(16000)[:len(samples)]
+    # Skip the filter's edges
+    trim = slice(1600, -1600)
+    error = np.sqrt(np.mean((samples[trim] - ideal[trim]) ** 2))
+    return 20 * np.log10(error / np.sqrt(np.mean(ideal[trim] ** 2)))
+
+
+def time_converter(convert, wav):
+    converted = convert(wav)
+    samples = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        convert(wav)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, error_db(converted)
+
+
+def main():
+    print("=" * 50)
+    print(f"PCM WAV -> 16kHz MONO LINEAR16, {SECONDS} s (median of {ITERATIONS})")
+    print("=" * 50)
+    print(f"{'fixture':<16} {'converter':<7} {'ms':>8} {'speedup':>8} {'error dB':>9}")
+    for name, rate, channels, width, format_tag in LAYOUTS:
+        wav = make_wav(rate, channels, width, format_tag)
+        numpy_ms, numpy_error = time_converter(convert_numpy, wav)
+        print(f"{name:<16} {'numpy':<7} {numpy_ms:>8.1f} {'':>8} {numpy_error:>9.1f}")
+        try:
+            pydub_ms, pydub_error = time_converter(convert_pydub, wav)
+        except Exception as e:
+            print(f"{name:<16} {'pydub':<7} {'error':>8}   {str(e).splitlines()[0]}")
+            continue
+        print(f"{name:<16} {'pydub':<7} {pydub_ms:>8.1f} {pydub_ms / numpy_ms:>7.1f}x {pydub_error:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
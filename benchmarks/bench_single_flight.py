@@ -0,0 +1,62 @@
+"""
+Upstream calls and latency for a burst of identical text queries, with and
+without single-flight coalescing (COALESCE_INTENTS).
+
+Every user sends the same opening message within BURST_SECONDS; the fake
+server matches every query to the "echo" intent.
+
+Run from the repo root:
+    python -m benchmarks.bench_single_flight
+"""
+import asyncio
+import os
+import random
+import statistics
+import time
+
+from benchmarks.fake_dialogflow import FakeDialogflowServer
+
+LATENCY = 0.2
+USERS = 500
+BURST_SECONDS = 1.0
+MESSAGE = "مرحبا"
+
+
+async def burst(dialogflow):
+    latencies = []
+
+    async def user(i):
+        await asyncio.sleep(random.uniform(0, BURST_SECONDS))
+        start = time.perf_counter()
+        await dialogflow.detect_intent_async(MESSAGE, session_id=f"user-{i}")
+        latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(user(i) for i in range(USERS)))
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+async def main():
+    server = FakeDialogflowServer(latency=LATENCY)
+    os.environ["DIALOGFLOW_API_ENDPOINT"] = f"127.0.0.1:{server.start()}"
+    os.environ["DIALOGFLOW_INSECURE_CHANNEL"] = "1"
+
+    from integeration import Dialogflow, dialogflow as dialogflow_module
+    from integeration.single_flight import SingleFlight
+
+    dialogflow = Dialogflow()
+    await dialogflow.warm_up(timeout=5)
+    print(f"{USERS} users within {BURST_SECONDS:g} s, upstream latency {LATENCY * 1000:.0f} ms")
+    print(f"{'coalescing':>10} {'upstream calls':>15} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, single_flight in (("off", None), ("on", SingleFlight(allowed_intents={"echo"}))):
+        dialogflow_module.single_flight = single_flight
+        server.request_count = 0
+        p50, p99 = await burst(dialogflow)
+        print(f"{label:>10} {server.request_count:>15} {p50 * 1000:>8.1f} {p99 * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+    # The fake server runs on a daemon thread; skip stopping it and the
+    # interpreter teardown (grpc shutdown can hang on exit)
+    os._exit(0)
@@ -0,0 +1,108 @@
+"""
+Payload size and end-to-end latency of voice notes per target encoding
+(AUDIO_TARGET_ENCODING): LINEAR16 WAV, FLAC and Ogg Opus.
+
+Each fixture is converted with the configured transcoder backend
+(AUDIO_TRANSCODE_MODE) and the result sent with detect_intent_async to a
+local fake Dialogflow server. Reports the payload size, DetectIntentRequest
+serialization time, median conversion and end-to-end latency, and how long
+the payload takes on an UPLINK_MBPS link: the fake server is on localhost,
+so the network saving only shows in that column.
+
+Uses the bench_transcode fixtures (benchmarks/fixtures/*.m4a|*.mp4, else
+synthesized tones, which flatter FLAC; add real voice notes for
+representative sizes).
+
+Run from the repo root:
+    python -m benchmarks.bench_target_encoding
+"""
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.fake_dialogflow import FakeDialogflowServer
+
+LATENCY = 0.05
+ITERATIONS = 10
+SERIALIZE_ITERATIONS = 100
+UPLINK_MBPS = 10
+ENCODINGS = ('linear16', 'flac', 'ogg_opus')
+
+
+def serialize_ms(dialogflow, converted):
+    from google.cloud.dialogflowcx_v3.types.session import DetectIntentRequest
+
+    request = dialogflow.build_detect_intent_request(dialogflow.build_audio_query_input(converted), "bench")
+    start = time.perf_counter()
+    for _ in range(SERIALIZE_ITERATIONS):
+        DetectIntentRequest.serialize(request)
+    return (time.perf_counter() - start) / SERIALIZE_ITERATIONS * 1000
+
+
+async def time_encoding(dialogflow, transcoder, audio_bytes, input_format, encoding):
+    # One untimed round so pool workers are spawned and warm
+    converted = await transcoder.convert(audio_bytes, input_format, encoding)
+    await dialogflow.detect_intent_async(None, session_id="bench-warm-up", audio_bytes=converted)
+    convert_samples = []
+    total_samples = []
+    for i in range(ITERATIONS):
+        start = time.perf_counter()
+        converted = await transcoder.convert(audio_bytes, input_format, encoding)
+        convert_samples.append(time.perf_counter() - start)
+        await dialogflow.detect_intent_async(None, session_id=f"bench-{i}", audio_bytes=converted)
+        total_samples.append(time.perf_counter() - start)
+    return len(converted), serialize_ms(dialogflow, converted), statistics.median(convert_samples) * 1000, statistics.median(total_samples) * 1000
+
+
+async def run_benchmark(fixtures):
+    from integeration import Dialogflow
+    from integeration.transcoders import get_transcoder
+
+    dialogflow = Dialogflow()
+    await dialogflow.warm_up(timeout=5)
+    transcoder = get_transcoder()
+    print(f"{transcoder.name} transcoder, upstream latency {LATENCY * 1000:.0f} ms, uplink {UPLINK_MBPS} Mbit/s")
+    print(f"{'fixture':<18} {'encoding':<9} {'KB':>8} {'vs wav':>7} {'serialize ms':>13} {'convert ms':>11} {'e2e ms':>8} {'uplink ms':>10}")
+    for fixture_name, audio_bytes in fixtures:
+        input_format = fixture_name.rsplit(".", 1)[1]
+        wav_size = None
+        for encoding in ENCODINGS:
+            try:
+                size, serialize, convert, total = await time_encoding(dialogflow, transcoder, audio_bytes, input_format, encoding)
+            except Exception as e:
+                print(f"{fixture_name:<18} {encoding:<9} {'error':>8}   {str(e).splitlines()[0]}")
+                continue
+            wav_size = wav_size or (size if encoding == 'linear16' else None)
+            ratio = f"{size / wav_size:.0%}" if wav_size else "-"
+            uplink = size * 8 / (UPLINK_MBPS * 1e6) * 1000
+            print(f"{fixture_name:<18} {encoding:<9} {size / 1024:>8.1f} {ratio:>7} {serialize:>13.3f} {convert:>11.1f} {total:>8.1f} {uplink:>10.1f}")
+    transcoder.close()
+
+
+def main():
+    server = FakeDialogflowServer(latency=LATENCY)
+    os.environ["DIALOGFLOW_API_ENDPOINT"] = f"127.0.0.1:{server.start()}"
+    os.environ["DIALOGFLOW_INSECURE_CHANNEL"] = "1"
+    # Imports integeration, so only once the environment is set
+    from benchmarks.bench_transcode import load_fixtures
+
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            fixtures = load_fixtures(directory)
+        except FileNotFoundError:
+            print("ffmpeg is required to synthesize fixtures (or add recordings to benchmarks/fixtures)")
+            return
+
+    print("=" * 50)
+    print(f"TARGET ENCODING BENCHMARK (median of {ITERATIONS})")
+    print("=" * 50)
+    asyncio.run(run_benchmark(fixtures))
+
+
+if __name__ == "__main__":
+    main()
+    # The fake server runs on a daemon thread; skip stopping it and the
+    # interpreter teardown (grpc shutdown can hang on exit)
+    os._exit(0)
@@ -0,0 +1,111 @@
+"""
+Benchmark the m4a/mp4 -> LINEAR16 WAV transcoder backends against each other
+through the pluggable Transcoder interface (integeration/transcoders.py):
+
+    pydub        AudioSegment decode + set_frame_rate/channels/sample_width
+    ffmpeg       ffmpeg subprocess with temporary input/output files
+    ffmpeg-pipe  async ffmpeg subprocess over stdin/stdout (pipe:0/pipe:1)
+    pyav         PyAV decoders kept warm in long-lived worker processes
+
+Reports median single-request latency and throughput with CONCURRENCY
+requests in flight. Uses benchmarks/fixtures/*.m4a|*.mp4 when present,
+otherwise synthesizes fixtures with ffmpeg (needs ffmpeg on PATH).
+
+Run from the repo root:
+    python -m benchmarks.bench_transcode
+"""
+import asyncio
+import glob
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+from integeration import audio
+from integeration.transcoders import TRANSCODER_NAMES, create_transcoder
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+ITERATIONS = 10
+CONCURRENCY = 8
+
+
+def synthesize_fixtures(directory):
+    """Generate speech-band test tones as m4a/mp4 (faststart and not) of a few lengths."""
+    paths = []
+    for seconds in (5, 30):
+        for ext, flags in (("m4a", ["-movflags", "+faststart"]), ("mp4", [])):
+            path = os.path.join(directory, f"tone_{seconds}s.{ext}")
+            subprocess.run(
+                ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                 "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={seconds}",
+                 "-ac", "2", "-c:a", "aac", *flags, path],
+                check=True,
+            )
+            paths.append(path)
+    return paths
+
+
+def load_fixtures(directory):
+    paths = sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.m4a")) + glob.glob(os.path.join(FIXTURE_DIR, "*.mp4")))
+    if not paths:
+        paths = synthesize_fixtures(directory)
+    fixtures = []
+    for path in paths:
+        with open(path, "rb") as f:
+            fixtures.append((os.path.basename(path), f.read()))
+    return fixtures
+
+
+async def time_backend(transcoder, audio_bytes, input_format):
+    # One untimed call so pool workers are spawned and warm
+    await transcoder.convert(audio_bytes, input_format)
+    samples = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        await transcoder.convert(audio_bytes, input_format)
+        samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(transcoder.convert(audio_bytes, input_format) for _ in range(CONCURRENCY)))
+    throughput = CONCURRENCY / (time.perf_counter() - start)
+    return statistics.median(samples) * 1000, throughput
+
+
+async def run_benchmark(fixtures):
+    transcoders = []
+    for name in TRANSCODER_NAMES:
+        try:
+            transcoders.append(create_transcoder(name))
+        except ValueError as e:
+            print(f"  skipping {name}: {e}")
+
+    print(f"{'fixture':<20} {'backend':<12} {'median ms':>10} {'conv/s':>8}")
+    for fixture_name, audio_bytes in fixtures:
+        input_format = fixture_name.rsplit(".", 1)[1]
+        for transcoder in transcoders:
+            try:
+                latency, throughput = await time_backend(transcoder, audio_bytes, input_format)
+                print(f"{fixture_name:<20} {transcoder.name:<12} {latency:>10.1f} {throughput:>8.1f}")
+            except Exception as e:
+                print(f"{fixture_name:<20} {transcoder.name:<12} {'error':>10}   {str(e).splitlines()[0]}")
+    for transcoder in transcoders:
+        transcoder.close()
+
+
+def main():
+    if not audio.ffmpeg_available():
+        print("ffmpeg is required for this benchmark")
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = load_fixtures(directory)
+
+    print("=" * 50)
+    print(f"TRANSCODER BENCHMARK (median of {ITERATIONS}, {CONCURRENCY} concurrent for throughput)")
+    print("=" * 50)
+    asyncio.run(run_benchmark(fixtures))
+
+
+if __name__ == "__main__":
+    main()
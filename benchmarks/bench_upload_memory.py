@@ -0,0 +1,121 @@
+"""
+Memory profile of a 1 MB voice note on the base64 JSON path
+(POST /ai-agent/message) versus the raw-body path (POST /ai-agent/message/audio).
+
+Each mode runs in a fresh subprocess against a local fake Dialogflow server.
+The body is delivered to the ASGI app in 64 KB chunks, as uvicorn would, and
+only server-side work is measured:
+
+    traced peak   tracemalloc peak of Python allocations while handling one request
+    RSS growth    growth of the process peak RSS (ru_maxrss) over that request
+
+Run from the repo root:
+    python -m benchmarks.bench_upload_memory
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+from benchmarks.fake_dialogflow import FakeDialogflowServer
+
+AUDIO_BYTES = 1024 * 1024
+CHUNK_BYTES = 64 * 1024
+MODES = ("json", "raw")
+
+
+def make_voice_note():
+    from integeration.audio import wav_header
+    pcm = random.Random(0).randbytes(AUDIO_BYTES - 44)
+    return wav_header(len(pcm)) + pcm
+
+
+def build_request(mode, audio):
+    """Return (path, content type, body chunks) as the server would receive them."""
+    if mode == "json":
+        body = json.dumps({"audio_data": base64.b64encode(audio).decode("ascii")}).encode()
+        path, content_type = "/ai-agent/message", "application/json"
+    else:
+        body = audio
+        path, content_type = "/ai-agent/message/audio", "audio/wav"
+    return path, content_type, [body[i:i + CHUNK_BYTES] for i in range(0, len(body), CHUNK_BYTES)]
+
+
+async def call_app(app, path, content_type, chunks):
+    chunks = list(chunks)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": b"session_id=bench",
+        "headers": [(b"content-type", content_type.encode()),
+                    (b"content-length", str(sum(len(c) for c in chunks)).encode())],
+        "client": ("127.0.0.1", 10000), "server": ("bench", 80),
+    }
+    status = {}
+
+    async def receive():
+        if chunks:
+            return {"type": "http.request", "body": chunks.pop(0), "more_body": bool(chunks)}
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await app(scope, receive, send)
+    return status["code"]
+
+
+def child(mode):
+    server = FakeDialogflowServer(latency=0)
+    os.environ["DIALOGFLOW_API_ENDPOINT"] = f"127.0.0.1:{server.start()}"
+    os.environ["DIALOGFLOW_INSECURE_CHANNEL"] = "1"
+    from main import app
+
+    async def run():
+        audio = make_voice_note()
+        # Warm up imports, channels and allocator arenas
+        for _ in range(2):
+            assert await call_app(app, *build_request(mode, audio)) == 200
+        path, content_type, chunks = build_request(mode, audio)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        assert await call_app(app, path, content_type, chunks) == 200
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        wire = sum(len(chunk) for chunk in chunks)
+        print(json.dumps({"traced_peak": peak - baseline, "rss_growth_kb": rss_after - rss_before, "wire": wire}))
+
+    asyncio.run(run())
+    # grpc can hang tearing down channels at interpreter shutdown; the result is already printed
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def main():
+    print("=" * 50)
+    print(f"UPLOAD MEMORY BENCHMARK ({AUDIO_BYTES // 1024} KB voice note)")
+    print("=" * 50)
+    print(f"{'path':<8} {'wire bytes':>12} {'traced peak MB':>16} {'RSS growth MB':>15}")
+    for mode in MODES:
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_upload_memory", "--child", mode],
+            capture_output=True, text=True, check=True
+        )
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{mode:<8} {stats['wire']:>12} {stats['traced_peak'] / 2**20:>16.2f} {stats['rss_growth_kb'] / 1024:>15.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        child(sys.argv[2])
+    else:
+        main()
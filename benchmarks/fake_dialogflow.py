@@ -0,0 +1,144 @@
+"""
+Local fake Dialogflow CX Sessions gRPC server for benchmarks.
+
+Replies to DetectIntent (and StreamingDetectIntent) after a fixed simulated latency so the client side
+(event loop, channels, audio pipeline) can be measured without calling Google.
+
+Point the app at it with:
+    DIALOGFLOW_API_ENDPOINT=127.0.0.1:<port> DIALOGFLOW_INSECURE_CHANNEL=1
+"""
+import asyncio
+import random
+import threading
+
+import grpc
+from google.cloud.dialogflowcx_v3.types.session import (
+    DetectIntentRequest, DetectIntentResponse, Match, QueryResult,
+    StreamingDetectIntentRequest, StreamingDetectIntentResponse, StreamingRecognitionResult,
+)
+from google.cloud.dialogflowcx_v3.types.intent import Intent
+from google.cloud.dialogflowcx_v3.types.response_message import ResponseMessage
+
+SERVICE_NAME = "google.cloud.dialogflow.cx.v3.Sessions"
+
+
+class FakeDialogflowServer:
+    def __init__(self, latency=0.05, port=0, max_concurrent_streams=None, tail_latency=None, tail_fraction=0.0):
+        self.latency = latency
+        # A tail_fraction of DetectIntent calls take tail_latency instead (a degraded region)
+        self.tail_latency = tail_latency
+        self.tail_fraction = tail_fraction
+        # grpc.StatusCode to fail DetectIntent with (an unavailable region), or None
+        self.fail_with = None
+        self.port = port
+        # Per-connection HTTP/2 stream limit, like the real endpoint's
+        self.max_concurrent_streams = max_concurrent_streams
+        self.request_count = 0
+        # Replies spoken for requests with an output_audio_config, and the fake speech bytes per reply
+        self.synthesized = 0
+        self.speech_bytes = 16000
+        # Streams end after this many audio bytes, like a single_utterance stream at end of speech (None: at the client's end)
+        self.utterance_bytes = None
+        # Client connections seen, to check that pooled channels really are separate
+        self.peers = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+
+    def _reply(self, text, intent="echo"):
+        message = ResponseMessage(text=ResponseMessage.Text(text=[text]))
+        match = Match(intent=Intent(display_name=intent), confidence=1.0)
+        return DetectIntentResponse(query_result=QueryResult(response_messages=[message], match=match))
+
+    def _spoken(self, response, request):
+        """The response with fake speech if the request asked for it."""
+        if request.output_audio_config.audio_encoding:
+            self.synthesized += 1
+            response.output_audio = b"\xff" * self.speech_bytes
+        return response
+
+    async def _detect_intent(self, request, context):
+        self.request_count += 1
+        self.peers.add(context.peer())
+        if self.fail_with is not None:
+            await context.abort(self.fail_with, "fake failure")
+        if self.tail_latency is not None and random.random() < self.tail_fraction:
+            await asyncio.sleep(self.tail_latency)
+        else:
+            await asyncio.sleep(self.latency)
+        if request.query_input.text.text:
+            return self._spoken(self._reply(f"echo: {request.query_input.text.text}"), request)
+        return self._spoken(self._reply(f"audio: {len(request.query_input.audio.audio)} bytes"), request)
+
+    async def _streaming_detect_intent(self, request_iterator, context):
+        self.request_count += 1
+        received = 0
+        chunks = 0
+        first = None
+        async for request in request_iterator:
+            if first is None:
+                first = request
+            received += len(request.query_input.audio.audio)
+            chunks += 1
+            if chunks % 10 == 0:
+                yield StreamingDetectIntentResponse(
+                    recognition_result=StreamingRecognitionResult(transcript=f"heard {received} bytes", is_final=False)
+                )
+            if self.utterance_bytes is not None and received >= self.utterance_bytes:
+                break
+        await asyncio.sleep(self.latency)
+        yield StreamingDetectIntentResponse(
+            detect_intent_response=self._spoken(self._reply(f"audio: {received} bytes"), first)
+        )
+
+    def _handlers(self):
+        return {
+            "DetectIntent": grpc.unary_unary_rpc_method_handler(
+                self._detect_intent,
+                request_deserializer=DetectIntentRequest.deserialize,
+                response_serializer=DetectIntentResponse.serialize,
+            ),
+            "StreamingDetectIntent": grpc.stream_stream_rpc_method_handler(
+                self._streaming_detect_intent,
+                request_deserializer=StreamingDetectIntentRequest.deserialize,
+                response_serializer=StreamingDetectIntentResponse.serialize,
+            ),
+        }
+
+    async def _serve(self):
+        options = []
+        if self.max_concurrent_streams:
+            options.append(("grpc.max_concurrent_streams", self.max_concurrent_streams))
+        self._server = grpc.aio.server(options=options)
+        self._server.add_generic_rpc_handlers(
+            (grpc.method_handlers_generic_handler(SERVICE_NAME, self._handlers()),)
+        )
+        self.port = self._server.add_insecure_port(f"127.0.0.1:{self.port}")
+        await self._server.start()
+        self._started.set()
+        await self._server.wait_for_termination()
+
+    def start(self):
+        """Run the server on its own event loop in a daemon thread and return the port."""
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._serve())
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self.port
+
+    def stop(self):
+        if self._loop and self._server:
+            asyncio.run_coroutine_threadsafe(self._server.stop(None), self._loop).result()
+
+
+if __name__ == "__main__":
+    import time
+
+    server = FakeDialogflowServer()
+    print(f"Fake Dialogflow listening on 127.0.0.1:{server.start()}")
+    while True:
+        time.sleep(3600)
@@ -1 +1,2 @@
-from . import ai_agent
\ No newline at end of file
+from . import ai_agent
+from . import batch
\ No newline at end of file
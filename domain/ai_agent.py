@@ -1,23 +1,118 @@
-from integeration import Dialogflow
-from pydantic import BaseModel
+from integeration import Dialogflow, ffmpeg_available
+from pydantic import BaseModel, ConfigDict, field_serializer
+import asyncio
+import base64
+import logging
+
+logger = logging.getLogger(__name__)
 
 dialogflow_instance = Dialogflow()
 
+
+async def warm_up(timeout=None):
+    """Probe ffmpeg and connect to Dialogflow ahead of the first request."""
+    try:
+        await asyncio.gather(
+            asyncio.to_thread(ffmpeg_available),
+            dialogflow_instance.warm_up(timeout)
+        )
+    except Exception as e:
+        logger.warning(f"Warm-up failed, clients will connect on first request: {str(e) or type(e).__name__}")
+        raise
+
 class AiAgentResponse(BaseModel):
+    # First text message, as before; all of them are in messages
     response: str
     session_id: str
+    messages: list[str] = []
+    # Custom payloads (rich cards, quick replies...), as sent by the agent
+    payloads: list[dict] = []
+    intent: str|None = None
+    confidence: float|None = None
+    # What Dialogflow heard, for audio turns
+    transcript: str|None = None
+    # The reply spoken by Dialogflow, when asked for (see integeration/speech.py)
+    output_audio: bytes|None = None
+
+    @field_serializer('output_audio', when_used='json-unless-none')
+    def _base64_audio(self, output_audio):
+        # Standard base64 in JSON; MessagePack (python mode) keeps the raw bytes
+        return base64.b64encode(output_audio).decode('ascii')
+
+    @classmethod
+    def from_reply(cls, reply, session_id):
+        """Build from an integeration Reply."""
+        return cls(
+            response=reply.text, session_id=session_id, messages=reply.messages, payloads=reply.payloads,
+            intent=reply.intent, confidence=reply.confidence, transcript=reply.transcript, output_audio=reply.output_audio
+        )
 
 class AiAgent(BaseModel):
+    # memoryview lets raw uploads reach Dialogflow without extra copies
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     message: str = ""
     session_id: str|None = None
-    audio_bytes: bytes|None = None
+    audio_bytes: bytes|memoryview|None = None
     audio_file_path: str|None = None
+    # Routing hints, see integeration/agents.py; unknown agent names raise ValueError
+    agent: str|None = None
+    tenant: str|None = None
+    language: str|None = None
+    # Ask for the reply as speech too; ignored unless OUTPUT_AUDIO=1
+    output_audio: bool = False
+
+    def _endpoint(self):
+        if not (self.agent or self.tenant or self.language):
+            # Later turns without hints stay on the agent their session started on
+            endpoint = dialogflow_instance.session_agent(self.session_id)
+            if endpoint is not None:
+                return endpoint
+        return dialogflow_instance.registry.resolve(agent=self.agent, tenant=self.tenant, language=self.language)
 
     def generate_response(self):
-        response, session_id = dialogflow_instance.detect_intent(
+        reply, session_id = dialogflow_instance.detect_intent(
+            query=self.message if self.message else None,
+            session_id=self.session_id,
+            audio_bytes=self.audio_bytes,
+            audio_file_path=self.audio_file_path,
+            agent=self._endpoint(),
+            output_audio=self.output_audio
+        )
+        return AiAgentResponse.from_reply(reply, session_id)
+
+    async def generate_response_async(self):
+        reply, session_id = await dialogflow_instance.detect_intent_async(
             query=self.message if self.message else None,
-            session_id=self.session_id, 
-            audio_bytes=self.audio_bytes, 
-            audio_file_path=self.audio_file_path
+            session_id=self.session_id,
+            audio_bytes=self.audio_bytes,
+            audio_file_path=self.audio_file_path,
+            agent=self._endpoint(),
+            output_audio=self.output_audio
         )
-        return AiAgentResponse(response=response, session_id=session_id)
\ No newline at end of file
+        return AiAgentResponse.from_reply(reply, session_id)
+
+    async def generate_streaming_response(self, audio_chunks):
+        reply, session_id = await dialogflow_instance.streaming_detect_intent_async(
+            audio_chunks,
+            session_id=self.session_id,
+            agent=self._endpoint(),
+            output_audio=self.output_audio
+        )
+        return AiAgentResponse.from_reply(reply, session_id)
+
+    async def generate_streaming_events(self, audio_chunks, audio_format=None, sample_rate_hertz=16000):
+        """Yield interim transcripts while audio streams in, then the reply (with its speech as bytes when asked for)."""
+        agent = self._endpoint()
+        async for response in dialogflow_instance.stream_detect_intent(
+            audio_chunks, self.session_id, audio_format=audio_format, sample_rate_hertz=sample_rate_hertz,
+            agent=agent, output_audio=self.output_audio
+        ):
+            if 'recognition_result' in response:
+                result = response.recognition_result
+                yield {"type": "interim", "transcript": result.transcript, "is_final": result.is_final}
+            elif 'detect_intent_response' in response:
+                reply = AiAgentResponse.from_reply(
+                    dialogflow_instance.extract_reply(response.detect_intent_response, agent.language_code), self.session_id
+                )
+                yield {"type": "reply", **reply.model_dump()}
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Run many conversation turns concurrently, e.g. to replay recorded
+conversations or drive regression and load tests.
+
+Turns of different sessions run in parallel up to a fan-out limit; turns of
+the same session run one after another in the order they were submitted, so
+Dialogflow sees each conversation exactly as it was recorded. Results are
+yielded as they complete.
+"""
+import asyncio
+import os
+import uuid
+from collections import deque
+
+from pydantic import BaseModel, ConfigDict
+
+from .ai_agent import AiAgent
+
+# Upper bound on concurrent Dialogflow calls per batch
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))
+# Items read ahead of their results, per unit of concurrency
+BATCH_READ_AHEAD = 4
+
+
+class BatchItem(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: int
+    id: str|None = None
+    message: str = ""
+    session_id: str|None = None
+    audio_bytes: bytes|None = None
+    agent: str|None = None
+    tenant: str|None = None
+    language: str|None = None
+    # Set when the item could not be parsed; reported without calling Dialogflow
+    error: Exception|None = None
+
+
+async def run_batch(items, concurrency=BATCH_MAX_CONCURRENCY):
+    """
+    Run the turns from an async iterable of BatchItem and yield
+    (item, outcome) pairs as they complete, where outcome is an
+    AiAgentResponse or the exception the turn raised.
+
+    Items without a session_id each get a new session. Items are read ahead
+    of their results only up to BATCH_READ_AHEAD * concurrency, so a large
+    NDJSON upload is not buffered while Dialogflow catches up. An error
+    raised by the items iterator itself is re-raised after the turns already
+    read have finished.
+    """
+    fan_out = asyncio.Semaphore(concurrency)
+    read_ahead = asyncio.Semaphore(BATCH_READ_AHEAD * concurrency)
+    results = asyncio.Queue()
+    sessions = {}
+    workers = set()
+    done = object()
+
+    async def run_session(session_id, pending):
+        while True:
+            item = pending[0]
+            if item.error is not None:
+                outcome = item.error
+            else:
+                async with fan_out:
+                    try:
+                        outcome = await AiAgent(
+                            message=item.message,
+                            session_id=session_id,
+                            audio_bytes=item.audio_bytes,
+                            agent=item.agent,
+                            tenant=item.tenant,
+                            language=item.language
+                        ).generate_response_async()
+                    except Exception as e:
+                        outcome = e
+            pending.popleft()
+            results.put_nowait((item, outcome))
+            if not pending:
+                # Later turns of this session start a new worker
+                del sessions[session_id]
+                return
+
+    async def feed():
+        try:
+            async for item in items:
+                await read_ahead.acquire()
+                session_id = item.session_id = item.session_id or str(uuid.uuid4())
+                if session_id in sessions:
+                    sessions[session_id].append(item)
+                    continue
+                pending = sessions[session_id] = deque([item])
+                worker = asyncio.create_task(run_session(session_id, pending))
+                workers.add(worker)
+                worker.add_done_callback(workers.discard)
+        except Exception as e:
+            error = e
+        else:
+            error = None
+        while workers:
+            await asyncio.wait(set(workers))
+        results.put_nowait(error if error is not None else done)
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            result = await results.get()
+            if result is done:
+                return
+            if isinstance(result, Exception):
+                raise result
+            read_ahead.release()
+            yield result
+    finally:
+        feeder.cancel()
+        for worker in list(workers):
+            worker.cancel()
@@ -1 +1,5 @@
-from .dialogflow import Dialogflow
\ No newline at end of file
+from .dialogflow import Dialogflow
+from .audio import AudioTooLong, NoSpeechDetected, UnsupportedAudioFormat, detect_audio_format, ffmpeg_available
+from .audio_pool import AudioPoolBusy
+from .resilience import CircuitOpen
+from .transcoders import shutdown_transcoders
@@ -0,0 +1,247 @@
+"""
+Registry of Dialogflow agent endpoints with latency-aware failover.
+
+By default there is one endpoint ("default") built from the module constants
+in dialogflow.py. DIALOGFLOW_AGENTS (a JSON string, or the path of a JSON
+file) configures more, e.g. the same agent replicated to a second region:
+
+    {
+        "default": "us",
+        "agents": {
+            "us": {"location": "us-central1", "agent_id": "...", "secondary": "eu"},
+            "eu": {"location": "europe-west1", "agent_id": "..."},
+            "en": {"location": "global", "agent_id": "...", "language_code": "en"}
+        },
+        "routes": {
+            "tenants": {"acme": "eu"},
+            "languages": {"en": "en"}
+        }
+    }
+
+Missing fields (project_id, agent_id, language_code, ...) fall back to the
+defaults and api_endpoint is derived from location. Each endpoint has its
+own channel pools and tracks its latency (EWMA and p95 over a sliding
+window). A call to an endpoint with a secondary fails over to it on
+UNAVAILABLE / DEADLINE_EXCEEDED / RESOURCE_EXHAUSTED, and with
+DIALOGFLOW_HEDGING=1 a call to an endpoint whose p95 has degraded past
+DIALOGFLOW_HEDGE_P95_MS is hedged: if it hasn't answered after that long,
+the secondary is called too and the first reply wins. Every call goes
+through the endpoint's circuit breaker (see resilience.py), and an open
+breaker fails over like an unavailable endpoint.
+
+Session state lives in each agent, so a turn answered by the secondary does
+not carry the primary's conversation context; secondaries should be
+replicas of the primary agent.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+from .channel_pool import ChannelPool
+from .metrics import DIALOGFLOW_ENDPOINT_EWMA, DIALOGFLOW_ENDPOINT_SECONDS, DIALOGFLOW_FAILOVERS, DIALOGFLOW_HEDGES
+from .resilience import TRANSIENT_ERRORS, BudgetExhausted, CircuitBreaker
+
+DIALOGFLOW_AGENTS = os.environ.get("DIALOGFLOW_AGENTS", "")
+DIALOGFLOW_HEDGING = os.environ.get("DIALOGFLOW_HEDGING") == "1"
+# p95 above which an endpoint counts as degraded; also the hedge delay
+DIALOGFLOW_HEDGE_P95_MS = float(os.environ.get("DIALOGFLOW_HEDGE_P95_MS", "1500"))
+# Calls kept per endpoint for the p95, and the EWMA smoothing factor
+LATENCY_WINDOW = 200
+LATENCY_EWMA_ALPHA = 0.1
+
+# Errors worth retrying on another region (CircuitOpen is a ServiceUnavailable)
+FAILOVER_ERRORS = TRANSIENT_ERRORS
+
+
+class LatencyTracker:
+    """EWMA and windowed p95 of an endpoint's call latency, in seconds."""
+    __slots__ = ('ewma', '_samples', '_p95')
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.ewma = None
+        self._samples = deque(maxlen=window)
+        self._p95 = None
+
+    def observe(self, seconds):
+        self.ewma = seconds if self.ewma is None else self.ewma + LATENCY_EWMA_ALPHA * (seconds - self.ewma)
+        self._samples.append(seconds)
+        self._p95 = None
+
+    def p95(self):
+        if self._p95 is None and self._samples:
+            ordered = sorted(self._samples)
+            self._p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return self._p95
+
+    def degraded(self, threshold=DIALOGFLOW_HEDGE_P95_MS / 1000):
+        p95 = self.p95()
+        return p95 is not None and p95 > threshold
+
+
+class AgentEndpoint:
+    def __init__(self, name, project_id, location, agent_id, language_code, api_endpoint, client_factory, secondary=None):
+        """
+        Args:
+            client_factory: client_factory(endpoint) builds one async
+                sessions client on a fresh channel to this endpoint
+            secondary: name of the endpoint to fail over / hedge to
+        """
+        self.name = name
+        self.project_id = project_id
+        self.location = location
+        self.agent_id = agent_id
+        self.language_code = language_code
+        self.api_endpoint = api_endpoint
+        self.secondary_name = secondary
+        self.secondary = None
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(name)
+        self.async_clients = ChannelPool(f"{name}/async", lambda: client_factory(self))
+        self._seconds = DIALOGFLOW_ENDPOINT_SECONDS.labels(name)
+        self._ewma = DIALOGFLOW_ENDPOINT_EWMA.labels(name)
+
+    def session_path(self, session_id):
+        return f"projects/{self.project_id}/locations/{self.location}/agents/{self.agent_id}/sessions/{session_id}"
+
+    def observe(self, seconds):
+        self.latency.observe(seconds)
+        self._seconds.observe(seconds)
+        self._ewma.set(self.latency.ewma)
+
+
+def default_api_endpoint(location):
+    if location == "global":
+        return "dialogflow.googleapis.com:443"
+    return f"{location}-dialogflow.googleapis.com:443"
+
+
+class AgentRegistry:
+    def __init__(self, endpoints, default, tenants=None, languages=None):
+        self.endpoints = endpoints
+        self.default = endpoints[default]
+        self.tenants = tenants or {}
+        self.languages = languages or {}
+        for endpoint in endpoints.values():
+            if endpoint.secondary_name is None:
+                continue
+            endpoint.secondary = self._get(endpoint.secondary_name, f"secondary of '{endpoint.name}'")
+            if endpoint.secondary.language_code != endpoint.language_code:
+                raise ValueError(f"Agent '{endpoint.name}' and its secondary must use the same language_code")
+        for name in (*self.tenants.values(), *self.languages.values()):
+            self._get(name, "route target")
+
+    def _get(self, name, role):
+        if name not in self.endpoints:
+            raise ValueError(f"Unknown agent '{name}' ({role}), expected one of: {', '.join(self.endpoints)}")
+        return self.endpoints[name]
+
+    @classmethod
+    def from_config(cls, config, defaults, client_factory):
+        """
+        Build the registry from a parsed DIALOGFLOW_AGENTS config. defaults
+        holds project_id, location, agent_id, language_code and api_endpoint
+        for the built-in "default" agent and for fields an agent leaves out.
+        """
+        agents = config.get("agents") or {"default": {}}
+        endpoints = {}
+        for name, options in agents.items():
+            fields = dict(defaults)
+            if "location" in options:
+                fields["api_endpoint"] = default_api_endpoint(options["location"])
+            fields.update(options)
+            endpoints[name] = AgentEndpoint(
+                name,
+                fields["project_id"],
+                fields["location"],
+                fields["agent_id"],
+                fields["language_code"],
+                fields["api_endpoint"],
+                client_factory,
+                secondary=fields.get("secondary"),
+            )
+        routes = config.get("routes", {})
+        default = config.get("default", next(iter(endpoints)))
+        return cls(endpoints, default, tenants=routes.get("tenants"), languages=routes.get("languages"))
+
+    @classmethod
+    def from_env(cls, defaults, client_factory):
+        config = {}
+        if DIALOGFLOW_AGENTS:
+            if DIALOGFLOW_AGENTS.lstrip().startswith("{"):
+                config = json.loads(DIALOGFLOW_AGENTS)
+            else:
+                with open(DIALOGFLOW_AGENTS) as f:
+                    config = json.load(f)
+        return cls.from_config(config, defaults, client_factory)
+
+    def resolve(self, agent=None, tenant=None, language=None):
+        """
+        Pick the endpoint for a request: an explicit agent name first, then
+        the tenant's route, then the language's (full tag, then primary
+        subtag), then the default.
+        """
+        if agent:
+            return self._get(agent, "requested")
+        if tenant and tenant in self.tenants:
+            return self.endpoints[self.tenants[tenant]]
+        if language:
+            language = language.lower()
+            name = self.languages.get(language) or self.languages.get(language.split("-")[0])
+            if name:
+                return self.endpoints[name]
+        return self.default
+
+
+async def _timed_call(endpoint, call):
+    with endpoint.breaker.guard():
+        start = time.perf_counter()
+        try:
+            with endpoint.async_clients.acquire() as client:
+                return await call(endpoint, client)
+        finally:
+            # Cancelled hedges are recorded too: their elapsed time is a lower bound
+            endpoint.observe(time.perf_counter() - start)
+
+
+async def call_async(endpoint, call):
+    """
+    Run `await call(endpoint, client)` on the endpoint, failing over to its
+    secondary on transient errors and hedging to it while degraded.
+    """
+    secondary = endpoint.secondary
+    if secondary is None:
+        return await _timed_call(endpoint, call)
+    if DIALOGFLOW_HEDGING and endpoint.latency.degraded():
+        return await _hedged_call(endpoint, secondary, call)
+    try:
+        return await _timed_call(endpoint, call)
+    except BudgetExhausted:
+        raise
+    except FAILOVER_ERRORS:
+        DIALOGFLOW_FAILOVERS.labels(endpoint.name, secondary.name).inc()
+        return await _timed_call(secondary, call)
+
+
+async def _hedged_call(endpoint, secondary, call):
+    primary = asyncio.ensure_future(_timed_call(endpoint, call))
+    done, _ = await asyncio.wait({primary}, timeout=DIALOGFLOW_HEDGE_P95_MS / 1000)
+    if done and primary.exception() is None:
+        DIALOGFLOW_HEDGES.labels(endpoint.name, 'not_needed').inc()
+        return primary.result()
+    if done and not isinstance(primary.exception(), FAILOVER_ERRORS):
+        raise primary.exception()
+    hedge = asyncio.ensure_future(_timed_call(secondary, call))
+    pending = {hedge} if done else {primary, hedge}
+    try:
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                if task.exception() is None:
+                    DIALOGFLOW_HEDGES.labels(endpoint.name, 'primary' if task is primary else 'secondary').inc()
+                    return task.result()
+        raise hedge.exception()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,327 @@
+"""
+Audio transcoding helpers.
+
+Kept at module level (not on the Dialogflow singleton) so the conversion can
+be shipped to worker processes by the transcode pool.
+"""
+import os
+import io
+import asyncio
+import functools
+import importlib.util
+import logging
+import subprocess
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# pydub is imported on first conversion; only check that it is installed here
+PYDUB_AVAILABLE = importlib.util.find_spec("pydub") is not None
+if not PYDUB_AVAILABLE:
+    logger.warning("pydub not available. Install with: pip install pydub")
+
+class UnsupportedAudioFormat(ValueError):
+    """The audio's magic bytes don't match any format we can handle."""
+
+
+class AudioTooLong(ValueError):
+    """The audio is longer than MAX_AUDIO_SECONDS."""
+
+
+class NoSpeechDetected(ValueError):
+    """The recording is silence (REJECT_SILENT_AUDIO)."""
+
+
+@functools.cache
+def ffmpeg_available():
+    """
+    Check if ffmpeg is installed and available. Probed on first call (the
+    app's warm-up does this off the event loop) and cached.
+    """
+    try:
+        result = subprocess.run(['ffmpeg', '-version'],
+                              capture_output=True,
+                              timeout=5)
+        available = result.returncode == 0
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        available = False
+    if not available:
+        logger.warning("ffmpeg not available. Audio conversion will not work.")
+        logger.warning("Install ffmpeg: brew install ffmpeg (Mac) or apt-get install ffmpeg (Linux)")
+    return available
+
+# Longest voice message accepted, in seconds (0 disables the check)
+MAX_AUDIO_SECONDS = float(os.environ.get("MAX_AUDIO_SECONDS", "60"))
+TARGET_SAMPLE_RATE = 16000
+FFMPEG_TIMEOUT = 30  # seconds
+
+# Encoding m4a/mp4 uploads are transcoded to: linear16 (WAV), flac or
+# ogg_opus. Dialogflow takes all three; FLAC is lossless at about half the
+# size of WAV, Opus a fraction of that.
+AUDIO_TARGET_ENCODING = os.environ.get("AUDIO_TARGET_ENCODING", "linear16")
+# Opus bitrate in bits/s; 24 kbps keeps 16kHz mono speech intelligible for recognition
+OPUS_BITRATE = int(os.environ.get("OPUS_BITRATE", "24000"))
+
+# Output arguments shared by the ffmpeg paths:
+# - Sample rate: 16000 Hz
+# - Channels: 1 (mono)
+# - Sample format: s16le (16-bit signed little-endian = LINEAR16)
+FFMPEG_PCM_ARGS = ['-ar', str(TARGET_SAMPLE_RATE), '-ac', '1', '-acodec', 'pcm_s16le']
+
+# Per target encoding: container (also its detect_audio_format name) and ffmpeg output arguments
+TARGET_ENCODINGS = {
+    'linear16': ('wav', FFMPEG_PCM_ARGS),
+    'flac': ('flac', ['-ar', str(TARGET_SAMPLE_RATE), '-ac', '1', '-sample_fmt', 's16', '-acodec', 'flac']),
+    'ogg_opus': ('ogg', ['-ar', str(TARGET_SAMPLE_RATE), '-ac', '1', '-acodec', 'libopus', '-b:a', str(OPUS_BITRATE), '-application', 'voip']),
+}
+if AUDIO_TARGET_ENCODING not in TARGET_ENCODINGS:
+    raise ValueError(f"Unknown AUDIO_TARGET_ENCODING '{AUDIO_TARGET_ENCODING}', expected one of: {', '.join(TARGET_ENCODINGS)}")
+TARGET_FORMAT = TARGET_ENCODINGS[AUDIO_TARGET_ENCODING][0]
+
+
+def wav_header(data_size, sample_rate=TARGET_SAMPLE_RATE, channels=1, sample_width=2):
+    """Build a canonical 44-byte PCM WAV header for data_size bytes of samples."""
+    byte_rate = sample_rate * channels * sample_width
+    return (
+        b'RIFF' + (36 + data_size).to_bytes(4, 'little') + b'WAVE'
+        + b'fmt ' + (16).to_bytes(4, 'little') + (1).to_bytes(2, 'little')
+        + channels.to_bytes(2, 'little') + sample_rate.to_bytes(4, 'little')
+        + byte_rate.to_bytes(4, 'little') + (channels * sample_width).to_bytes(2, 'little')
+        + (sample_width * 8).to_bytes(2, 'little')
+        + b'data' + data_size.to_bytes(4, 'little')
+    )
+
+
+def detect_audio_format(audio_bytes):
+    """
+    Detect audio format from bytes and return format name.
+
+    Returns:
+        str: Format name ('mp4', 'm4a', 'wav', 'flac', 'ogg', 'unknown')
+    """
+    if len(audio_bytes) < 12:
+        return 'unknown'
+
+    # Check file signatures (magic bytes)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Audio file header (first 12 bytes): %s", bytes(audio_bytes[:12]).hex())
+
+    # MP4/M4A files start with ftyp box (bytes 4-8)
+    if len(audio_bytes) >= 8 and audio_bytes[4:8] == b'ftyp':
+        # Check for M4A specific brand (bytes() so memoryviews work with `in`)
+        brands = bytes(audio_bytes[8:20])
+        if b'm4a' in brands or b'M4A' in brands:
+            return 'm4a'
+        return 'mp4'
+
+    # WAV files start with "RIFF" and contain "WAVE"
+    elif audio_bytes[0:4] == b'RIFF' and len(audio_bytes) >= 12 and audio_bytes[8:12] == b'WAVE':
+        return 'wav'
+
+    # FLAC files start with "fLaC"
+    elif audio_bytes[0:4] == b'fLaC':
+        return 'flac'
+
+    # OGG files start with "OggS"
+    elif audio_bytes[0:4] == b'OggS':
+        return 'ogg'
+
+    return 'unknown'
+
+
+def check_duration(length, rate):
+    """
+    Raise AudioTooLong if length at rate per second (bytes of PCM at the byte
+    rate, or frames at the sample rate) exceeds MAX_AUDIO_SECONDS.
+    """
+    if rate and MAX_AUDIO_SECONDS and length > rate * MAX_AUDIO_SECONDS:
+        raise AudioTooLong(f"Audio is longer than the {MAX_AUDIO_SECONDS:g} second limit")
+
+
+def convert_audio(audio_bytes, input_format='mp4', encoding=AUDIO_TARGET_ENCODING):
+    """
+    Convert audio bytes to 16kHz mono audio in a target encoding.
+    Tries pydub first (recommended), falls back to ffmpeg subprocess.
+
+    Args:
+        audio_bytes: Original audio data
+        input_format: Format of input audio ('mp4', 'm4a', 'flac', 'ogg', etc.)
+        encoding: Target encoding from TARGET_ENCODINGS
+
+    Returns:
+        bytes: LINEAR16 WAV, FLAC or Ogg Opus audio, 16kHz, mono
+    """
+    # Try pydub first (cleaner and more reliable)
+    if PYDUB_AVAILABLE:
+        try:
+            return convert_with_pydub(audio_bytes, input_format, encoding)
+        except Exception as e:
+            logger.warning(f"pydub conversion failed: {str(e)}, trying ffmpeg fallback...")
+            # Fall through to ffmpeg method
+
+    # Fallback to ffmpeg subprocess
+    if not ffmpeg_available():
+        error_msg = "Audio conversion requires either pydub (pip install pydub) or ffmpeg (brew install ffmpeg / apt-get install ffmpeg)"
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+    return convert_with_ffmpeg_tempfile(audio_bytes, input_format, encoding)
+
+
+def convert_with_pydub(audio_bytes, input_format='mp4', encoding='linear16'):
+    """Decode with pydub and re-export as 16kHz mono audio in the target encoding."""
+    logger.debug("Converting %s audio to %s using pydub (%d bytes)", input_format, encoding, len(audio_bytes))
+
+    from pydub import AudioSegment
+
+    # Create AudioSegment from bytes
+    audio = AudioSegment.from_file(io.BytesIO(audio_bytes), format=input_format)
+
+    # Convert to 16kHz, mono, 16-bit (LINEAR16 samples, also what FLAC/Opus encode from)
+    audio = audio.set_frame_rate(TARGET_SAMPLE_RATE).set_channels(1).set_sample_width(2)
+
+    # Export to bytes
+    output_buffer = io.BytesIO()
+    if encoding == 'ogg_opus':
+        audio.export(output_buffer, format="ogg", codec="libopus", bitrate=str(OPUS_BITRATE), parameters=["-application", "voip"])
+    else:
+        audio.export(output_buffer, format=TARGET_ENCODINGS[encoding][0])
+    converted = output_buffer.getvalue()
+
+    logger.debug("Converted audio using pydub: %d bytes, %s, 16kHz, mono", len(converted), encoding)
+    return converted
+
+
+def convert_with_ffmpeg_tempfile(audio_bytes, input_format='mp4', encoding='linear16'):
+    """Convert with an ffmpeg subprocess using temporary input/output files."""
+    output_format, output_args = TARGET_ENCODINGS[encoding]
+    # Create temporary files for input and output
+    input_ext = input_format if input_format != 'm4a' else 'm4a'
+    with tempfile.NamedTemporaryFile(suffix=f'.{input_ext}', delete=False) as input_file:
+        input_file.write(audio_bytes)
+        input_file_path = input_file.name
+
+    output_file_path = None
+    try:
+        # Create temporary output file
+        with tempfile.NamedTemporaryFile(suffix=f'.{output_format}', delete=False) as output_file:
+            output_file_path = output_file.name
+
+        logger.debug("Converting %s audio to %s using ffmpeg (%d bytes, output %s)", input_format, encoding, len(audio_bytes), output_file_path)
+
+        ffmpeg_cmd = [
+            'ffmpeg',
+            '-i', input_file_path,  # Input file
+            *output_args,
+            '-f', output_format,     # Format: WAV, FLAC or Ogg
+            '-y',                    # Overwrite output file
+            output_file_path         # Output file
+        ]
+
+        # Run ffmpeg (suppress output unless there's an error)
+        result = subprocess.run(
+            ffmpeg_cmd,
+            capture_output=True,
+            text=True,
+            timeout=FFMPEG_TIMEOUT
+        )
+
+        if result.returncode != 0:
+            error_msg = f"ffmpeg conversion failed: {result.stderr}"
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+
+        # Read the converted file
+        with open(output_file_path, 'rb') as f:
+            converted = f.read()
+
+        logger.debug("Converted audio using ffmpeg: %d bytes, %s, 16kHz, mono", len(converted), encoding)
+        return converted
+
+    except subprocess.TimeoutExpired:
+        logger.error("ffmpeg conversion timed out")
+        raise ValueError("Audio conversion timed out")
+    except Exception as e:
+        logger.error(f"Error converting audio: {str(e)}")
+        raise ValueError(f"Failed to convert audio from {input_format} to {encoding}: {str(e)}")
+    finally:
+        # Clean up temporary files
+        try:
+            if os.path.exists(input_file_path):
+                os.unlink(input_file_path)
+            if output_file_path and os.path.exists(output_file_path):
+                os.unlink(output_file_path)
+        except Exception as e:
+            logger.warning(f"Error cleaning up temp files: {str(e)}")
+
+
+def mp4_is_streamable(audio_bytes):
+    """
+    True if the MP4/M4A 'moov' box comes before 'mdat' (faststart), i.e. the
+    file can be demuxed from a non-seekable pipe. Walks top-level boxes only.
+    """
+    offset = 0
+    total = len(audio_bytes)
+    while offset + 8 <= total:
+        size = int.from_bytes(audio_bytes[offset:offset + 4], 'big')
+        box_type = bytes(audio_bytes[offset + 4:offset + 8])
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if size == 1:
+            if offset + 16 > total:
+                break
+            size = int.from_bytes(audio_bytes[offset + 8:offset + 16], 'big')
+        elif size == 0:
+            break
+        if size < 8:
+            break
+        offset += size
+    return False
+
+
+async def convert_with_ffmpeg_pipe(audio_bytes, input_format='mp4', encoding='linear16'):
+    """
+    Convert with ffmpeg over stdin/stdout pipes, without touching the disk.
+
+    For LINEAR16 ffmpeg emits raw s16le PCM on pipe:1 (a WAV written to a
+    pipe can't have its sizes patched in) and the header is prepended here;
+    FLAC and Ogg are written as is (FLAC then lacks its sample count). MP4/M4A
+    files with the moov atom at the end can't be demuxed from a non-seekable
+    pipe; those fall back to the temp-file path.
+    """
+    if not ffmpeg_available():
+        raise ValueError("Audio conversion requires ffmpeg (brew install ffmpeg / apt-get install ffmpeg)")
+    if input_format in ('mp4', 'm4a') and not mp4_is_streamable(audio_bytes):
+        return await asyncio.to_thread(convert_with_ffmpeg_tempfile, audio_bytes, input_format, encoding)
+
+    output_format, output_args = TARGET_ENCODINGS[encoding]
+    ffmpeg_cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-i', 'pipe:0',
+        *output_args,
+        '-f', 's16le' if encoding == 'linear16' else output_format,
+        'pipe:1'
+    ]
+    process = await asyncio.create_subprocess_exec(
+        *ffmpeg_cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        output, stderr = await asyncio.wait_for(process.communicate(audio_bytes), timeout=FFMPEG_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        logger.error("ffmpeg conversion timed out")
+        raise ValueError("Audio conversion timed out")
+
+    if process.returncode != 0 or not output:
+        logger.warning(f"ffmpeg pipe conversion failed ({stderr.decode(errors='replace').strip()}), retrying via temp files...")
+        return await asyncio.to_thread(convert_with_ffmpeg_tempfile, audio_bytes, input_format, encoding)
+
+    logger.debug("Converted audio using ffmpeg pipes: %d bytes, %s, 16kHz, mono", len(output), encoding)
+    if encoding == 'linear16':
+        return wav_header(len(output)) + output
+    return output
@@ -0,0 +1,203 @@
+"""
+Header parsers for the audio formats Dialogflow can take as is.
+
+Each parser reads only the container headers, over bytes or a memoryview
+without copying the samples, and returns an AudioInfo:
+
+    parse_wav    RIFF/WAVE, walking the chunks (LIST, JUNK, fact... may come
+                 before or between fmt and data); PCM, float, A-law, mu-law
+                 and WAVE_FORMAT_EXTENSIBLE
+    parse_flac   the STREAMINFO block
+    parse_ogg    the identification header on the first Ogg page (Opus or
+                 Vorbis), and the stream length from the last page
+
+conversion_reason() then tells whether Dialogflow takes the audio without
+conversion: mono 16-bit PCM, A-law or mu-law at 8-48kHz, 16/24-bit FLAC, or
+Opus. Anything else (stereo, 8-bit or float PCM, Vorbis, ADPCM...) goes
+through the transcoder.
+"""
+from .audio import UnsupportedAudioFormat
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_ALAW = 0x0006
+WAVE_FORMAT_MULAW = 0x0007
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+WAV_CODECS = {WAVE_FORMAT_PCM: 'pcm', WAVE_FORMAT_IEEE_FLOAT: 'float', WAVE_FORMAT_ALAW: 'alaw', WAVE_FORMAT_MULAW: 'mulaw'}
+# Sizes the chunk header fields use for "unknown" in WAVs written to a pipe
+WAV_UNKNOWN_SIZES = (0, 0xFFFFFFFF)
+
+# Rates Dialogflow accepts for OGG_OPUS; Opus decodes to any of them
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+# Opus granule positions always count 48kHz samples, whatever the input rate
+OPUS_GRANULE_RATE = 48000
+# Largest possible Ogg page: header, 255 lacing values and 255 * 255 bytes of data
+OGG_MAX_PAGE = 27 + 255 + 255 * 255
+OGG_UNKNOWN_GRANULE = 2 ** 64 - 1
+
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+# Highest rate a WAV header may declare: the resampler's filter grows with the rate
+MAX_WAV_SAMPLE_RATE = 192000
+
+
+class AudioInfo:
+    """
+    What an audio file's headers say: codec ('pcm', 'float', 'alaw',
+    'mulaw', 'flac', 'opus', 'vorbis' or 'wav_0x....' for other WAVE format
+    tags), sample rate to declare, channel count, bits per sample, length in
+    frames (0 when unknown) and, for WAV, where the samples start and the
+    bytes per frame.
+    """
+    __slots__ = ('codec', 'sample_rate', 'channels', 'bits_per_sample', 'frames', 'data_offset', 'block_align')
+
+    def __init__(self, codec, sample_rate, channels, bits_per_sample, frames=0, data_offset=0, block_align=0):
+        self.codec = codec
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bits_per_sample = bits_per_sample
+        self.frames = frames
+        self.data_offset = data_offset
+        self.block_align = block_align
+
+    @property
+    def byte_rate(self):
+        """Bytes per second of WAV samples, 0 for compressed audio."""
+        return self.sample_rate * self.block_align
+
+    @property
+    def encoding(self):
+        """Dialogflow encoding name (a STREAM_AUDIO_FORMATS key) for the codec, or None."""
+        if self.codec == 'pcm':
+            return 'linear16' if self.bits_per_sample == 16 else None
+        return {'alaw': 'alaw', 'mulaw': 'mulaw', 'flac': 'flac', 'opus': 'ogg_opus'}.get(self.codec)
+
+    def __repr__(self):
+        return (f"AudioInfo({self.codec}, {self.sample_rate} Hz, {self.channels} ch, {self.bits_per_sample} bit, "
+                f"{self.frames} frames)")
+
+
+def parse_wav(data):
+    """Walk the RIFF chunks up to 'data'; raises UnsupportedAudioFormat on a malformed header."""
+    if len(data) < 12 or data[0:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise UnsupportedAudioFormat("Not a RIFF/WAVE file")
+    info = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = bytes(data[offset:offset + 4])
+        chunk_size = int.from_bytes(data[offset + 4:offset + 8], 'little')
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            if chunk_size < 16 or body + 16 > len(data):
+                raise UnsupportedAudioFormat("Truncated WAV fmt chunk")
+            info = _parse_wav_fmt(data[body:body + min(chunk_size, 40)])
+        elif chunk_id == b'data':
+            if info is None:
+                raise UnsupportedAudioFormat("WAV data chunk comes before its fmt chunk")
+            available = len(data) - body
+            # Streamed WAVs leave the size unset; truncated uploads fall short of it
+            data_size = available if chunk_size in WAV_UNKNOWN_SIZES else min(chunk_size, available)
+            info.data_offset = body
+            info.frames = data_size // info.block_align
+            return info
+        offset = body + chunk_size + (chunk_size & 1)
+    raise UnsupportedAudioFormat("WAV header has no data chunk" if info else "WAV header has no fmt chunk")
+
+
+def wav_data_offset(data):
+    """Where the samples of a RIFF/WAVE file start, or None while `data` ends before its data chunk header."""
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_size = int.from_bytes(data[offset + 4:offset + 8], 'little')
+        if data[offset:offset + 4] == b'data':
+            return offset + 8
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _parse_wav_fmt(fmt):
+    format_tag = int.from_bytes(fmt[0:2], 'little')
+    channels = int.from_bytes(fmt[2:4], 'little')
+    sample_rate = int.from_bytes(fmt[4:8], 'little')
+    block_align = int.from_bytes(fmt[12:14], 'little')
+    bits_per_sample = int.from_bytes(fmt[14:16], 'little')
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        # The real format tag leads the sub-format GUID
+        format_tag = int.from_bytes(fmt[24:26], 'little')
+    if not channels or not block_align:
+        raise UnsupportedAudioFormat("WAV fmt chunk has no channels")
+    if not 0 < sample_rate <= MAX_WAV_SAMPLE_RATE:
+        raise UnsupportedAudioFormat(f"Unsupported WAV sample rate: {sample_rate} Hz")
+    codec = WAV_CODECS.get(format_tag, f"wav_0x{format_tag:04x}")
+    return AudioInfo(codec, sample_rate, channels, bits_per_sample, block_align=block_align)
+
+
+def parse_flac(data):
+    """Read STREAMINFO, which the FLAC format requires to be the first metadata block."""
+    if len(data) < 42 or data[0:4] != b'fLaC' or data[4] & 0x7F != 0:
+        raise UnsupportedAudioFormat("FLAC stream has no STREAMINFO block")
+    # After the 10 bytes of block/frame sizes: 20-bit sample rate, 3-bit channels - 1,
+    # 5-bit bits per sample - 1, 36-bit total samples (0 when the encoder couldn't seek back)
+    fields = int.from_bytes(data[18:26], 'big')
+    return AudioInfo(
+        'flac', fields >> 44, ((fields >> 41) & 0x7) + 1, ((fields >> 36) & 0x1F) + 1, frames=fields & (2 ** 36 - 1)
+    )
+
+
+def parse_ogg(data):
+    """Read the codec identification header on the first page, and the length from the last one."""
+    if len(data) < 28 or data[0:4] != b'OggS':
+        raise UnsupportedAudioFormat("Not an Ogg stream")
+    # The first page holds only the identification header, after the 27-byte page header and lacing values
+    body = 27 + data[26]
+    head = bytes(data[body:body + 19])
+    if head[:8] == b'OpusHead' and len(head) == 19:
+        channels = head[9]
+        pre_skip = int.from_bytes(head[10:12], 'little')
+        input_rate = int.from_bytes(head[12:16], 'little')
+        sample_rate = input_rate if input_rate in OPUS_SAMPLE_RATES else OPUS_GRANULE_RATE
+        granule = _last_granule(data)
+        frames = max(granule - pre_skip, 0) * sample_rate // OPUS_GRANULE_RATE if granule else 0
+        return AudioInfo('opus', sample_rate, channels, 16, frames=frames)
+    if head[:7] == b'\x01vorbis' and len(head) >= 16:
+        sample_rate = int.from_bytes(head[12:16], 'little')
+        return AudioInfo('vorbis', sample_rate, head[11], 16, frames=_last_granule(data))
+    return AudioInfo('unknown', 0, 0, 0)
+
+
+def _last_granule(data):
+    """Granule position of the last complete Ogg page header, or 0."""
+    tail = bytes(data[-OGG_MAX_PAGE:])
+    page = tail.rfind(b'OggS')
+    while page >= 0:
+        # Skip "OggS" bytes inside packet data: a page header has version 0
+        if page + 14 <= len(tail) and tail[page + 4] == 0:
+            granule = int.from_bytes(tail[page + 6:page + 14], 'little')
+            return 0 if granule == OGG_UNKNOWN_GRANULE else granule
+        page = tail.rfind(b'OggS', 0, page)
+    return 0
+
+
+HEADER_PARSERS = {'wav': parse_wav, 'flac': parse_flac, 'ogg': parse_ogg}
+
+
+def parse_audio_header(data, audio_format):
+    """AudioInfo for a detect_audio_format name, or None for formats without a parser."""
+    parser = HEADER_PARSERS.get(audio_format)
+    return parser(data) if parser is not None else None
+
+
+def conversion_reason(info):
+    """
+    Why Dialogflow can't take the audio as is ('codec', 'bit_depth',
+    'channels' or 'sample_rate'), or None to pass it through unconverted.
+    """
+    if info.encoding is None:
+        return 'bit_depth' if info.codec == 'pcm' else 'codec'
+    if info.channels != 1:
+        return 'channels'
+    if info.codec == 'flac' and info.bits_per_sample not in (16, 24):
+        return 'bit_depth'
+    if info.codec != 'opus' and not MIN_SAMPLE_RATE <= info.sample_rate <= MAX_SAMPLE_RATE:
+        return 'sample_rate'
+    return None
@@ -0,0 +1,101 @@
+"""
+Bounded worker pool for CPU-heavy audio transcoding.
+
+Conversions run off the request path in a process pool (pydub decode and
+resample) or a thread pool (when only the ffmpeg subprocess is available).
+At most AUDIO_POOL_WORKERS jobs run and AUDIO_POOL_QUEUE_SIZE wait; anything
+beyond that is rejected immediately with AudioPoolBusy so a burst of voice
+notes cannot pile up audio buffers in memory or starve text requests.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .audio import PYDUB_AVAILABLE
+
+logger = logging.getLogger(__name__)
+
+AUDIO_POOL_WORKERS = int(os.environ.get("AUDIO_POOL_WORKERS", "2"))
+AUDIO_POOL_QUEUE_SIZE = int(os.environ.get("AUDIO_POOL_QUEUE_SIZE", "8"))
+# "process" or "thread"; defaults to processes when pydub does the decoding
+AUDIO_POOL_KIND = os.environ.get("AUDIO_POOL_KIND", "process" if PYDUB_AVAILABLE else "thread")
+AUDIO_POOL_RETRY_AFTER = int(os.environ.get("AUDIO_POOL_RETRY_AFTER", "2"))
+
+
+class AudioPoolBusy(Exception):
+    """Raised when the transcode pool and its queue are full."""
+
+    def __init__(self, retry_after=AUDIO_POOL_RETRY_AFTER):
+        super().__init__("Audio conversion queue is full, retry later")
+        self.retry_after = retry_after
+
+
+class AudioPool:
+    def __init__(self, workers=AUDIO_POOL_WORKERS, queue_size=AUDIO_POOL_QUEUE_SIZE, kind=AUDIO_POOL_KIND, initializer=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.kind = kind
+        self.initializer = initializer
+        self.pending = 0
+        self._executor = None
+        self._semaphore = None
+
+    @property
+    def capacity(self):
+        return self.workers + self.queue_size
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn, not fork: the parent holds gRPC threads that must not be forked
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self.initializer
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="audio", initializer=self.initializer
+                )
+            logger.info(f"Started {self.kind} audio pool: {self.workers} workers, queue {self.queue_size}")
+        return self._executor
+
+    @asynccontextmanager
+    async def _reserve(self):
+        """Queue for one of the `workers` running jobs, or raise AudioPoolBusy if the queue is full."""
+        if self.pending >= self.capacity:
+            raise AudioPoolBusy()
+        self.pending += 1
+        try:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.workers)
+            async with self._semaphore:
+                yield
+        finally:
+            self.pending -= 1
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool, or raise AudioPoolBusy if it is saturated."""
+        async with self._reserve():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Reserve a pool slot for work that runs outside the executor (async
+        ffmpeg subprocesses, in-process PCM conversion). It counts against
+        the same workers and queue as run().
+        """
+        async with self._reserve():
+            yield
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+audio_pool = AudioPool()
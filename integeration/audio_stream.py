@@ -0,0 +1,129 @@
+"""
+Helpers for streaming audio to Dialogflow while it is still being received.
+
+Chunks are async iterables of bytes. Compressed m4a/mp4 is transcoded
+incrementally through an ffmpeg pipe so PCM can be forwarded before the
+upload has finished.
+"""
+import asyncio
+import logging
+
+from .audio import FFMPEG_PCM_ARGS, check_duration, ffmpeg_available
+
+logger = logging.getLogger(__name__)
+
+# ~100 ms of 16kHz 16-bit mono PCM, the chunk size Dialogflow recommends
+STREAM_CHUNK_BYTES = 3200
+
+
+class StreamTranscodeFailed(Exception):
+    """ffmpeg could not decode the stream from a pipe before producing any audio."""
+
+
+async def read_head(chunks, size):
+    """
+    Read at least `size` bytes from the start of an async chunk iterator.
+
+    Returns:
+        tuple: (head bytes, iterator over the remaining chunks)
+    """
+    iterator = chunks.__aiter__()
+    head = bytearray()
+    while len(head) < size:
+        try:
+            head += await iterator.__anext__()
+        except StopAsyncIteration:
+            break
+    return bytes(head), iterator
+
+
+async def prepend(head, chunks):
+    if head:
+        yield head
+    async for chunk in chunks:
+        yield chunk
+
+
+async def rechunk(chunks, size=STREAM_CHUNK_BYTES):
+    """Split large chunks so each streaming request carries at most `size` bytes."""
+    async for chunk in chunks:
+        for offset in range(0, len(chunk), size):
+            yield chunk[offset:offset + size]
+
+
+async def limit_duration(chunks, byte_rate):
+    """Pass chunks through, raising AudioTooLong once byte_rate * MAX_AUDIO_SECONDS is crossed."""
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        check_duration(received, byte_rate)
+        yield chunk
+
+
+async def stream_with_ffmpeg_pipe(chunks, chunk_size=STREAM_CHUNK_BYTES):
+    """
+    Transcode a stream of compressed audio chunks to raw s16le 16kHz mono PCM,
+    yielding PCM as ffmpeg produces it.
+
+    Raises StreamTranscodeFailed if ffmpeg exits without output (e.g. an MP4
+    whose moov box is at the end and can't be read from a pipe); the chunks
+    consumed so far are available on the exception as `received`. They are
+    only kept until ffmpeg's first output: after that no fallback is needed.
+    """
+    if not ffmpeg_available():
+        raise ValueError("Streaming audio conversion requires ffmpeg (brew install ffmpeg / apt-get install ffmpeg)")
+
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-i', 'pipe:0',
+        *FFMPEG_PCM_ARGS,
+        '-f', 's16le',
+        'pipe:1',
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    # Chunks sent before ffmpeg's first output, for the fallback; None once output flows
+    received = []
+
+    async def feed():
+        try:
+            async for chunk in chunks:
+                if received is not None:
+                    received.append(chunk)
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg gave up; keep draining so a fallback sees the whole upload
+            async for chunk in chunks:
+                if received is not None:
+                    received.append(chunk)
+        finally:
+            if not process.stdin.is_closing():
+                process.stdin.close()
+
+    feeder = asyncio.create_task(feed())
+    produced = 0
+    try:
+        while True:
+            pcm = await process.stdout.read(chunk_size)
+            if not pcm:
+                break
+            produced += len(pcm)
+            received = None
+            yield pcm
+        await feeder
+        stderr = await process.stderr.read()
+        if await process.wait() != 0:
+            message = stderr.decode(errors='replace').strip()
+            if not produced:
+                error = StreamTranscodeFailed(message)
+                error.received = received
+                raise error
+            raise ValueError(f"ffmpeg streaming conversion failed: {message}")
+    finally:
+        if not feeder.done():
+            feeder.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
@@ -0,0 +1,99 @@
+"""
+Pool of Dialogflow clients, each on its own gRPC channel.
+
+One channel is one HTTP/2 connection, and a busy process multiplexing every
+call over it runs into the server's max-concurrent-streams limit and
+head-of-line blocking. The pool spreads calls over DIALOGFLOW_CHANNELS
+channels, picking one per call either round-robin or by fewest calls in
+flight (DIALOGFLOW_CHANNEL_POLICY), and keeps idle connections alive with
+HTTP/2 keepalive pings.
+
+Clients are created on first use; `with pool.acquire() as client:` holds a
+channel for the duration of one call (or one streaming call).
+"""
+import itertools
+import os
+import threading
+from contextlib import contextmanager
+
+from .metrics import DIALOGFLOW_CHANNEL_CALLS, DIALOGFLOW_CHANNEL_IN_FLIGHT
+
+DIALOGFLOW_CHANNELS = int(os.environ.get("DIALOGFLOW_CHANNELS", "4"))
+# "least_in_flight" or "round_robin"
+DIALOGFLOW_CHANNEL_POLICY = os.environ.get("DIALOGFLOW_CHANNEL_POLICY", "least_in_flight")
+DIALOGFLOW_KEEPALIVE_MS = int(os.environ.get("DIALOGFLOW_KEEPALIVE_MS", "30000"))
+DIALOGFLOW_KEEPALIVE_TIMEOUT_MS = int(os.environ.get("DIALOGFLOW_KEEPALIVE_TIMEOUT_MS", "10000"))
+
+CHANNEL_POLICIES = ('least_in_flight', 'round_robin')
+
+
+def channel_options():
+    """gRPC channel arguments shared by every pooled channel."""
+    return [
+        # Without a local subchannel pool, channels with equal arguments share one connection
+        ('grpc.use_local_subchannel_pool', 1),
+        ('grpc.keepalive_time_ms', DIALOGFLOW_KEEPALIVE_MS),
+        ('grpc.keepalive_timeout_ms', DIALOGFLOW_KEEPALIVE_TIMEOUT_MS),
+        ('grpc.keepalive_permit_without_calls', 1),
+        ('grpc.http2.max_pings_without_data', 0),
+    ]
+
+
+class ChannelPool:
+    def __init__(self, name, factory, size=DIALOGFLOW_CHANNELS, policy=DIALOGFLOW_CHANNEL_POLICY):
+        """
+        Args:
+            name: label for the per-channel metrics (e.g. 'default/async')
+            factory: callable building one client on a fresh channel
+            size: number of channels
+            policy: 'least_in_flight' or 'round_robin'
+        """
+        if policy not in CHANNEL_POLICIES:
+            raise ValueError(f"Unknown channel policy '{policy}', expected one of: {', '.join(CHANNEL_POLICIES)}")
+        self.name = name
+        self.size = max(1, size)
+        self.policy = policy
+        self._factory = factory
+        self._clients = None
+        self.in_flight = [0] * self.size
+        self._next = itertools.count()
+        # Guards lazy client creation
+        self._lock = threading.Lock()
+        self._in_flight_gauges = [DIALOGFLOW_CHANNEL_IN_FLIGHT.labels(name, str(i)) for i in range(self.size)]
+        self._call_counters = [DIALOGFLOW_CHANNEL_CALLS.labels(name, str(i)) for i in range(self.size)]
+
+    @property
+    def clients(self):
+        if self._clients is None:
+            with self._lock:
+                if self._clients is None:
+                    self._clients = [self._factory() for _ in range(self.size)]
+        return self._clients
+
+    def _pick(self):
+        start = next(self._next) % self.size
+        if self.policy == 'round_robin':
+            return start
+        # Fewest calls in flight, scanning from a rotating start so ties spread out
+        best = start
+        for offset in range(1, self.size):
+            index = (start + offset) % self.size
+            if self.in_flight[index] < self.in_flight[best]:
+                best = index
+        return best
+
+    @contextmanager
+    def acquire(self):
+        """Hold the least busy (or next) client for one call."""
+        clients = self.clients
+        with self._lock:
+            index = self._pick()
+            self.in_flight[index] += 1
+        self._in_flight_gauges[index].inc()
+        self._call_counters[index].inc()
+        try:
+            yield clients[index]
+        finally:
+            with self._lock:
+                self.in_flight[index] -= 1
+            self._in_flight_gauges[index].dec()
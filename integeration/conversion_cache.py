@@ -0,0 +1,213 @@
+"""
+Content-addressed cache of converted audio.
+
+Resent uploads (client retries, QA replays) skip the m4a/mp4 transcode: the
+converted audio is kept under a hash of the input bytes, its format and the
+target encoding and parameters. Hashing uses xxh3-128 when
+xxhash is installed, else BLAKE2b; either way it costs a small fraction of
+a transcode.
+
+The in-memory tier is an LRU bounded by CONVERSION_CACHE_MAX_BYTES of
+converted audio. With CONVERSION_CACHE_DIR set, entries also go to a disk tier of
+one file per entry, bounded by CONVERSION_CACHE_DISK_MAX_BYTES (per
+worker, as each tracks the entries it has seen), that survives restarts and
+is shared by workers on the same host. Disk hits are
+memory-mapped rather than read, and promoted to the memory tier.
+
+    CONVERSION_CACHE_MAX_BYTES       memory tier size (default 64 MB, 0 disables the cache)
+    CONVERSION_CACHE_DIR             disk tier directory (default: no disk tier)
+    CONVERSION_CACHE_DISK_MAX_BYTES  disk tier size (default 1 GB)
+"""
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .audio import AUDIO_TARGET_ENCODING, OPUS_BITRATE, TARGET_SAMPLE_RATE
+from .metrics import CONVERSION_CACHE_BYTES, CONVERSION_CACHE_BYTES_SAVED, CONVERSION_CACHE_LOOKUPS
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+CONVERSION_CACHE_MAX_BYTES = int(os.environ.get("CONVERSION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CONVERSION_CACHE_DIR = os.environ.get("CONVERSION_CACHE_DIR", "")
+CONVERSION_CACHE_DISK_MAX_BYTES = int(os.environ.get("CONVERSION_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
+DISK_SUFFIX = ".audio"
+
+
+def content_hash(data):
+    """Hex digest of the audio bytes (bytes or memoryview)."""
+    if XXHASH_AVAILABLE:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def target_params(encoding):
+    """Part of every key: entries converted to other output settings never match."""
+    if encoding == 'ogg_opus':
+        return f"{encoding}-{OPUS_BITRATE}-{TARGET_SAMPLE_RATE}-mono"
+    return f"{encoding}-{TARGET_SAMPLE_RATE}-mono"
+
+
+class MemoryTier:
+    """LRU of audio bytes bounded by their total size, reported on `gauge`."""
+
+    def __init__(self, max_bytes, gauge=None):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._gauge = gauge if gauge is not None else CONVERSION_CACHE_BYTES.labels('memory')
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= len(previous)
+        self._entries[key] = value
+        self.bytes += len(value)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+        self._gauge.set(self.bytes)
+
+
+class DiskTier:
+    """One file per entry under a directory, LRU by total file size."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._sizes = OrderedDict()
+        # Guards the index only; files are read and written outside it
+        self._lock = threading.Lock()
+        self._gauge = CONVERSION_CACHE_BYTES.labels('disk')
+        os.makedirs(directory, exist_ok=True)
+        # Pick up entries from earlier runs, least recently used first
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(DISK_SUFFIX) and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_atime, entry.name[:-len(DISK_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self.bytes += size
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + DISK_SUFFIX)
+
+    def get(self, key):
+        """Memory-mapped view of the entry, or None."""
+        try:
+            with open(self._path(key), 'rb') as f:
+                # The mapping outlives the file object and is unmapped once the view is released
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            # Not cached, removed by another worker, or empty
+            with self._lock:
+                self._forget(key)
+            return None
+        with self._lock:
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+            else:
+                # Written by another worker
+                self._sizes[key] = len(view)
+                self.bytes += len(view)
+                self._evict()
+        return view
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._sizes or len(value) > self.max_bytes:
+                return
+        # Write then rename, so readers never map a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not write conversion cache entry: {str(e)}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if key not in self._sizes:
+                self._sizes[key] = len(value)
+                self.bytes += len(value)
+            self._evict()
+
+    def _forget(self, key):
+        self.bytes -= self._sizes.pop(key, 0)
+        self._gauge.set(self.bytes)
+
+    def _evict(self):
+        while self.bytes > self.max_bytes:
+            key, size = self._sizes.popitem(last=False)
+            self.bytes -= size
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+        self._gauge.set(self.bytes)
+
+
+class ConversionCache:
+    def __init__(self, max_bytes=CONVERSION_CACHE_MAX_BYTES, directory=CONVERSION_CACHE_DIR, disk_max_bytes=CONVERSION_CACHE_DISK_MAX_BYTES):
+        self.memory = MemoryTier(max_bytes)
+        self.disk = DiskTier(directory, disk_max_bytes) if directory else None
+        # With a disk tier, gets and puts run in worker threads
+        self._lock = threading.Lock()
+
+    def key(self, audio_bytes, input_format, encoding=AUDIO_TARGET_ENCODING):
+        return f"{content_hash(audio_bytes)}-{input_format}-{target_params(encoding)}"
+
+    def get(self, key):
+        """
+        Converted audio (bytes, or a memoryview for disk hits) for the key, or
+        None; blocks on disk I/O when the disk tier is on.
+        """
+        with self._lock:
+            value = self.memory.get(key)
+        tier = 'memory'
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            tier = 'disk'
+            if value is not None:
+                with self._lock:
+                    self.memory.put(key, value)
+        if value is None:
+            CONVERSION_CACHE_LOOKUPS.labels('miss').inc()
+            return None
+        CONVERSION_CACHE_LOOKUPS.labels(tier).inc()
+        CONVERSION_CACHE_BYTES_SAVED.inc(len(value))
+        return value
+
+    def put(self, key, converted):
+        """Store a conversion; blocks on disk I/O when the disk tier is on."""
+        with self._lock:
+            self.memory.put(key, converted)
+        if self.disk is not None:
+            self.disk.put(key, converted)
+
+
+conversion_cache = ConversionCache() if CONVERSION_CACHE_MAX_BYTES > 0 else None
@@ -1,51 +1,116 @@
 import os
 import json
 import logging
-import io
-import subprocess
-import tempfile
+import asyncio
+import threading
+import grpc
 from google.auth import default
 from google.oauth2 import service_account
-from google.cloud.dialogflowcx import SessionsClient
-from google.cloud.dialogflowcx_v3.types.session import DetectIntentRequest, DetectIntentResponse, QueryInput, TextInput, AudioInput, QueryParameters
+from google.cloud.dialogflowcx import SessionsAsyncClient
+from google.cloud.dialogflowcx_v3.services.sessions.transports import SessionsGrpcAsyncIOTransport
+from google.cloud.dialogflowcx_v3.types.session import DetectIntentRequest, StreamingDetectIntentRequest, QueryInput, TextInput, AudioInput
 from google.cloud.dialogflowcx_v3.types.audio_config import InputAudioConfig, AudioEncoding
 import uuid
+from .audio import (
+    AUDIO_TARGET_ENCODING, MAX_AUDIO_SECONDS, TARGET_ENCODINGS, TARGET_FORMAT, NoSpeechDetected, UnsupportedAudioFormat, check_duration,
+    detect_audio_format, ffmpeg_available,
+)
+from .audio_headers import conversion_reason, parse_audio_header, parse_wav, wav_data_offset
+from .audio_pool import AudioPoolBusy, audio_pool
+from .agents import AgentRegistry, call_async
+from .channel_pool import channel_options
+from .metrics import (
+    AUDIO_FORMATS, AUDIO_ROUTES, CONVERSIONS, DIALOGFLOW_FALLBACKS, OUTPUT_AUDIO, SILENCE_TRIMMED_SECONDS, SILENCE_TRIMS, annotate, in_flight,
+    stage,
+)
+from .resilience import (
+    DIALOGFLOW_FALLBACK_RESPONSE, DIALOGFLOW_REQUEST_BUDGET, DIALOGFLOW_TEXT_RETRIES, CircuitOpen, Deadline, retry_async,
+)
+from .conversion_cache import conversion_cache
+from .pcm import convert_pcm, pcm_convertible
+from .replies import Reply, extract_reply
+from .audio_stream import StreamTranscodeFailed, limit_duration, prepend, read_head, rechunk, stream_with_ffmpeg_pipe
+from .response_cache import response_cache
+from .sessions import session_store
+from .speech import OUTPUT_AUDIO_CONFIG, synthesis_cache
+from .single_flight import single_flight
+from .transcoders import get_transcoder
+from .vad import SILENCE_TRIM, trim_silence, trimmable
 
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Try to import pydub for audio conversion
-try:
-    from pydub import AudioSegment
-    PYDUB_AVAILABLE = True
-    logger.info("pydub is available for audio conversion")
-except ImportError:
-    PYDUB_AVAILABLE = False
-    logger.warning("pydub not available. Install with: pip install pydub")
-
-# Check if ffmpeg is available for audio conversion
-def _check_ffmpeg_available():
-    """Check if ffmpeg is installed and available."""
-    try:
-        result = subprocess.run(['ffmpeg', '-version'], 
-                              capture_output=True, 
-                              timeout=5)
-        return result.returncode == 0
-    except (FileNotFoundError, subprocess.TimeoutExpired):
-        return False
-
-FFMPEG_AVAILABLE = _check_ffmpeg_available()
-if not FFMPEG_AVAILABLE:
-    logger.warning("ffmpeg not available. Audio conversion will not work.")
-    logger.warning("Install ffmpeg: brew install ffmpeg (Mac) or apt-get install ffmpeg (Linux)")
-
 LOCATION = "us-central1"
 PROJECT_ID = "girlies-ai-agent"
 AGENT_ID = "4a8116a1-9f58-4b71-8cf0-f2faee516a2d"
 LANGUAGE_CODE = "ar"
-API_ENDPOINT = f"{LOCATION}-dialogflow.googleapis.com:443"
+API_ENDPOINT = os.environ.get("DIALOGFLOW_API_ENDPOINT", f"{LOCATION}-dialogflow.googleapis.com:443")
+# Containers Dialogflow can't take at all; WAV, FLAC and Ogg are transcoded to
+# AUDIO_TARGET_ENCODING only when their headers say so (audio_headers.py)
+CONVERTIBLE_FORMATS = ('mp4', 'm4a')
+# Silence is trimmed from PCM: transcoded audio is decoded to it first and encoded to the target after
+DECODE_ENCODING = 'linear16' if SILENCE_TRIM else AUDIO_TARGET_ENCODING
+# Headerless formats a client can declare when streaming
+STREAM_AUDIO_FORMATS = {
+    'linear16': AudioEncoding.AUDIO_ENCODING_LINEAR_16,
+    'flac': AudioEncoding.AUDIO_ENCODING_FLAC,
+    'ogg_opus': AudioEncoding.AUDIO_ENCODING_OGG_OPUS,
+    'mulaw': AudioEncoding.AUDIO_ENCODING_MULAW,
+    'alaw': AudioEncoding.AUDIO_ENCODING_ALAW,
+    'amr': AudioEncoding.AUDIO_ENCODING_AMR,
+    'amr_wb': AudioEncoding.AUDIO_ENCODING_AMR_WB,
+}
+# Sample width of the declared formats whose duration can be tracked from byte counts
+STREAM_BYTES_PER_SAMPLE = {'linear16': 2, 'mulaw': 1, 'alaw': 1}
+# Bytes read from a stream before sniffing its format
+STREAM_HEAD_BYTES = 4096
+# Most bytes read looking for a streamed WAV's data chunk (LIST, bext... chunks can be long)
+STREAM_MAX_HEAD_BYTES = 1024 * 1024
+# Plaintext channel without credentials, only for a local fake Dialogflow server
+USE_INSECURE_CHANNEL = os.environ.get("DIALOGFLOW_INSECURE_CHANNEL") == "1"
+
+def _query_params(session):
+    return session.query_params if session is not None else None
+
+def _read_audio_file(audio_file_path):
+    with open(audio_file_path, 'rb') as f:
+        return f.read()
+
+def _load_credentials():
+    """Resolve GCP credentials from env, project files or application defaults."""
+    credentials = None
+    # Option 1: Check for credentials file path from environment variable
+    creds_file_path = os.environ.get("GCP_CREDENTIALS_FILE")
+    if creds_file_path and os.path.exists(creds_file_path):
+        credentials = service_account.Credentials.from_service_account_file(creds_file_path)
+    # Option 2: Check for credentials JSON string
+    elif os.environ.get("GCP_CREDENTIALS"):
+        creds_json_string = os.environ.get("GCP_CREDENTIALS")
+        creds_json = json.loads(creds_json_string)
+        credentials = service_account.Credentials.from_service_account_info(creds_json)
+    # Option 3: Check for default credentials file in project directory
+    else:
+        # Look for common credential file names in the project root
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        default_creds_files = [
+            os.path.join(project_root, "girlies-ai-agent-84d2cbf6976f.json"),
+            os.path.join(project_root, "credentials.json"),
+            os.path.join(project_root, "gcp-credentials.json"),
+        ]
+        for creds_file in default_creds_files:
+            if os.path.exists(creds_file):
+                credentials = service_account.Credentials.from_service_account_file(creds_file)
+                break
+        # Option 4: Use default credentials (for local development with gcloud auth)
+        if credentials is None:
+            try:
+                credentials, _ = default()
+            except Exception:
+                raise Exception(
+                    "No GCP credentials found. Please set GCP_CREDENTIALS_FILE environment variable, "
+                    "or place credentials.json in the project root, or run 'gcloud auth application-default login'"
+                )
+    return credentials
 
 class Dialogflow:
     _instance = None
@@ -58,284 +123,523 @@ class Dialogflow:
 
     def __init__(self):
         if not Dialogflow._initialized:
-            credentials = None
-            # Option 1: Check for credentials file path from environment variable
-            creds_file_path = os.environ.get("GCP_CREDENTIALS_FILE")
-            if creds_file_path and os.path.exists(creds_file_path):
-                credentials = service_account.Credentials.from_service_account_file(creds_file_path)
-            # Option 2: Check for credentials JSON string
-            elif os.environ.get("GCP_CREDENTIALS"):
-                creds_json_string = os.environ.get("GCP_CREDENTIALS")
-                creds_json = json.loads(creds_json_string)
-                credentials = service_account.Credentials.from_service_account_info(creds_json)
-            # Option 3: Check for default credentials file in project directory
-            else:
-                # Look for common credential file names in the project root
-                project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-                default_creds_files = [
-                    os.path.join(project_root, "girlies-ai-agent-84d2cbf6976f.json"),
-                    os.path.join(project_root, "credentials.json"),
-                    os.path.join(project_root, "gcp-credentials.json"),
-                ]
-                for creds_file in default_creds_files:
-                    if os.path.exists(creds_file):
-                        credentials = service_account.Credentials.from_service_account_file(creds_file)
-                        break
-                # Option 4: Use default credentials (for local development with gcloud auth)
-                if credentials is None:
-                    try:
-                        credentials, _ = default()
-                    except Exception:
-                        raise Exception(
-                            "No GCP credentials found. Please set GCP_CREDENTIALS_FILE environment variable, "
-                            "or place credentials.json in the project root, or run 'gcloud auth application-default login'"
-                        )
-            self.client = SessionsClient(credentials=credentials, client_options={"api_endpoint": API_ENDPOINT})
+            # Credentials and clients are created on first use (or by warm_up),
+            # so importing and constructing this stays cheap at startup
+            self._credentials = None
+            # Event loop of the blocking detect_intent, created on first use
+            self._loop = None
+            self._loop_lock = threading.Lock()
+            self.registry = AgentRegistry.from_env(
+                {
+                    "project_id": PROJECT_ID,
+                    "location": LOCATION,
+                    "agent_id": AGENT_ID,
+                    "language_code": LANGUAGE_CODE,
+                    "api_endpoint": API_ENDPOINT,
+                },
+                self._new_client
+            )
             Dialogflow._initialized = True
 
+    @property
+    def credentials(self):
+        """GCP credentials, loaded on first use. None with an insecure channel."""
+        if self._credentials is None and not USE_INSECURE_CHANNEL:
+            self._credentials = _load_credentials()
+        return self._credentials
+
+    def _new_client(self, agent):
+        """
+        Async sessions client for an agent endpoint, on its own channel.
+
+        grpc.aio channels bind to the running event loop, so clients are built
+        lazily from inside the loop instead of at import time.
+        """
+        if USE_INSECURE_CHANNEL:
+            # Local fake/emulated Dialogflow server (benchmarks, load tests)
+            channel = grpc.aio.insecure_channel(agent.api_endpoint, options=channel_options())
+        else:
+            channel = SessionsGrpcAsyncIOTransport.create_channel(
+                agent.api_endpoint, credentials=self.credentials, options=channel_options()
+            )
+        return SessionsAsyncClient(transport=SessionsGrpcAsyncIOTransport(channel=channel))
+
+    async def warm_up(self, timeout=None):
+        """
+        Load credentials off the event loop, build the async clients of every
+        agent endpoint and wait for their channels to connect, so the first
+        requests skip the handshake.
+        """
+        await asyncio.to_thread(lambda: self.credentials)
+        channels = [
+            client.transport.grpc_channel
+            for agent in self.registry.endpoints.values()
+            for client in agent.async_clients.clients
+        ]
+        await asyncio.wait_for(asyncio.gather(*(channel.channel_ready() for channel in channels)), timeout)
+
 # يلي بتاخد الرسالة وبترد عليها 
-    def detect_intent(self, query, session_id=None, audio_bytes=None, audio_file_path=None, audio_encoding=None, sample_rate_hertz=16000):
+    def detect_intent(self, query, session_id=None, audio_bytes=None, audio_file_path=None, audio_encoding=None, sample_rate_hertz=16000, agent=None, output_audio=False):
         """
-        Detect intent from text or voice message.
-        
+        Blocking wrapper around detect_intent_async, for callers without an
+        event loop (scripts, sync code). Same arguments; returns
+        (Reply, session_id), see replies.py.
+
+        Calls run one at a time on this instance's own event loop, which the
+        async clients bind to on first use: a process that also calls
+        detect_intent_async (the FastAPI app) must not use it.
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+            return self._loop.run_until_complete(self.detect_intent_async(
+                query, session_id, audio_bytes, audio_file_path, audio_encoding, sample_rate_hertz, agent, output_audio
+            ))
+
+    async def detect_intent_async(self, query, session_id=None, audio_bytes=None, audio_file_path=None, audio_encoding=None, sample_rate_hertz=16000, agent=None, output_audio=False):
+        """
+        Detect intent from a text or voice message without blocking the event loop.
+
         Args:
             query: Text query (str) - required for text input
             session_id: Optional session ID (str)
-            audio_bytes: Audio data as bytes - required for audio input
+            audio_bytes: Audio data as bytes (or a memoryview) - required for audio input
             audio_file_path: Path to audio file - alternative to audio_bytes
             audio_encoding: Audio encoding format (auto-detected if None)
             sample_rate_hertz: Sample rate in Hz (default: 16000)
-        
+            agent: AgentEndpoint from self.registry (default agent if None)
+            output_audio: Ask Dialogflow to speak the reply, when OUTPUT_AUDIO
+                is on (see speech.py)
+
+        Audio file reads run in a worker thread, format conversion goes through
+        the bounded audio pool (raises AudioPoolBusy when saturated) and the
+        gRPC call goes through the CX async sessions client. Text replies for
+        allow-listed intents are served from the response cache when enabled,
+        and identical text queries in flight can share one call (single_flight.py);
+        spoken replies are served from the cache only when their speech is
+        cached too (speech.py). The call goes to `agent` (an AgentEndpoint,
+        default agent if None), with failover/hedging to its secondary region
+        when configured, within the request budget and retries of resilience.py.
+
         Returns:
-            tuple: (response_text, session_id)
+            tuple: (Reply, session_id)
         """
+        agent = agent or self.registry.default
         session_id = session_id or str(uuid.uuid4())
-        session_path = self.build_session_path(session_id)
+        session = self._session_turn(session_id, agent)
+        deadline = Deadline()
+        output_audio_config = OUTPUT_AUDIO_CONFIG if output_audio else None
+        cache_key = None
+        if response_cache is not None and query and audio_bytes is None and audio_file_path is None:
+            cache_key = response_cache.key(query, agent.language_code, agent.name)
+            cached = await response_cache.get(cache_key)
+            if cached is not None and output_audio_config is not None:
+                cached = self._cached_speech(cached, agent)
+            if cached is not None:
+                return cached, session_id
+        if audio_file_path:
+            audio_bytes = await asyncio.to_thread(_read_audio_file, audio_file_path)
+            audio_file_path = None
+        if audio_bytes is not None and audio_encoding is None:
+            detected_format = self._detect_audio_format(audio_bytes)
+            audio_bytes, audio_info = await self._prepare_audio_async(audio_bytes, detected_format)
+            audio_encoding, sample_rate_hertz = self._audio_settings(audio_info)
+        query_input = self._build_query_input(query, audio_bytes, audio_encoding, sample_rate_hertz, agent.language_code)
         
-        # Determine if input is audio or text
-        if audio_bytes is not None or audio_file_path is not None:
-            # Handle audio input
-            if audio_file_path:
-                with open(audio_file_path, 'rb') as f:
-                    audio_bytes = f.read()
-            
-            # Auto-detect and convert audio format if needed
-            if audio_encoding is None:
-                logger.info(f"Auto-detecting audio format (audio size: {len(audio_bytes)} bytes)")
-                detected_format = self._detect_audio_format(audio_bytes)
-                logger.info(f"Detected format: {detected_format}")
-                
-                # Convert MP4/M4A to WAV if needed
-                if detected_format in ['mp4', 'm4a']:
-                    logger.info(f"Converting {detected_format} to WAV format for Dialogflow compatibility...")
-                    try:
-                        audio_bytes = self._convert_audio_to_wav(audio_bytes, input_format=detected_format)
-                        detected_format = 'wav'  # Now it's WAV
-                    except Exception as e:
-                        logger.error(f"Conversion failed: {str(e)}")
-                        raise ValueError(f"Failed to convert {detected_format} audio: {str(e)}")
-                
-                # Set encoding based on final format
-                if detected_format == 'wav':
-                    # Extract sample rate from WAV header
-                    if len(audio_bytes) >= 28:
-                        sample_rate_hertz = int.from_bytes(audio_bytes[24:28], byteorder='little')
-                    else:
-                        sample_rate_hertz = 16000
-                    audio_encoding = AudioEncoding.AUDIO_ENCODING_LINEAR_16
-                elif detected_format == 'flac':
-                    audio_encoding = AudioEncoding.AUDIO_ENCODING_FLAC
-                    sample_rate_hertz = 16000
-                elif detected_format == 'ogg':
-                    audio_encoding = AudioEncoding.AUDIO_ENCODING_OGG_OPUS
-                    sample_rate_hertz = 16000
-                else:
-                    # Default to LINEAR16
-                    audio_encoding = AudioEncoding.AUDIO_ENCODING_LINEAR_16
-                    sample_rate_hertz = 16000
-                
-                logger.info(f"Using encoding: {audio_encoding}, sample rate: {sample_rate_hertz} Hz")
-            
-            query_input = self.build_audio_query_input(audio_bytes, audio_encoding, sample_rate_hertz)
-        elif query:
-            # Handle text input
-            query_input = self.build_query_input(query)
-        else:
-            raise ValueError("Either 'query' (text) or 'audio_bytes'/'audio_file_path' must be provided")
+        def call(endpoint, client):
+            request = self.build_detect_intent_request(
+                query_input, endpoint.session_path(session_id), _query_params(session), output_audio_config
+            )
+            # The client's own retries (UNAVAILABLE, up to 220 s) would outlast the budget
+            return client.detect_intent(request=request, retry=None, timeout=deadline.timeout())
         
-        request = self.build_detect_intent_request(query_input, session_path)
-        response = self.client.detect_intent(request=request)
-        return self.extract_response_text(response), session_id
-    
-    def _detect_audio_format(self, audio_bytes):
-        """
-        Detect audio format from bytes and return format name.
+        retries = DIALOGFLOW_TEXT_RETRIES if 'text' in query_input else 0
         
+        async def reply():
+            with stage('detect_intent'), in_flight('detect_intent'):
+                try:
+                    response = await retry_async(lambda: call_async(agent, call), deadline, retries, 'detect_intent')
+                except CircuitOpen as e:
+                    return self._fallback_response(agent, e, output_audio_config is not None), None
+            extracted = self.extract_reply(response, agent.language_code)
+            if cache_key is not None:
+                await response_cache.store(cache_key, extracted)
+            return extracted, extracted.intent
+
+        if single_flight is not None and 'text' in query_input:
+            # Identical queries in flight share one call, for COALESCE_INTENTS only;
+            # spoken and text-only replies are separate calls
+            key = single_flight.key(query, agent.language_code, agent.name)
+            if output_audio_config is not None:
+                key += "\x00speech"
+            extracted = await single_flight.run(key, reply)
+        else:
+            extracted, _ = await reply()
+        return extracted, session_id
+
+    def _session_turn(self, session_id, agent):
+        """Record the turn in the session store; the SessionRecord, or None when the store is off."""
+        if session_store is None:
+            return None
+        return session_store.turn(session_id, agent)
+
+    def session_agent(self, session_id):
+        """AgentEndpoint the session last talked to, or None for sessions this worker doesn't know."""
+        session = session_store.get(session_id) if session_store is not None else None
+        return session.agent if session is not None else None
+
+    def _fallback_response(self, agent, error, output_audio=False):
+        """
+        Canned reply while the agent's breaker is open (cached replies were
+        already tried), spoken if its speech is cached.
+        """
+        if not DIALOGFLOW_FALLBACK_RESPONSE:
+            raise error
+        DIALOGFLOW_FALLBACKS.labels(agent.name).inc()
+        annotate(fallback=True)
+        reply = Reply([DIALOGFLOW_FALLBACK_RESPONSE])
+        if output_audio:
+            return self._cached_speech(reply, agent) or reply
+        return reply
+
+    def _cached_speech(self, reply, agent):
+        """The reply with its speech from the synthesis cache, or None when it isn't cached."""
+        if synthesis_cache is None:
+            return None
+        output_audio = synthesis_cache.get(synthesis_cache.key(reply, agent.language_code))
+        if output_audio is None:
+            return None
+        OUTPUT_AUDIO.labels('cache').inc()
+        return reply.with_audio(output_audio)
+
+    def _build_query_input(self, query, audio_bytes=None, audio_encoding=None, sample_rate_hertz=16000, language_code=LANGUAGE_CODE):
+        """Build the text or audio QueryInput; audio is sent as is (see _prepare_audio_async)."""
+        if audio_bytes is not None:
+            return self.build_audio_query_input(audio_bytes, audio_encoding, sample_rate_hertz, language_code)
+        if query:
+            return self.build_query_input(query, language_code)
+        raise ValueError("Either 'query' (text) or 'audio_bytes'/'audio_file_path' must be provided")
+
+    async def _prepare_audio_async(self, audio_bytes, detected_format):
+        """
+        Convert what Dialogflow can't take as is, PCM WAV in a worker thread
+        holding an audio pool slot (pcm.py) and anything else through the transcoder backend, and trim
+        silence when SILENCE_TRIM is on (vad.py).
+
         Returns:
-            str: Format name ('mp4', 'm4a', 'wav', 'flac', 'ogg', 'unknown')
+            tuple: (audio bytes, AudioInfo or None for headerless audio)
         """
-        if len(audio_bytes) < 12:
-            return 'unknown'
-        
-        # Check file signatures (magic bytes)
-        header_hex = audio_bytes[:12].hex()
-        logger.info(f"Audio file header (first 12 bytes): {header_hex}")
-        
-        # MP4/M4A files start with ftyp box (bytes 4-8)
-        if len(audio_bytes) >= 8 and audio_bytes[4:8] == b'ftyp':
-            # Check for M4A specific brand
-            if b'm4a' in audio_bytes[8:20] or b'M4A' in audio_bytes[8:20]:
-                return 'm4a'
-            return 'mp4'
-        
-        # WAV files start with "RIFF" and contain "WAVE"
-        elif audio_bytes[0:4] == b'RIFF' and len(audio_bytes) >= 12 and audio_bytes[8:12] == b'WAVE':
-            return 'wav'
-        
-        # FLAC files start with "fLaC"
-        elif audio_bytes[0:4] == b'fLaC':
-            return 'flac'
-        
-        # OGG files start with "OggS"
-        elif audio_bytes[0:4] == b'OggS':
-            return 'ogg'
-        
-        return 'unknown'
-    
-    def _convert_audio_to_wav(self, audio_bytes, input_format='mp4'):
+        audio_info, reason = self._inspect_audio(detected_format, audio_bytes)
+        if reason is not None and DECODE_ENCODING == 'linear16' and pcm_convertible(audio_info):
+            # In a thread, within the audio pool's worker and queue limits (AudioPoolBusy past them)
+            async with audio_pool.slot():
+                audio_bytes, audio_info = await asyncio.to_thread(self._convert_pcm, audio_bytes, audio_info)
+        elif reason is not None:
+            encoding = DECODE_ENCODING
+            audio_bytes = await self._convert_audio_async(audio_bytes, detected_format, encoding)
+            audio_info = parse_audio_header(audio_bytes, TARGET_ENCODINGS[encoding][0])
+        if trimmable(audio_info):
+            audio_bytes, audio_info = self._trim_silence(audio_bytes, audio_info)
+            if reason is not None and AUDIO_TARGET_ENCODING != 'linear16':
+                audio_bytes = await self._convert_audio_async(audio_bytes, 'wav')
+                audio_info = parse_audio_header(audio_bytes, TARGET_FORMAT)
+        return audio_bytes, audio_info
+
+    def _convert_pcm(self, audio_bytes, audio_info):
+        """Downmix, resample and requantize PCM to 16kHz mono LINEAR16 WAV. See pcm.convert_pcm."""
+        # Before the work, which grows with the length
+        check_duration(audio_info.frames, audio_info.sample_rate)
+        with stage('convert'):
+            converted = convert_pcm(audio_bytes, audio_info)
+        CONVERSIONS.labels('numpy', 'ok').inc()
+        annotate(backend='numpy', converted_bytes=len(converted))
+        return converted, parse_wav(converted)
+
+    def _trim_silence(self, audio_bytes, audio_info):
+        """Cut leading and trailing silence from 16-bit mono WAV. See vad.trim_silence."""
+        frames = audio_info.frames
+        try:
+            with stage('vad'):
+                audio_bytes, audio_info, outcome = trim_silence(audio_bytes, audio_info)
+        except NoSpeechDetected:
+            SILENCE_TRIMS.labels('rejected').inc()
+            annotate(vad='rejected')
+            raise
+        if outcome == 'trimmed':
+            trimmed_seconds = (frames - audio_info.frames) / audio_info.sample_rate
+            SILENCE_TRIMMED_SECONDS.inc(trimmed_seconds)
+            annotate(trimmed_ms=round(trimmed_seconds * 1000))
+        SILENCE_TRIMS.labels(outcome).inc()
+        annotate(vad=outcome)
+        return audio_bytes, audio_info
+
+    def _inspect_audio(self, detected_format, audio_bytes):
         """
-        Convert audio bytes to LINEAR16 WAV format.
-        Tries pydub first (recommended), falls back to ffmpeg subprocess.
-        
+        Parse the headers of WAV, FLAC or Ogg audio and decide whether it has
+        to be transcoded. See audio_headers.conversion_reason.
+
+        Returns:
+            tuple: (AudioInfo, or None for MP4/M4A and headerless audio; why
+            the audio must be transcoded, or None to send it as is)
+        """
+        if detected_format in CONVERTIBLE_FORMATS:
+            audio_info, reason = None, 'container'
+        else:
+            with stage('parse_header'):
+                audio_info = parse_audio_header(audio_bytes, detected_format)
+            reason = conversion_reason(audio_info) if audio_info is not None else None
+        AUDIO_ROUTES.labels(reason or 'passthrough').inc()
+        if reason is not None:
+            annotate(conversion_reason=reason)
+        return audio_info, reason
+
+    def _audio_settings(self, audio_info):
+        """
+        Pick the Dialogflow encoding and sample rate from the audio's headers,
+        raising AudioTooLong past MAX_AUDIO_SECONDS. Audio without headers
+        is sent as raw 16kHz LINEAR16.
+
+        Returns:
+            tuple: (audio_encoding, sample_rate_hertz)
+        """
+        if audio_info is None:
+            return AudioEncoding.AUDIO_ENCODING_LINEAR_16, 16000
+        check_duration(audio_info.frames, audio_info.sample_rate)
+        return STREAM_AUDIO_FORMATS[audio_info.encoding], audio_info.sample_rate
+
+    async def stream_detect_intent(self, audio_chunks, session_id, audio_format=None, sample_rate_hertz=16000, agent=None, output_audio=False):
+        """
+        Stream audio to Dialogflow with streaming_detect_intent while it is
+        still arriving.
+
         Args:
-            audio_bytes: Original audio data
-            input_format: Format of input audio ('mp4', 'm4a', 'flac', 'ogg', etc.)
+            audio_chunks: Async iterable of raw upload bytes (any supported format)
+            session_id: Session ID (str)
+            audio_format: Name from STREAM_AUDIO_FORMATS for headerless audio such
+                as raw PCM frames; sniffed from the first bytes if None
+            sample_rate_hertz: Sample rate for audio_format (default: 16000)
+            agent: AgentEndpoint from self.registry (default agent if None);
+                streams are not failed over, hedged or retried but fail fast
+                with CircuitOpen while its breaker is open
+            output_audio: Ask Dialogflow to speak the reply, when OUTPUT_AUDIO
+                is on (see speech.py)
+
+        Yields:
+            StreamingDetectIntentResponse: interim recognition results, then the
+            final detect_intent_response.
+        """
+        agent = agent or self.registry.default
+        session_path = agent.session_path(session_id)
+        session = self._session_turn(session_id, agent)
+        if audio_format is not None:
+            if audio_format not in STREAM_AUDIO_FORMATS:
+                raise UnsupportedAudioFormat(f"Unsupported audio format '{audio_format}', expected one of: {', '.join(STREAM_AUDIO_FORMATS)}")
+            audio_encoding, payload = STREAM_AUDIO_FORMATS[audio_format], audio_chunks
+            byte_rate = sample_rate_hertz * STREAM_BYTES_PER_SAMPLE.get(audio_format, 0)
+        else:
+            audio_encoding, sample_rate_hertz, payload, byte_rate = await self._prepare_audio_stream(audio_chunks)
+        logger.debug("Streaming audio with encoding: %s, sample rate: %d Hz", audio_encoding, sample_rate_hertz)
+        payload = rechunk(limit_duration(payload, byte_rate))
         
+        # grpc.aio only cancels the call when the request iterator fails, so
+        # keep the error (size/duration limit, conversion failure) to re-raise
+        errors = []
+        requests = self._streaming_requests(
+            session_path, audio_encoding, sample_rate_hertz, payload, errors, agent.language_code, _query_params(session),
+            OUTPUT_AUDIO_CONFIG if output_audio else None
+        )
+        # At most MAX_AUDIO_SECONDS of audio goes up, so this only ends a hung stream
+        timeout = MAX_AUDIO_SECONDS + DIALOGFLOW_REQUEST_BUDGET if MAX_AUDIO_SECONDS else None
+        # The stream holds its channel until the final response
+        with stage('streaming_detect_intent'), in_flight('streaming_detect_intent'), agent.breaker.guard(), agent.async_clients.acquire() as client:
+            responses = await client.streaming_detect_intent(requests=requests, timeout=timeout)
+            try:
+                async for response in responses:
+                    yield response
+            except (asyncio.CancelledError, grpc.aio.AioRpcError):
+                if errors:
+                    raise errors[0]
+                raise
+        if errors:
+            raise errors[0]
+
+    async def streaming_detect_intent_async(self, audio_chunks, session_id=None, agent=None, output_audio=False):
+        """
+        Detect intent from streamed audio and wait for the final response.
+
+        Returns:
+            tuple: (Reply, session_id)
+        """
+        session_id = session_id or str(uuid.uuid4())
+        final_response = None
+        async for response in self.stream_detect_intent(audio_chunks, session_id, agent=agent, output_audio=output_audio):
+            if 'detect_intent_response' in response:
+                final_response = response.detect_intent_response
+        if final_response is None:
+            return Reply(), session_id
+        return self.extract_reply(final_response, (agent or self.registry.default).language_code), session_id
+
+    async def _prepare_audio_stream(self, audio_chunks):
+        """
+        Sniff the format from the first bytes of the stream, rejecting
+        unsupported audio before the rest is read.
+
         Returns:
-            bytes: WAV audio data in LINEAR16 format, 16kHz, mono, 16-bit
+            tuple: (audio_encoding, sample_rate_hertz, payload chunks, bytes per
+            second of the payload or 0 if unknown)
         """
-        # Try pydub first (cleaner and more reliable)
-        if PYDUB_AVAILABLE:
+        head, rest = await read_head(audio_chunks, STREAM_HEAD_BYTES)
+        detected_format = self._detect_audio_format(head)
+        if detected_format == 'wav':
+            while wav_data_offset(head) is None and len(head) < STREAM_MAX_HEAD_BYTES:
+                more, rest = await read_head(rest, len(head))
+                if not more:
+                    break
+                head += more
+        logger.debug("Detected streamed format: %s", detected_format)
+        if detected_format == 'unknown':
+            raise UnsupportedAudioFormat("Unsupported audio format: send WAV, FLAC, OGG/Opus, MP4 or M4A audio")
+        audio_info, reason = self._inspect_audio(detected_format, head)
+        if reason is not None:
+            payload = self._transcode_stream(prepend(head, rest), detected_format)
+            return AudioEncoding.AUDIO_ENCODING_LINEAR_16, 16000, payload, 16000 * 2
+        audio_encoding, sample_rate_hertz = self._audio_settings(audio_info)
+        if detected_format == 'wav':
+            # Streamed PCM carries raw samples only, so skip the RIFF header
+            return audio_encoding, sample_rate_hertz, prepend(head[audio_info.data_offset:], rest), audio_info.byte_rate
+        return audio_encoding, sample_rate_hertz, prepend(head, rest), 0
+
+    async def _transcode_stream(self, chunks, input_format):
+        """Incrementally transcode streamed audio (m4a/mp4, stereo WAV...) to PCM through an ffmpeg pipe."""
+        if ffmpeg_available():
+            async with audio_pool.slot():
+                try:
+                    async for pcm in stream_with_ffmpeg_pipe(chunks):
+                        yield pcm
+                    CONVERSIONS.labels('ffmpeg-stream', 'ok').inc()
+                    return
+                except StreamTranscodeFailed as e:
+                    CONVERSIONS.labels('ffmpeg-stream', 'fallback').inc()
+                    logger.warning(f"Streaming conversion not possible ({str(e)}), converting the buffered upload")
+                    received = b''.join(e.received)
+        else:
+            received = b''.join([chunk async for chunk in chunks])
+        # e.g. MP4 with the moov box at the end: convert the whole upload at once,
+        # to PCM like the ffmpeg pipe whatever the target encoding
+        wav_bytes = await self._convert_audio_async(received, input_format, 'linear16')
+        # bytes() as cached conversions can be memory-mapped views
+        yield bytes(wav_bytes[parse_wav(wav_bytes).data_offset:])
+
+    def _streaming_requests(self, session_path, audio_encoding, sample_rate_hertz, payload, errors, language_code=LANGUAGE_CODE, query_params=None, output_audio_config=None):
+        async def requests():
+            # The first request carries the session, its parameters and the audio configs, the rest only audio
+            audio_config = InputAudioConfig(
+                audio_encoding=audio_encoding,
+                sample_rate_hertz=sample_rate_hertz,
+                single_utterance=True
+            )
+            yield StreamingDetectIntentRequest(
+                session=session_path,
+                query_input=QueryInput(audio=AudioInput(config=audio_config), language_code=language_code),
+                query_params=query_params,
+                output_audio_config=output_audio_config
+            )
             try:
-                logger.info(f"Converting {input_format} audio to WAV using pydub...")
-                logger.info(f"Input: {len(audio_bytes)} bytes")
-                
-                # Create AudioSegment from bytes
-                audio = AudioSegment.from_file(io.BytesIO(audio_bytes), format=input_format)
-                
-                # Convert to WAV format: 16kHz, mono, 16-bit (LINEAR16)
-                audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
-                
-                # Export to WAV bytes
-                wav_buffer = io.BytesIO()
-                audio.export(wav_buffer, format="wav")
-                wav_bytes = wav_buffer.getvalue()
-                
-                logger.info(f"Successfully converted audio using pydub: {len(wav_bytes)} bytes, WAV format, 16kHz, mono, 16-bit")
-                return wav_bytes
-                
+                async for chunk in payload:
+                    yield StreamingDetectIntentRequest(
+                        query_input=QueryInput(audio=AudioInput(audio=chunk), language_code=language_code)
+                    )
             except Exception as e:
-                logger.warning(f"pydub conversion failed: {str(e)}, trying ffmpeg fallback...")
-                # Fall through to ffmpeg method
-        
-        # Fallback to ffmpeg subprocess
-        if not FFMPEG_AVAILABLE:
-            error_msg = "Audio conversion requires either pydub (pip install pydub) or ffmpeg (brew install ffmpeg / apt-get install ffmpeg)"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
-        
-        # Create temporary files for input and output
-        input_ext = input_format if input_format != 'm4a' else 'm4a'
-        with tempfile.NamedTemporaryFile(suffix=f'.{input_ext}', delete=False) as input_file:
-            input_file.write(audio_bytes)
-            input_file_path = input_file.name
-        
-        output_file_path = None
+                errors.append(e)
+                raise
+        return requests()
+
+    async def _convert_audio_async(self, audio_bytes, input_format, encoding=AUDIO_TARGET_ENCODING):
+        """
+        Convert audio to the target encoding with the configured transcoder
+        backend, or take it from the conversion cache.
+        """
+        cache_key, converted = await self._cached_conversion(audio_bytes, input_format, encoding)
+        if converted is not None:
+            return converted
+        logger.debug("Converting %s to %s for Dialogflow compatibility", input_format, encoding)
+        transcoder = get_transcoder()
         try:
-            # Create temporary output file
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as output_file:
-                output_file_path = output_file.name
-            
-            logger.info(f"Converting {input_format} audio to WAV format using ffmpeg...")
-            logger.info(f"Input: {len(audio_bytes)} bytes, Output: {output_file_path}")
-            
-            # Use ffmpeg to convert to LINEAR16 WAV:
-            # - Sample rate: 16000 Hz
-            # - Channels: 1 (mono)
-            # - Sample format: s16le (16-bit signed little-endian = LINEAR16)
-            # - Format: wav
-            ffmpeg_cmd = [
-                'ffmpeg',
-                '-i', input_file_path,  # Input file
-                '-ar', '16000',          # Sample rate: 16kHz
-                '-ac', '1',              # Channels: mono
-                '-acodec', 'pcm_s16le',  # Audio codec: 16-bit PCM (LINEAR16)
-                '-f', 'wav',             # Format: WAV
-                '-y',                    # Overwrite output file
-                output_file_path         # Output file
-            ]
-            
-            # Run ffmpeg (suppress output unless there's an error)
-            result = subprocess.run(
-                ffmpeg_cmd,
-                capture_output=True,
-                text=True,
-                timeout=30  # 30 second timeout
-            )
-            
-            if result.returncode != 0:
-                error_msg = f"ffmpeg conversion failed: {result.stderr}"
-                logger.error(error_msg)
-                raise ValueError(error_msg)
-            
-            # Read the converted WAV file
-            with open(output_file_path, 'rb') as f:
-                wav_bytes = f.read()
-            
-            logger.info(f"Successfully converted audio using ffmpeg: {len(wav_bytes)} bytes, WAV format, 16kHz, mono, 16-bit")
-            return wav_bytes
-            
-        except subprocess.TimeoutExpired:
-            logger.error("ffmpeg conversion timed out")
-            raise ValueError("Audio conversion timed out")
+            with stage('convert'):
+                converted = await transcoder.convert(audio_bytes, input_format, encoding)
+        except AudioPoolBusy:
+            CONVERSIONS.labels(transcoder.name, 'busy').inc()
+            raise
         except Exception as e:
-            logger.error(f"Error converting audio: {str(e)}")
-            raise ValueError(f"Failed to convert audio from {input_format} to WAV: {str(e)}")
-        finally:
-            # Clean up temporary files
-            try:
-                if os.path.exists(input_file_path):
-                    os.unlink(input_file_path)
-                if output_file_path and os.path.exists(output_file_path):
-                    os.unlink(output_file_path)
-            except Exception as e:
-                logger.warning(f"Error cleaning up temp files: {str(e)}")
+            CONVERSIONS.labels(transcoder.name, 'error').inc()
+            logger.error(f"Conversion failed: {str(e)}")
+            raise ValueError(f"Failed to convert {input_format} audio: {str(e)}")
+        CONVERSIONS.labels(transcoder.name, 'ok').inc()
+        annotate(backend=transcoder.name, converted_bytes=len(converted))
+        if cache_key is not None:
+            if conversion_cache.disk is None:
+                conversion_cache.put(cache_key, converted)
+            else:
+                await asyncio.to_thread(conversion_cache.put, cache_key, converted)
+        return converted
 
-    def build_session_path(self, session_id):
-        return f"projects/{PROJECT_ID}/locations/{LOCATION}/agents/{AGENT_ID}/sessions/{session_id}"
+    async def _cached_conversion(self, audio_bytes, input_format, encoding=AUDIO_TARGET_ENCODING):
+        """(cache key, cached conversion or None); the key is None when the cache is off."""
+        if conversion_cache is None:
+            return None, None
+        with stage('conversion_cache'):
+            cache_key = conversion_cache.key(audio_bytes, input_format, encoding)
+            if conversion_cache.disk is None:
+                converted = conversion_cache.get(cache_key)
+            else:
+                # Disk hits open and map a file
+                converted = await asyncio.to_thread(conversion_cache.get, cache_key)
+        if converted is not None:
+            CONVERSIONS.labels('cache', 'ok').inc()
+            annotate(backend='cache', converted_bytes=len(converted))
+        return cache_key, converted
+
+    def _detect_audio_format(self, audio_bytes):
+        """Detect audio format from magic bytes. See audio.detect_audio_format."""
+        with stage('detect_format'):
+            detected_format = detect_audio_format(audio_bytes)
+        AUDIO_FORMATS.labels(detected_format).inc()
+        annotate(format=detected_format)
+        return detected_format
     
-    def build_query_input(self, query):
+    def build_query_input(self, query, language_code=LANGUAGE_CODE):
         """Build query input for text messages."""
         text_input = TextInput(text=query)
-        return QueryInput(text=text_input, language_code=LANGUAGE_CODE)
+        return QueryInput(text=text_input, language_code=language_code)
     
-    def build_audio_query_input(self, audio_bytes, audio_encoding=AudioEncoding.AUDIO_ENCODING_LINEAR_16, sample_rate_hertz=16000):
+    def build_audio_query_input(self, audio_bytes, audio_encoding=AudioEncoding.AUDIO_ENCODING_LINEAR_16, sample_rate_hertz=16000, language_code=LANGUAGE_CODE):
         """Build query input for voice/audio messages."""
         audio_config = InputAudioConfig(
             audio_encoding=audio_encoding,
             sample_rate_hertz=sample_rate_hertz
         )
+        if not isinstance(audio_bytes, bytes):
+            # The protobuf runtime only takes bytes: the one copy of a buffer/memoryview upload
+            audio_bytes = bytes(audio_bytes)
         audio_input = AudioInput(config=audio_config, audio=audio_bytes)
-        return QueryInput(audio=audio_input, language_code=LANGUAGE_CODE)
+        return QueryInput(audio=audio_input, language_code=language_code)
     
-    def build_detect_intent_request(self, query_input, session_path):
-        return DetectIntentRequest(session=session_path, query_input=query_input)
+    def build_detect_intent_request(self, query_input, session_path, query_params=None, output_audio_config=None):
+        return DetectIntentRequest(
+            session=session_path, query_input=query_input, query_params=query_params, output_audio_config=output_audio_config
+        )
 
-    def extract_response_text(self, response):
-        if not response.query_result.response_messages:
-            return ""
-        
-        else:
-            return response.query_result.response_messages[0].text.text[0]
-    
-    
\ No newline at end of file
+    def extract_reply(self, response, language_code=None):
+        """
+        All messages, intent, confidence, transcript and speech of a response,
+        see replies.extract_reply. Speech goes to the synthesis cache, under
+        language_code (default: the response's).
+        """
+        with stage('extract_response'):
+            reply = extract_reply(response)
+        if reply.output_audio is not None:
+            OUTPUT_AUDIO.labels('dialogflow').inc()
+            if synthesis_cache is not None:
+                language_code = language_code or response.query_result.language_code
+                synthesis_cache.put(synthesis_cache.key(reply, language_code), reply.output_audio)
+        return reply
@@ -0,0 +1,231 @@
+"""
+Prometheus metrics and per-stage tracing for the request path.
+
+Wrap a stage of a request in `with stage('convert'):` to record its latency
+in ai_agent_stage_seconds{stage=...}. With TRACING_ENABLED=1 each stage also
+opens a span: an OpenTelemetry span when opentelemetry-api is installed,
+otherwise a DEBUG log line with the stage timing. Tracing off costs one
+perf_counter pair and a histogram observe per stage.
+
+Stage timings and annotate() fields also go into the current request's
+record (see start_request_record), which the HTTP layer turns into one
+structured log line per request.
+
+The metrics are no-ops when prometheus_client is not installed.
+"""
+import contextvars
+import logging
+import os
+import time
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+try:
+    from opentelemetry import trace as otel_trace
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED") == "1"
+# Stage buckets span a sub-millisecond format sniff to a multi-second transcode or gRPC call
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _NoopMetric:
+    """Stands in for prometheus_client metrics when it isn't installed."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+if PROMETHEUS_AVAILABLE:
+    STAGE_SECONDS = Histogram(
+        'ai_agent_stage_seconds', 'Time spent in each stage of a request', ['stage'], buckets=STAGE_BUCKETS
+    )
+    AUDIO_FORMATS = Counter('ai_agent_audio_format_total', 'Uploads by detected audio format', ['format'])
+    AUDIO_ROUTES = Counter(
+        'ai_agent_audio_routes_total',
+        'Audio sent as is (passthrough) or transcoded, by reason (container, codec, bit_depth, channels, sample_rate)', ['route']
+    )
+    CONVERSIONS = Counter(
+        'ai_agent_audio_conversions_total', 'Audio conversions by transcoder backend and outcome', ['backend', 'outcome']
+    )
+    SILENCE_TRIMS = Counter(
+        'ai_agent_silence_trim_total', 'Silence trimming outcomes (trimmed, unchanged, no_speech, rejected)', ['outcome']
+    )
+    SILENCE_TRIMMED_SECONDS = Counter('ai_agent_silence_trimmed_seconds_total', 'Seconds of silence cut before upload')
+    HTTP_SECONDS = Histogram(
+        'ai_agent_http_request_seconds', 'HTTP request latency by route', ['route'], buckets=STAGE_BUCKETS
+    )
+    HTTP_IN_FLIGHT = Gauge('ai_agent_http_requests_in_flight', 'HTTP requests being handled', ['route'])
+    HTTP_RESPONSES = Counter('ai_agent_http_responses_total', 'HTTP responses by route and status', ['route', 'status'])
+    HTTP_ERRORS = Counter('ai_agent_http_errors_total', 'HTTP error responses (4xx/5xx) by status', ['status'])
+    DIALOGFLOW_IN_FLIGHT = Gauge('ai_agent_dialogflow_calls_in_flight', 'Dialogflow calls awaiting a reply', ['method'])
+    DIALOGFLOW_CHANNEL_IN_FLIGHT = Gauge(
+        'ai_agent_dialogflow_channel_in_flight', 'Dialogflow calls in flight per pooled channel', ['pool', 'channel']
+    )
+    DIALOGFLOW_CHANNEL_CALLS = Counter(
+        'ai_agent_dialogflow_channel_calls_total', 'Dialogflow calls per pooled channel', ['pool', 'channel']
+    )
+    DIALOGFLOW_ENDPOINT_SECONDS = Histogram(
+        'ai_agent_dialogflow_endpoint_seconds', 'Dialogflow call latency per agent endpoint', ['endpoint'],
+        buckets=STAGE_BUCKETS
+    )
+    DIALOGFLOW_ENDPOINT_EWMA = Gauge(
+        'ai_agent_dialogflow_endpoint_ewma_seconds', 'Smoothed Dialogflow call latency per agent endpoint', ['endpoint']
+    )
+    DIALOGFLOW_FAILOVERS = Counter(
+        'ai_agent_dialogflow_failovers_total', 'Calls retried on the secondary endpoint after an error', ['endpoint', 'secondary']
+    )
+    DIALOGFLOW_HEDGES = Counter(
+        'ai_agent_dialogflow_hedges_total', 'Calls to a degraded endpoint by which side answered', ['endpoint', 'winner']
+    )
+    DIALOGFLOW_BREAKER_STATE = Gauge(
+        'ai_agent_dialogflow_breaker_state', 'Circuit breaker state per endpoint (0 closed, 1 half-open, 2 open)', ['endpoint']
+    )
+    DIALOGFLOW_BREAKER_TRANSITIONS = Counter(
+        'ai_agent_dialogflow_breaker_transitions_total', 'Circuit breaker state changes per endpoint', ['endpoint', 'state']
+    )
+    DIALOGFLOW_RETRIES = Counter('ai_agent_dialogflow_retries_total', 'Dialogflow calls retried after a transient error', ['method'])
+    DIALOGFLOW_FALLBACKS = Counter(
+        'ai_agent_dialogflow_fallbacks_total', 'Fallback replies served while the circuit breaker was open', ['endpoint']
+    )
+    RESPONSE_CACHE_LOOKUPS = Counter(
+        'ai_agent_response_cache_lookups_total', 'Text reply cache lookups by result (hit, miss)', ['result']
+    )
+    RESPONSE_CACHE_STORES = Counter('ai_agent_response_cache_stores_total', 'Replies of allow-listed intents stored in the cache')
+    CONVERSION_CACHE_LOOKUPS = Counter(
+        'ai_agent_conversion_cache_lookups_total', 'Converted-audio cache lookups by result (memory, disk, miss)', ['result']
+    )
+    CONVERSION_CACHE_BYTES_SAVED = Counter(
+        'ai_agent_conversion_cache_bytes_saved_total', 'Bytes of converted audio served from the cache instead of transcoding'
+    )
+    CONVERSION_CACHE_BYTES = Gauge('ai_agent_conversion_cache_bytes', 'Converted audio held per cache tier', ['tier'])
+    SYNTHESIS_CACHE_LOOKUPS = Counter(
+        'ai_agent_synthesis_cache_lookups_total', 'Synthesized-speech cache lookups by result (hit, miss)', ['result']
+    )
+    SYNTHESIS_CACHE_BYTES = Gauge('ai_agent_synthesis_cache_bytes', 'Synthesized speech held in the cache')
+    OUTPUT_AUDIO = Counter(
+        'ai_agent_output_audio_total', 'Spoken replies by where their speech came from (dialogflow, cache)', ['source']
+    )
+    SESSIONS_ACTIVE = Gauge('ai_agent_sessions_active', 'Sessions in the local session store')
+    SESSION_EVICTIONS = Counter('ai_agent_session_evictions_total', 'Sessions evicted from the local store (idle, capacity)', ['reason'])
+    COALESCED = Counter(
+        'ai_agent_coalesced_queries_total',
+        'Text queries by single-flight role (leader, shared, not_allowed, leader_cancelled)', ['outcome']
+    )
+else:
+    STAGE_SECONDS = AUDIO_FORMATS = AUDIO_ROUTES = CONVERSIONS = _NoopMetric()
+    SILENCE_TRIMS = SILENCE_TRIMMED_SECONDS = _NoopMetric()
+    HTTP_SECONDS = HTTP_IN_FLIGHT = HTTP_RESPONSES = HTTP_ERRORS = DIALOGFLOW_IN_FLIGHT = _NoopMetric()
+    DIALOGFLOW_CHANNEL_IN_FLIGHT = DIALOGFLOW_CHANNEL_CALLS = _NoopMetric()
+    DIALOGFLOW_ENDPOINT_SECONDS = DIALOGFLOW_ENDPOINT_EWMA = DIALOGFLOW_FAILOVERS = DIALOGFLOW_HEDGES = _NoopMetric()
+    DIALOGFLOW_BREAKER_STATE = DIALOGFLOW_BREAKER_TRANSITIONS = DIALOGFLOW_RETRIES = DIALOGFLOW_FALLBACKS = _NoopMetric()
+    RESPONSE_CACHE_LOOKUPS = RESPONSE_CACHE_STORES = _NoopMetric()
+    COALESCED = CONVERSION_CACHE_LOOKUPS = CONVERSION_CACHE_BYTES_SAVED = CONVERSION_CACHE_BYTES = _NoopMetric()
+    SYNTHESIS_CACHE_LOOKUPS = SYNTHESIS_CACHE_BYTES = OUTPUT_AUDIO = _NoopMetric()
+    SESSIONS_ACTIVE = SESSION_EVICTIONS = _NoopMetric()
+    CONTENT_TYPE_LATEST = "text/plain; charset=utf-8"
+
+
+# Stage timings and annotations of the request being handled, or None outside a request
+_request_record = contextvars.ContextVar('request_record', default=None)
+
+
+def start_request_record():
+    """Start collecting stage timings and annotations for the current request."""
+    record = {"stages": {}}
+    return record, _request_record.set(record)
+
+
+def end_request_record(token):
+    _request_record.reset(token)
+
+
+def annotate(**fields):
+    """Attach fields (format, sizes, backend) to the current request's log line."""
+    record = _request_record.get()
+    if record is not None:
+        record.update(fields)
+
+
+if TRACING_ENABLED and OTEL_AVAILABLE:
+    _tracer = otel_trace.get_tracer(__name__)
+else:
+    _tracer = None
+
+
+class stage:
+    """
+    Context manager timing one stage of a request:
+
+        with stage('detect_intent'):
+            response = await client.detect_intent(request=request)
+    """
+    __slots__ = ('name', '_start', '_span')
+
+    def __init__(self, name):
+        self.name = name
+        self._span = None
+
+    def __enter__(self):
+        if _tracer is not None:
+            self._span = _tracer.start_as_current_span(self.name)
+            self._span.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        STAGE_SECONDS.labels(self.name).observe(elapsed)
+        record = _request_record.get()
+        if record is not None:
+            # Summed, as a stage can run more than once per request (batches)
+            stages = record["stages"]
+            stages[self.name] = stages.get(self.name, 0.0) + elapsed
+        if self._span is not None:
+            self._span.__exit__(exc_type, exc, tb)
+        elif TRACING_ENABLED:
+            logger.debug(f"span {self.name}: {elapsed * 1000:.2f} ms{' (failed)' if exc_type else ''}")
+        return False
+
+
+class in_flight:
+    """Context manager counting a Dialogflow call in DIALOGFLOW_IN_FLIGHT."""
+    __slots__ = ('_gauge',)
+
+    def __init__(self, method):
+        self._gauge = DIALOGFLOW_IN_FLIGHT.labels(method)
+
+    def __enter__(self):
+        self._gauge.inc()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._gauge.dec()
+        return False
+
+
+def render_metrics():
+    """Metrics in the Prometheus text exposition format, with its content type."""
+    if not PROMETHEUS_AVAILABLE:
+        return b"# prometheus_client is not installed\n", CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
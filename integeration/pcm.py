@@ -0,0 +1,140 @@
+"""
+In-process conversion of PCM audio to 16kHz mono LINEAR16 with NumPy.
+
+WAV that Dialogflow can't take as is only because of its channel count,
+sample width or rate (stereo, 8/24/32-bit or float, 96kHz...) doesn't need
+a decoder: convert_pcm() reads the samples straight from the upload's
+buffer (bytes or a memoryview), downmixes, resamples with a polyphase
+windowed-sinc filter and requantizes to 16-bit, with no subprocess or
+transcoder worker. Raw PCM works the same, described by an AudioInfo with
+data_offset 0. Compressed codecs (A-law/mu-law WAV, MP4, Vorbis...) still go
+to the transcoder.
+
+    PCM_FAST_PATH   0 sends PCM WAV to the transcoder instead (default 1)
+"""
+import functools
+import math
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .audio import TARGET_SAMPLE_RATE, wav_header
+
+PCM_FAST_PATH = os.environ.get("PCM_FAST_PATH", "1") == "1"
+
+INT24 = np.dtype([('low', '<u2'), ('high', 'i1')])
+
+# Bytes per sample the fast path reads, per codec
+PCM_SAMPLE_WIDTHS = {'pcm': (1, 2, 3, 4), 'float': (4, 8)}
+# Filter half-length in input samples of the slower rate, and Kaiser window
+# shape: the defaults of scipy.signal.resample_poly
+RESAMPLE_HALF_LENGTH = 10
+KAISER_BETA = 5.0
+
+
+def pcm_convertible(info):
+    """True if the fast path is on and can read the samples `info` describes."""
+    if not PCM_FAST_PATH or info is None or not info.channels or info.block_align % info.channels:
+        return False
+    return info.block_align // info.channels in PCM_SAMPLE_WIDTHS.get(info.codec, ())
+
+
+def read_samples(data, info):
+    """Mono float32 samples, at 16-bit scale, of the PCM `info` describes."""
+    width = info.block_align // info.channels
+    count = info.frames * info.channels
+    if info.codec == 'float':
+        samples = np.frombuffer(data, dtype=f'<f{width}', count=count, offset=info.data_offset).astype(np.float32) * 32768
+    elif width == 1:
+        # 8-bit WAV is unsigned
+        samples = (np.frombuffer(data, dtype=np.uint8, count=count, offset=info.data_offset).astype(np.float32) - 128) * 256
+    elif width == 3:
+        # The signed high byte carries the 16-bit scale, the low two bytes the fraction
+        raw = np.frombuffer(data, dtype=INT24, count=count, offset=info.data_offset)
+        samples = raw['high'].astype(np.float32) * 256
+        samples += raw['low'] * np.float32(1 / 256)
+    else:
+        samples = np.frombuffer(data, dtype=f'<i{width}', count=count, offset=info.data_offset).astype(np.float32)
+        if width == 4:
+            samples /= 65536
+    if info.channels > 1:
+        # Summing strided channel views is several times faster than mean(axis=1) over a short axis
+        mono = samples[0::info.channels].copy()
+        for channel in range(1, info.channels):
+            mono += samples[channel::info.channels]
+        samples = mono / info.channels
+    return samples
+
+
+@functools.lru_cache(maxsize=16)
+def _filter_bank(up, down):
+    """
+    Anti-aliasing low-pass filter for resampling by up/down, split into its
+    `up` phases: bank[p] are the taps applied to consecutive input samples
+    for outputs of phase p. Returns (filter half-length, bank).
+    """
+    half = RESAMPLE_HALF_LENGTH * max(up, down)
+    taps = 2 * half + 1
+    cutoff = 1 / max(up, down)
+    h = np.sinc(cutoff * (np.arange(taps) - half)) * np.kaiser(taps, KAISER_BETA)
+    # Unit gain at DC after zero-stuffing by `up`
+    h *= up / h.sum()
+    per_phase = -(-taps // up)
+    h = np.concatenate([h, np.zeros(per_phase * up - taps)])
+    # bank[p, j] = h[p + (per_phase - 1 - j) * up]: taps reversed, so each output is a dot product with a forward window
+    return half, np.ascontiguousarray(h.reshape(per_phase, up).T[:, ::-1], dtype=np.float32)
+
+
+def resample(samples, rate, target_rate):
+    """Polyphase resampling of float32 samples, equivalent to upsampling, filtering and decimating."""
+    if rate == target_rate:
+        return samples
+    gcd = math.gcd(rate, target_rate)
+    up, down = target_rate // gcd, rate // gcd
+    half, bank = _filter_bank(up, down)
+    per_phase = bank.shape[1]
+    count = -(-len(samples) * up // down)
+    if up == 1:
+        return _decimate(samples, down, bank[0], half, count)
+    padding = np.zeros(per_phase, dtype=np.float32)
+    windows = sliding_window_view(np.concatenate([padding[1:], samples, padding]), per_phase)
+    resampled = np.empty(count, dtype=np.float32)
+    # Outputs first, first + up, ... share a filter phase, and their windows start `down` samples apart
+    for first in range(min(up, count)):
+        position = first * down + half
+        outputs = resampled[first::up]
+        outputs[:] = windows[position // up::down][:len(outputs)] @ bank[position % up]
+    return resampled
+
+
+def _decimate(samples, down, taps, half, count):
+    """
+    resample() for integer ratios (48kHz, 32kHz...), where consecutive windows
+    overlap and the strided matrix-vector product can't use BLAS: with the
+    input laid out in rows of `down` samples, each group of `down` taps is a
+    contiguous one.
+    """
+    blocks = -(-len(taps) // down)
+    grouped = np.zeros(blocks * down, dtype=np.float32)
+    grouped[:len(taps)] = taps
+    grouped = grouped.reshape(blocks, down)
+    # Output m starts its window at input m * down + half - (len(taps) - 1); pad so that is row m
+    lead = len(taps) - 1 - half
+    padded = np.zeros((count + blocks) * down, dtype=np.float32)
+    padded[lead:lead + len(samples)] = samples
+    rows = padded.reshape(count + blocks, down)
+    decimated = rows[:count] @ grouped[0]
+    for block in range(1, blocks):
+        decimated += rows[block:block + count] @ grouped[block]
+    return decimated
+
+
+def convert_pcm(data, info, target_rate=TARGET_SAMPLE_RATE):
+    """
+    Convert the PCM `info` describes (see pcm_convertible) to a mono 16-bit
+    WAV at target_rate.
+    """
+    samples = resample(read_samples(data, info), info.sample_rate, target_rate)
+    pcm = np.clip(np.rint(samples), -32768, 32767).astype('<i2')
+    return wav_header(pcm.nbytes, target_rate) + pcm.tobytes()
@@ -0,0 +1,101 @@
+"""
+The whole of a Dialogflow reply, not only its first text.
+
+A turn can answer with several messages (text split over bubbles, custom
+payloads for cards or quick replies...). extract_reply() reads all of them,
+with the matched intent, its confidence and, for audio, the transcript, in
+one pass over the raw protobuf: going through the proto-plus wrappers
+would marshal every field on access. Only custom payloads are converted
+(Struct to dict), and only when present.
+
+Replies are also what the response cache and single-flight coalescing hand
+out; to_json()/from_json() serialize them for the Redis backend, with orjson
+when installed (dumps() and loads(), also used for reply bodies). Their
+spoken audio (speech.py) is not serialized: it is cached by content on its
+own.
+"""
+import json
+
+from google.cloud.dialogflowcx_v3.types.session import DetectIntentResponse
+from google.protobuf import json_format
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def dumps(content):
+    """UTF-8 JSON bytes."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False).encode("utf-8")
+
+
+def loads(data):
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+
+class Reply:
+    """
+    Text messages in order, custom payloads (dicts), matched intent display
+    name and confidence (None without a match), the transcript of audio
+    input (None for text) and the synthesized speech of the reply (bytes,
+    None unless asked for).
+    """
+    __slots__ = ('messages', 'payloads', 'intent', 'confidence', 'transcript', 'output_audio')
+    # Slots to_dict() and to_json() write
+    FIELDS = __slots__[:-1]
+
+    def __init__(self, messages=(), payloads=(), intent=None, confidence=None, transcript=None, output_audio=None):
+        self.messages = list(messages)
+        self.payloads = list(payloads)
+        self.intent = intent
+        self.confidence = confidence
+        self.transcript = transcript
+        self.output_audio = output_audio
+
+    @property
+    def text(self):
+        """The first text message, or "": the reply as it was before multi-message responses."""
+        return self.messages[0] if self.messages else ""
+
+    def with_audio(self, output_audio):
+        """A copy of the reply carrying `output_audio` instead of its own."""
+        return Reply(self.messages, self.payloads, self.intent, self.confidence, self.transcript, output_audio)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def to_json(self):
+        """UTF-8 JSON bytes."""
+        return dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(**loads(data))
+
+    def __repr__(self):
+        return f"Reply({len(self.messages)} messages, {len(self.payloads)} payloads, intent={self.intent!r})"
+
+
+def extract_reply(response):
+    """Reply for a DetectIntentResponse (proto-plus or raw protobuf)."""
+    if isinstance(response, DetectIntentResponse):
+        response = DetectIntentResponse.pb(response)
+    result = response.query_result
+    messages = []
+    payloads = []
+    for message in result.response_messages:
+        kind = message.WhichOneof('message')
+        if kind == 'text':
+            messages.extend(message.text.text)
+        elif kind == 'payload':
+            payloads.append(json_format.MessageToDict(message.payload))
+    if result.HasField('match'):
+        intent = result.match.intent.display_name or None
+        confidence = result.match.confidence
+    else:
+        intent = confidence = None
+    return Reply(messages, payloads, intent, confidence, result.transcript or None, response.output_audio or None)
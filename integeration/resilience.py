@@ -0,0 +1,183 @@
+"""
+Deadlines, retries and circuit breaking for Dialogflow calls.
+
+Each detect_intent request gets a budget (DIALOGFLOW_REQUEST_BUDGET seconds)
+covering every attempt, failover and backoff; each gRPC call gets the
+smaller of DIALOGFLOW_CALL_TIMEOUT and what is left of the budget, so a
+slow upstream can't hold a request (and its worker) indefinitely.
+
+Text queries are retried on UNAVAILABLE and RESOURCE_EXHAUSTED up to
+DIALOGFLOW_TEXT_RETRIES times with full-jitter exponential backoff. A turn
+that timed out (DEADLINE_EXCEEDED) may already have been applied to the
+session, so it is not retried. Audio is not retried, the upload would have
+to be sent again.
+
+Each agent endpoint has a circuit breaker. After BREAKER_FAILURE_THRESHOLD
+transient failures in a row it opens and calls fail fast with CircuitOpen
+(failing over to the secondary endpoint when there is one) for
+BREAKER_RESET_SECONDS, then a single probe call is let through: success
+closes the breaker, failure opens it again. While open, replies come from
+the response cache when it has one, else DIALOGFLOW_FALLBACK_RESPONSE.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from google.api_core import exceptions as core_exceptions
+
+from .metrics import DIALOGFLOW_BREAKER_STATE, DIALOGFLOW_BREAKER_TRANSITIONS, DIALOGFLOW_RETRIES
+
+DIALOGFLOW_REQUEST_BUDGET = float(os.environ.get("DIALOGFLOW_REQUEST_BUDGET", "15"))
+DIALOGFLOW_CALL_TIMEOUT = float(os.environ.get("DIALOGFLOW_CALL_TIMEOUT", "5"))
+DIALOGFLOW_TEXT_RETRIES = int(os.environ.get("DIALOGFLOW_TEXT_RETRIES", "2"))
+DIALOGFLOW_RETRY_BASE_MS = float(os.environ.get("DIALOGFLOW_RETRY_BASE_MS", "100"))
+DIALOGFLOW_RETRY_MAX_MS = float(os.environ.get("DIALOGFLOW_RETRY_MAX_MS", "2000"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+# Reply served while the breaker is open; unset, such requests fail with 503
+DIALOGFLOW_FALLBACK_RESPONSE = os.environ.get("DIALOGFLOW_FALLBACK_RESPONSE", "")
+
+# Errors that say nothing about the request itself: worth a retry, a failover or a breaker strike
+TRANSIENT_ERRORS = (core_exceptions.ServiceUnavailable, core_exceptions.DeadlineExceeded, core_exceptions.ResourceExhausted)
+# Transient errors where Dialogflow never ran the turn, so it can be sent again
+RETRYABLE_ERRORS = (core_exceptions.ServiceUnavailable, core_exceptions.ResourceExhausted)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+# Values of the breaker state gauge
+BREAKER_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(core_exceptions.ServiceUnavailable):
+    """Raised without calling Dialogflow while an endpoint's breaker is open."""
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"Dialogflow endpoint '{endpoint}' is unavailable, retry later")
+        self.retry_after = max(1, int(retry_after + 0.5))
+
+
+class BudgetExhausted(core_exceptions.DeadlineExceeded):
+    """Raised instead of making a call once the request budget is spent."""
+
+
+class Deadline:
+    """Time left of one request's budget."""
+    __slots__ = ('expires',)
+
+    def __init__(self, budget=DIALOGFLOW_REQUEST_BUDGET):
+        self.expires = time.monotonic() + budget
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def timeout(self, cap=DIALOGFLOW_CALL_TIMEOUT):
+        """Timeout for the next call; raises BudgetExhausted once the budget is spent."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise BudgetExhausted("Dialogflow request budget exhausted")
+        return min(cap, remaining)
+
+
+def backoff(attempt):
+    """Full-jitter exponential backoff in seconds before retry number `attempt` (0-based)."""
+    return random.uniform(0, min(DIALOGFLOW_RETRY_MAX_MS, DIALOGFLOW_RETRY_BASE_MS * 2 ** attempt)) / 1000
+
+
+async def retry_async(call, deadline, retries, method):
+    """
+    `await call()`, retrying RETRYABLE_ERRORS up to `retries` times while
+    the deadline leaves room for the backoff. An open breaker is not retried.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except CircuitOpen:
+            raise
+        except RETRYABLE_ERRORS:
+            delay = backoff(attempt)
+            if attempt == retries or deadline.remaining() <= delay:
+                raise
+        DIALOGFLOW_RETRIES.labels(method).inc()
+        await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        # Guards state transitions
+        self._lock = threading.Lock()
+        self._state_gauge = DIALOGFLOW_BREAKER_STATE.labels(name)
+        self._state_gauge.set(BREAKER_STATES[CLOSED])
+
+    def _set_state(self, state):
+        self.state = state
+        self._state_gauge.set(BREAKER_STATES[state])
+        DIALOGFLOW_BREAKER_TRANSITIONS.labels(self.name, state).inc()
+
+    def _before_call(self):
+        with self._lock:
+            if self.state == OPEN:
+                waited = time.monotonic() - self._opened_at
+                if waited < self.reset_seconds:
+                    raise CircuitOpen(self.name, self.reset_seconds - waited)
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpen(self.name, 1)
+                self._probing = True
+
+    def _after_call(self, failed):
+        with self._lock:
+            self._probing = False
+            if not failed:
+                self.failures = 0
+                if self.state != CLOSED:
+                    self._set_state(CLOSED)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                if self.state != OPEN:
+                    self._set_state(OPEN)
+
+    def _release(self):
+        with self._lock:
+            self._probing = False
+
+    @contextmanager
+    def guard(self):
+        """
+        Wrap one call to the endpoint: raises CircuitOpen up front while open,
+        and counts a transient error as a failure. Any other outcome means
+        Dialogflow answered; cancelled calls and a spent budget leave the
+        count alone.
+        """
+        self._before_call()
+        try:
+            yield
+        except BudgetExhausted:
+            # The call was never made
+            self._release()
+            raise
+        except TRANSIENT_ERRORS:
+            self._after_call(failed=True)
+            raise
+        except Exception:
+            self._after_call(failed=False)
+            raise
+        except BaseException:
+            # Cancelled, or a stream closed early
+            self._release()
+            raise
+        else:
+            self._after_call(failed=False)
@@ -0,0 +1,165 @@
+"""
+Opt-in cache of Dialogflow replies for deterministic text intents.
+
+Keys are the normalized query text plus language code and agent name. Only replies whose
+matched intent is allow-listed in RESPONSE_CACHE_INTENTS are stored, so
+stateful flows always reach Dialogflow. Lookups and stores are counted in
+ai_agent_response_cache_lookups_total and ai_agent_response_cache_stores_total.
+Configuration:
+
+    RESPONSE_CACHE_ENABLED      "1" to enable
+    RESPONSE_CACHE_INTENTS      comma-separated intent display names
+    RESPONSE_CACHE_TTL          seconds (default 300)
+    RESPONSE_CACHE_MAX_ENTRIES  in-process LRU size (default 1024)
+    RESPONSE_CACHE_NORMALIZE    comma-separated subset of
+                                diacritics,tatweel,alef,whitespace (default all)
+    RESPONSE_CACHE_BACKEND      "memory" (default) or "redis"
+    RESPONSE_CACHE_REDIS_URL    for the redis backend
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from .metrics import RESPONSE_CACHE_LOOKUPS, RESPONSE_CACHE_STORES
+from .replies import Reply
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED") == "1"
+RESPONSE_CACHE_INTENTS = frozenset(
+    name.strip() for name in os.environ.get("RESPONSE_CACHE_INTENTS", "").split(",") if name.strip()
+)
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_NORMALIZE = tuple(
+    step.strip() for step in os.environ.get("RESPONSE_CACHE_NORMALIZE", "diacritics,tatweel,alef,whitespace").split(",")
+    if step.strip()
+)
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_REDIS_URL = os.environ.get("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# Arabic harakat, superscript alef and Quranic annotation marks
+_DIACRITICS = {codepoint: None for codepoint in [*range(0x064B, 0x0660), 0x0670, *range(0x06D6, 0x06EE)]}
+_TATWEEL = {0x0640: None}
+# أ إ آ ٱ -> ا
+_ALEF = {ord(c): 'ا' for c in 'أإآٱ'}
+_NORMALIZATION_TABLES = {'diacritics': _DIACRITICS, 'tatweel': _TATWEEL, 'alef': _ALEF}
+
+
+def build_normalizer(steps=RESPONSE_CACHE_NORMALIZE):
+    """Return a text -> normalized text function for the given steps."""
+    unknown = set(steps) - set(_NORMALIZATION_TABLES) - {'whitespace'}
+    if unknown:
+        raise ValueError(f"Unknown normalization steps: {', '.join(sorted(unknown))}")
+    table = {}
+    for step in steps:
+        table.update(_NORMALIZATION_TABLES.get(step, {}))
+    table = str.maketrans(table)
+    collapse_whitespace = 'whitespace' in steps
+
+    def normalize(text):
+        text = text.translate(table)
+        if collapse_whitespace:
+            text = ' '.join(text.split())
+        return text
+    return normalize
+
+
+def query_key(query, language_code, agent, normalize):
+    """Key of a text query: agent name, language code and normalized text."""
+    return f"{agent}\x00{language_code}\x00{normalize(query)}"
+
+
+class MemoryCacheBackend:
+    """In-process LRU with per-entry TTL."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """Shared backend for multi-worker deploys; eviction is left to Redis TTL/maxmemory."""
+
+    def __init__(self, url=RESPONSE_CACHE_REDIS_URL, ttl=RESPONSE_CACHE_TTL, prefix="ai-agent:reply:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise ValueError("The redis response cache backend requires redis (pip install redis)")
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key):
+        value = await self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        try:
+            return Reply.from_json(value)
+        except (ValueError, TypeError):
+            # Written by an older version as plain text; expires with its TTL
+            return None
+
+    async def set(self, key, value):
+        await self.client.set(self.prefix + key, value.to_json(), ex=max(1, int(self.ttl)))
+
+
+class ResponseCache:
+    def __init__(self, backend, allowed_intents=RESPONSE_CACHE_INTENTS, normalize=None):
+        self.backend = backend
+        self.allowed_intents = allowed_intents
+        self.normalize = normalize or build_normalizer()
+
+    def key(self, query, language_code, agent="default"):
+        return query_key(query, language_code, agent, self.normalize)
+
+    async def get(self, key):
+        value = await self.backend.get(key)
+        RESPONSE_CACHE_LOOKUPS.labels('miss' if value is None else 'hit').inc()
+        return value
+
+    async def store(self, key, reply):
+        """Cache the Reply only if the matched intent is allow-listed."""
+        if reply.intent in self.allowed_intents:
+            if reply.output_audio is not None:
+                # Speech is cached by content in speech.py, within its own bound
+                reply = reply.with_audio(None)
+            await self.backend.set(key, reply)
+            RESPONSE_CACHE_STORES.inc()
+
+
+def _create_response_cache():
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if RESPONSE_CACHE_BACKEND == "redis":
+        backend = RedisCacheBackend()
+    else:
+        backend = MemoryCacheBackend()
+    if not RESPONSE_CACHE_INTENTS:
+        logger.warning("RESPONSE_CACHE_ENABLED is set but RESPONSE_CACHE_INTENTS is empty; nothing will be cached")
+    return ResponseCache(backend)
+
+
+response_cache = _create_response_cache()
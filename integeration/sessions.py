@@ -0,0 +1,124 @@
+"""
+Registry of the conversations this worker is having.
+
+Dialogflow holds the conversation state; locally each session gets a compact
+record (SessionRecord) so that:
+
+    - later turns without routing hints stay on the agent the session
+      started on, instead of being routed to the default agent where the
+      conversation doesn't exist
+    - the QueryParameters sent with every turn are built once, not per turn
+    - concurrent conversations are bounded and counted
+      (ai_agent_sessions_active)
+
+Records live in an OrderedDict kept in last-use order: lookups are O(1),
+and sessions idle for SESSION_IDLE_SECONDS (default 30 min, Dialogflow CX's
+own session lifetime) are evicted from its front as new turns come in.
+Past SESSION_MAX_RECORDS the least recently used session is evicted; its
+conversation goes on in Dialogflow, and its next turn gets a new record.
+
+    SESSION_IDLE_SECONDS    idle time before a session is forgotten (default 1800)
+    SESSION_MAX_RECORDS     sessions kept per worker (default 100000, 0 disables the store)
+    DIALOGFLOW_TIME_ZONE    IANA time zone sent with every turn (default: the agent's)
+    DIALOGFLOW_CHANNEL      channel sent with every turn, for channel-specific responses
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from google.cloud.dialogflowcx_v3.types.session import QueryParameters
+
+from .metrics import SESSION_EVICTIONS, SESSIONS_ACTIVE
+
+SESSION_IDLE_SECONDS = float(os.environ.get("SESSION_IDLE_SECONDS", "1800"))
+SESSION_MAX_RECORDS = int(os.environ.get("SESSION_MAX_RECORDS", "100000"))
+DIALOGFLOW_TIME_ZONE = os.environ.get("DIALOGFLOW_TIME_ZONE", "")
+DIALOGFLOW_CHANNEL = os.environ.get("DIALOGFLOW_CHANNEL", "")
+
+
+def build_query_params(time_zone=DIALOGFLOW_TIME_ZONE, channel=DIALOGFLOW_CHANNEL):
+    """QueryParameters for a session's turns, or None when there is nothing to send."""
+    fields = {name: value for name, value in (('time_zone', time_zone), ('channel', channel)) if value}
+    return QueryParameters(**fields) if fields else None
+
+
+class SessionRecord:
+    """
+    What this worker knows about a session: the AgentEndpoint it talks to,
+    when it was last used (time.monotonic()) and its QueryParameters (None
+    when there are none to send).
+    """
+    __slots__ = ('session_id', 'agent', 'last_seen', 'query_params')
+
+    def __init__(self, session_id, agent, now, query_params=None):
+        self.session_id = session_id
+        self.agent = agent
+        self.last_seen = now
+        self.query_params = query_params
+
+    def __repr__(self):
+        return f"SessionRecord({self.session_id}, {self.agent.name})"
+
+
+class SessionStore:
+    def __init__(self, idle_seconds=SESSION_IDLE_SECONDS, max_records=SESSION_MAX_RECORDS, clock=time.monotonic):
+        self.idle_seconds = idle_seconds
+        self.max_records = max_records
+        self.clock = clock
+        # session_id -> SessionRecord, least recently used first
+        self._records = OrderedDict()
+        # Callers of the blocking Dialogflow.detect_intent can be in several threads
+        self._lock = threading.Lock()
+        # Every session gets the same parameters today; built once and shared
+        self._query_params = build_query_params()
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, session_id):
+        """The session's record, or None if it is unknown or has been idle too long."""
+        if session_id is None:
+            return None
+        with self._lock:
+            record = self._records.get(session_id)
+            if record is not None and self.clock() - record.last_seen > self.idle_seconds:
+                self._evict(session_id, 'idle')
+                return None
+        return record
+
+    def turn(self, session_id, agent):
+        """
+        Record a turn of the session with `agent` (an AgentEndpoint), opening
+        a record for sessions seen for the first time, and return it.
+        """
+        now = self.clock()
+        with self._lock:
+            self._evict_idle(now)
+            record = self._records.get(session_id)
+            if record is None:
+                record = self._records[session_id] = SessionRecord(session_id, agent, now, self._query_params)
+                while len(self._records) > self.max_records:
+                    self._evict(next(iter(self._records)), 'capacity')
+                SESSIONS_ACTIVE.set(len(self._records))
+            else:
+                self._records.move_to_end(session_id)
+                record.agent = agent
+                record.last_seen = now
+        return record
+
+    def _evict_idle(self, now):
+        # Records are in last-use order, so the idle ones are at the front
+        while self._records:
+            session_id, record = next(iter(self._records.items()))
+            if now - record.last_seen <= self.idle_seconds:
+                break
+            self._evict(session_id, 'idle')
+
+    def _evict(self, session_id, reason):
+        del self._records[session_id]
+        SESSION_EVICTIONS.labels(reason).inc()
+        SESSIONS_ACTIVE.set(len(self._records))
+
+
+session_store = SessionStore() if SESSION_MAX_RECORDS > 0 else None
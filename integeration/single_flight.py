@@ -0,0 +1,76 @@
+"""
+Opt-in coalescing of identical concurrent text queries.
+
+When many users send the same message at once (e.g. the opening message of
+a campaign), only the first one (the leader) calls Dialogflow; the others
+wait for its reply. Keys are the normalized query text (same normalization
+as the response cache) plus language code and agent name.
+
+The shared reply is only handed out when the intent the leader matched is
+listed in COALESCE_INTENTS, which should hold stateless or first-turn
+intents only: the waiters' own sessions never see the turn. For any other
+intent each waiter makes its own call once the leader is done. An error
+from the leader's call is raised to its waiters too.
+
+    COALESCE_INTENTS    comma-separated intent display names (empty: disabled)
+"""
+import asyncio
+import os
+
+from .metrics import COALESCED, annotate, stage
+from .response_cache import build_normalizer, query_key
+
+COALESCE_INTENTS = frozenset(
+    name.strip() for name in os.environ.get("COALESCE_INTENTS", "").split(",") if name.strip()
+)
+
+
+class SingleFlight:
+    def __init__(self, allowed_intents=COALESCE_INTENTS, normalize=None):
+        self.allowed_intents = allowed_intents
+        self.normalize = normalize or build_normalizer()
+        # key -> future of the leader's (reply, intent_name), or None if it was cancelled
+        self._calls = {}
+
+    def key(self, query, language_code, agent="default"):
+        return query_key(query, language_code, agent, self.normalize)
+
+    async def run(self, key, call):
+        """
+        Return the Reply for `key`, from `await call()` (which returns
+        (reply, intent_name)) or from an identical call in flight.
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            with stage('coalesced_wait'):
+                # Shielded: a waiter going away must not cancel the leader's call
+                shared = await asyncio.shield(future)
+            if shared is not None and shared[1] in self.allowed_intents:
+                COALESCED.labels('shared').inc()
+                annotate(coalesced=True)
+                return shared[0]
+            COALESCED.labels('not_allowed' if shared is not None else 'leader_cancelled').inc()
+            reply, _ = await call()
+            return reply
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        COALESCED.labels('leader').inc()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            # Waiters make their own calls
+            future.set_result(None)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved so a leader without waiters doesn't log it again
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[key]
+        return result[0]
+
+
+single_flight = SingleFlight() if COALESCE_INTENTS else None
@@ -0,0 +1,102 @@
+"""
+Spoken replies, synthesized by Dialogflow.
+
+With OUTPUT_AUDIO=1, turns that ask for it (see views/encoding.py) send
+an OutputAudioConfig in the same DetectIntentRequest (or the first
+StreamingDetectIntentRequest), and Dialogflow returns the reply's speech
+with it: voice clients no longer make a text-to-speech call of their own.
+
+Synthesized audio is cached by content, under a hash of the reply's text
+messages, its language and the voice settings, in an LRU bounded by
+SYNTHESIS_CACHE_MAX_BYTES. Replies answered without a Dialogflow call
+(response cache hits, the breaker's fallback response) take their speech
+from it, so common replies are not synthesized again; a response cache hit
+whose speech isn't cached goes to Dialogflow instead. Those are its only
+readers, so without the response cache or DIALOGFLOW_FALLBACK_RESPONSE
+there is no synthesis cache.
+
+    OUTPUT_AUDIO                 1 lets turns ask for spoken replies (default 0)
+    OUTPUT_AUDIO_ENCODING        linear16 (WAV), mp3, mp3_64_kbps, ogg_opus, mulaw or alaw (default mp3)
+    OUTPUT_AUDIO_SAMPLE_RATE     sample rate in Hz (default 0: the voice's own)
+    TTS_VOICE                    voice name, e.g. ar-XA-Wavenet-B (default: the agent's)
+    TTS_SPEAKING_RATE            0.25 to 4.0 (default 1.0)
+    SYNTHESIS_CACHE_MAX_BYTES    cache size (default 32 MB, 0 disables the cache)
+"""
+import os
+
+from google.cloud.dialogflowcx_v3.types.audio_config import (
+    OutputAudioConfig, OutputAudioEncoding, SynthesizeSpeechConfig, VoiceSelectionParams
+)
+
+from .conversion_cache import MemoryTier, content_hash
+from .metrics import SYNTHESIS_CACHE_BYTES, SYNTHESIS_CACHE_LOOKUPS
+from .resilience import DIALOGFLOW_FALLBACK_RESPONSE
+from .response_cache import response_cache
+
+OUTPUT_AUDIO = os.environ.get("OUTPUT_AUDIO") == "1"
+OUTPUT_AUDIO_ENCODING = os.environ.get("OUTPUT_AUDIO_ENCODING", "mp3")
+OUTPUT_AUDIO_SAMPLE_RATE = int(os.environ.get("OUTPUT_AUDIO_SAMPLE_RATE", "0"))
+TTS_VOICE = os.environ.get("TTS_VOICE", "")
+TTS_SPEAKING_RATE = float(os.environ.get("TTS_SPEAKING_RATE", "1.0"))
+SYNTHESIS_CACHE_MAX_BYTES = int(os.environ.get("SYNTHESIS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Output encoding -> (Dialogflow encoding, media type of the audio it returns)
+OUTPUT_ENCODINGS = {
+    # Dialogflow adds a WAV header to uncompressed and G.711 speech
+    'linear16': (OutputAudioEncoding.OUTPUT_AUDIO_ENCODING_LINEAR_16, 'audio/wav'),
+    'mp3': (OutputAudioEncoding.OUTPUT_AUDIO_ENCODING_MP3, 'audio/mpeg'),
+    'mp3_64_kbps': (OutputAudioEncoding.OUTPUT_AUDIO_ENCODING_MP3_64_KBPS, 'audio/mpeg'),
+    'ogg_opus': (OutputAudioEncoding.OUTPUT_AUDIO_ENCODING_OGG_OPUS, 'audio/ogg'),
+    'mulaw': (OutputAudioEncoding.OUTPUT_AUDIO_ENCODING_MULAW, 'audio/wav'),
+    'alaw': (OutputAudioEncoding.OUTPUT_AUDIO_ENCODING_ALAW, 'audio/wav'),
+}
+if OUTPUT_AUDIO_ENCODING not in OUTPUT_ENCODINGS:
+    raise ValueError(f"Unknown OUTPUT_AUDIO_ENCODING '{OUTPUT_AUDIO_ENCODING}', expected one of: {', '.join(OUTPUT_ENCODINGS)}")
+OUTPUT_MEDIA_TYPE = OUTPUT_ENCODINGS[OUTPUT_AUDIO_ENCODING][1]
+
+
+def build_output_audio_config(encoding=OUTPUT_AUDIO_ENCODING, sample_rate_hertz=OUTPUT_AUDIO_SAMPLE_RATE, voice=TTS_VOICE, speaking_rate=TTS_SPEAKING_RATE):
+    speech = SynthesizeSpeechConfig(speaking_rate=speaking_rate, voice=VoiceSelectionParams(name=voice) if voice else None)
+    return OutputAudioConfig(
+        audio_encoding=OUTPUT_ENCODINGS[encoding][0], sample_rate_hertz=sample_rate_hertz, synthesize_speech_config=speech
+    )
+
+
+# Every spoken turn sends the same config; None when spoken replies are off
+OUTPUT_AUDIO_CONFIG = build_output_audio_config() if OUTPUT_AUDIO else None
+
+
+def spoken_text(reply):
+    """What Dialogflow speaks for a Reply: its text messages in order."""
+    return "\n".join(reply.messages)
+
+
+class SynthesisCache:
+    def __init__(self, max_bytes=SYNTHESIS_CACHE_MAX_BYTES):
+        self.memory = MemoryTier(max_bytes, SYNTHESIS_CACHE_BYTES)
+        # Part of every key: speech synthesized with other settings never matches
+        self._voice = f"{OUTPUT_AUDIO_ENCODING}-{OUTPUT_AUDIO_SAMPLE_RATE}-{TTS_VOICE}-{TTS_SPEAKING_RATE}"
+
+    def key(self, reply, language_code):
+        return content_hash(f"{self._voice}\x00{language_code}\x00{spoken_text(reply)}".encode("utf-8"))
+
+    def get(self, key):
+        """Synthesized audio for the key, or None."""
+        value = self.memory.get(key)
+        SYNTHESIS_CACHE_LOOKUPS.labels('miss' if value is None else 'hit').inc()
+        return value
+
+    def put(self, key, audio):
+        self.memory.put(key, audio)
+
+
+def _create_synthesis_cache():
+    if not OUTPUT_AUDIO or SYNTHESIS_CACHE_MAX_BYTES <= 0:
+        return None
+    if response_cache is None and not DIALOGFLOW_FALLBACK_RESPONSE:
+        # Nothing would read it back
+        return None
+    return SynthesisCache()
+
+
+synthesis_cache = _create_synthesis_cache()
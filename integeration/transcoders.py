@@ -0,0 +1,182 @@
+"""
+Pluggable audio transcoder backends.
+
+Every backend turns an uploaded m4a/mp4 into 16kHz mono audio in the
+target encoding (AUDIO_TARGET_ENCODING: LINEAR16 WAV, FLAC or Ogg Opus) and
+is selected with AUDIO_TRANSCODE_MODE:
+
+    pydub        pydub in the audio pool, ffmpeg temp files as fallback (default)
+    ffmpeg       ffmpeg subprocess with temp files, in the audio pool
+    ffmpeg-pipe  async ffmpeg subprocess over stdin/stdout, no temp files
+    pyav         libav through PyAV in long-lived worker processes that keep
+                 decoder contexts initialized across requests
+"""
+import abc
+import importlib.util
+import io
+import logging
+import os
+
+from .audio import (
+    AUDIO_TARGET_ENCODING, OPUS_BITRATE, TARGET_ENCODINGS, TARGET_SAMPLE_RATE, convert_audio, convert_with_ffmpeg_pipe,
+    convert_with_ffmpeg_tempfile, wav_header,
+)
+from .audio_pool import AudioPool, audio_pool
+
+logger = logging.getLogger(__name__)
+
+# PyAV for the pooled libav backend, imported only inside its worker processes
+PYAV_AVAILABLE = importlib.util.find_spec("av") is not None
+
+AUDIO_TRANSCODE_MODE = os.environ.get("AUDIO_TRANSCODE_MODE", "pydub")
+# Decoder contexts kept per pyav worker, keyed by codec parameters
+PYAV_DECODER_CACHE_SIZE = 16
+# libav encoder for each compressed target encoding
+PYAV_ENCODERS = {'flac': 'flac', 'ogg_opus': 'libopus'}
+
+
+class Transcoder(abc.ABC):
+    """Backend interface: async convert(audio_bytes, input_format, encoding) -> converted bytes."""
+    name = None
+
+    @abc.abstractmethod
+    async def convert(self, audio_bytes, input_format, encoding=AUDIO_TARGET_ENCODING):
+        """Converted audio (bytes) of audio_bytes, an upload in input_format."""
+
+    def close(self):
+        pass
+
+
+class PoolTranscoder(Transcoder):
+    """Runs a blocking conversion function in an AudioPool."""
+
+    def __init__(self, name, fn, pool):
+        self.name = name
+        self.fn = fn
+        self.pool = pool
+
+    async def convert(self, audio_bytes, input_format, encoding=AUDIO_TARGET_ENCODING):
+        if self.pool.kind == 'process' and isinstance(audio_bytes, memoryview):
+            # memoryviews can't be pickled to worker processes
+            audio_bytes = audio_bytes.tobytes()
+        return await self.pool.run(self.fn, audio_bytes, input_format, encoding)
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class FfmpegPipeTranscoder(Transcoder):
+    name = 'ffmpeg-pipe'
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def convert(self, audio_bytes, input_format, encoding=AUDIO_TARGET_ENCODING):
+        async with self.pool.slot():
+            return await convert_with_ffmpeg_pipe(audio_bytes, input_format, encoding)
+
+
+# --- PyAV worker side -------------------------------------------------------
+# These run inside the pyav pool's worker processes; the module-level cache
+# lives as long as the worker does.
+
+_pyav_decoders = {}
+
+
+def _init_pyav_worker():
+    import av
+    av.logging.set_level(av.logging.ERROR)
+
+
+def _get_pyav_decoder(stream_context):
+    key = (stream_context.name, stream_context.sample_rate, stream_context.layout.name, bytes(stream_context.extradata or b''))
+    decoder = _pyav_decoders.get(key)
+    if decoder is None:
+        if len(_pyav_decoders) >= PYAV_DECODER_CACHE_SIZE:
+            _pyav_decoders.pop(next(iter(_pyav_decoders)))
+        import av
+        decoder = av.CodecContext.create(stream_context.name, 'r')
+        decoder.extradata = stream_context.extradata
+        decoder.sample_rate = stream_context.sample_rate
+        decoder.layout = stream_context.layout
+        _pyav_decoders[key] = decoder
+    return decoder
+
+
+def _pyav_frames(container):
+    """Decode the first audio stream with a cached decoder, resampled to 16kHz mono s16."""
+    import av
+    stream = container.streams.audio[0]
+    decoder = _get_pyav_decoder(stream.codec_context)
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=TARGET_SAMPLE_RATE)
+    try:
+        for packet in container.demux(stream):
+            for frame in decoder.decode(packet):
+                yield from resampler.resample(frame)
+    finally:
+        # Leave the cached decoder clean for the next request
+        decoder.flush_buffers()
+    yield from resampler.resample(None)
+
+
+def convert_with_pyav(audio_bytes, input_format='mp4', encoding='linear16'):
+    """Decode with a cached libav decoder and resample to 16kHz mono s16, encoded to the target encoding."""
+    import av
+    try:
+        with av.open(io.BytesIO(audio_bytes)) as container:
+            if encoding == 'linear16':
+                wav = bytearray(44)
+                for out in _pyav_frames(container):
+                    wav += memoryview(out.planes[0])[:out.samples * 2]
+                wav[:44] = wav_header(len(wav) - 44)
+                return bytes(wav)
+            output_buffer = io.BytesIO()
+            with av.open(output_buffer, 'w', format=TARGET_ENCODINGS[encoding][0]) as output:
+                output_stream = output.add_stream(PYAV_ENCODERS[encoding], rate=TARGET_SAMPLE_RATE, layout='mono')
+                if encoding == 'ogg_opus':
+                    output_stream.bit_rate = OPUS_BITRATE
+                    output_stream.codec_context.options = {'application': 'voip'}
+                # The encoder rebuffers frames to its own frame size
+                for out in _pyav_frames(container):
+                    output.mux(output_stream.encode(out))
+                output.mux(output_stream.encode(None))
+            return output_buffer.getvalue()
+    except (av.FFmpegError, IndexError) as e:
+        raise ValueError(f"Failed to convert audio from {input_format} to {encoding} with PyAV: {str(e)}")
+
+
+# --- Registry ---------------------------------------------------------------
+
+def create_transcoder(name):
+    if name == 'pydub':
+        return PoolTranscoder('pydub', convert_audio, audio_pool)
+    if name == 'ffmpeg':
+        return PoolTranscoder('ffmpeg', convert_with_ffmpeg_tempfile, audio_pool)
+    if name == 'ffmpeg-pipe':
+        return FfmpegPipeTranscoder(audio_pool)
+    if name == 'pyav':
+        if not PYAV_AVAILABLE:
+            raise ValueError("The pyav transcoder requires PyAV (pip install av)")
+        return PoolTranscoder('pyav', convert_with_pyav, AudioPool(kind='process', initializer=_init_pyav_worker))
+    raise ValueError(f"Unknown audio transcoder: {name}")
+
+
+TRANSCODER_NAMES = ('pydub', 'ffmpeg', 'ffmpeg-pipe', 'pyav')
+_transcoder = None
+
+
+def get_transcoder():
+    """The transcoder selected by AUDIO_TRANSCODE_MODE, created on first use."""
+    global _transcoder
+    if _transcoder is None:
+        _transcoder = create_transcoder(AUDIO_TRANSCODE_MODE)
+        logger.info(f"Using {_transcoder.name} audio transcoder")
+    return _transcoder
+
+
+def shutdown_transcoders():
+    global _transcoder
+    if _transcoder is not None:
+        _transcoder.close()
+        _transcoder = None
+    audio_pool.shutdown()
@@ -0,0 +1,86 @@
+"""
+Energy-based voice activity detection, to trim silence before upload.
+
+Voice notes often start and end with seconds of silence that would be
+converted, sent and billed for nothing. With SILENCE_TRIM=1, 16-bit mono PCM
+(uploaded as WAV, or decoded from audio that needs transcoding anyway) is cut
+into SILENCE_FRAME_MS frames whose energy is compared to
+SILENCE_THRESHOLD_DBFS with NumPy, and everything before the first and after
+the last voiced frame is dropped, keeping SILENCE_PADDING_MS on each side.
+
+A recording with less than SILENCE_MIN_SPEECH_MS of voiced frames (including
+a header-only WAV) is rejected with NoSpeechDetected when
+REJECT_SILENT_AUDIO=1, and sent untrimmed otherwise. FLAC, Ogg Opus and
+G.711 audio that Dialogflow takes as is is not decoded just for this.
+
+    SILENCE_TRIM              1 enables trimming
+    SILENCE_THRESHOLD_DBFS    frames quieter than this are silence (default -45)
+    SILENCE_FRAME_MS          analysis frame length (default 20)
+    SILENCE_PADDING_MS        audio kept around the speech (default 300)
+    SILENCE_MIN_SPEECH_MS     voiced audio needed to count as speech (default 100)
+    REJECT_SILENT_AUDIO       1 rejects recordings without speech (with SILENCE_TRIM)
+"""
+import math
+import os
+
+import numpy as np
+
+from .audio import NoSpeechDetected, wav_header
+from .audio_headers import AudioInfo
+
+SILENCE_THRESHOLD_DBFS = float(os.environ.get("SILENCE_THRESHOLD_DBFS", "-45"))
+SILENCE_FRAME_MS = int(os.environ.get("SILENCE_FRAME_MS", "20"))
+SILENCE_PADDING_MS = int(os.environ.get("SILENCE_PADDING_MS", "300"))
+SILENCE_MIN_SPEECH_MS = int(os.environ.get("SILENCE_MIN_SPEECH_MS", "100"))
+REJECT_SILENT_AUDIO = os.environ.get("REJECT_SILENT_AUDIO") == "1"
+SILENCE_TRIM = os.environ.get("SILENCE_TRIM") == "1"
+
+# Mean squared sample value of a frame at the threshold
+THRESHOLD_POWER = (32768 * 10 ** (SILENCE_THRESHOLD_DBFS / 20)) ** 2
+
+
+def trimmable(info):
+    """True if trimming is on and `info` describes 16-bit mono PCM WAV."""
+    return SILENCE_TRIM and info is not None and info.encoding == 'linear16' and info.channels == 1
+
+
+def speech_bounds(samples, sample_rate):
+    """
+    (start, end) sample indexes of the speech in an int16 array, padded by
+    SILENCE_PADDING_MS, or None when less than SILENCE_MIN_SPEECH_MS is voiced.
+    """
+    frame = max(sample_rate * SILENCE_FRAME_MS // 1000, 1)
+    count = len(samples) // frame
+    if not count:
+        return None
+    frames = samples[:count * frame].reshape(count, frame).astype(np.float32)
+    power = np.einsum('ij,ij->i', frames, frames) / frame
+    voiced = np.flatnonzero(power > THRESHOLD_POWER)
+    if len(voiced) < math.ceil(SILENCE_MIN_SPEECH_MS / SILENCE_FRAME_MS):
+        return None
+    padding = sample_rate * SILENCE_PADDING_MS // 1000
+    return max(int(voiced[0]) * frame - padding, 0), min((int(voiced[-1]) + 1) * frame + padding, len(samples))
+
+
+def trim_silence(wav, info):
+    """
+    Cut leading and trailing silence from the 16-bit mono PCM WAV `info`
+    describes (bytes or a memoryview).
+
+    Returns:
+        tuple: (WAV bytes, AudioInfo, outcome): 'trimmed', or the input as is
+        with 'unchanged' or 'no_speech'. Raises NoSpeechDetected instead of
+        'no_speech' when REJECT_SILENT_AUDIO is on.
+    """
+    samples = np.frombuffer(wav, dtype='<i2', count=info.frames, offset=info.data_offset)
+    bounds = speech_bounds(samples, info.sample_rate)
+    if bounds is None:
+        if REJECT_SILENT_AUDIO:
+            raise NoSpeechDetected("No speech detected in the recording")
+        return wav, info, 'no_speech'
+    start, end = bounds
+    if start == 0 and end == info.frames:
+        return wav, info, 'unchanged'
+    frames = end - start
+    trimmed = wav_header(frames * 2, info.sample_rate) + samples[start:end].tobytes()
+    return trimmed, AudioInfo('pcm', info.sample_rate, 1, 16, frames=frames, data_offset=44, block_align=2), 'trimmed'
@@ -1,12 +1,35 @@
 from fastapi import FastAPI, Request
 from pydantic import BaseModel
-from views import ai_agent
+from contextlib import asynccontextmanager
+from integeration import shutdown_transcoders
+from views import ai_agent, health, metrics
+from views.limits import BodySizeLimitMiddleware
+from views.health import start_warm_up
+from views.metrics import MetricsMiddleware
 
+import logging
+import os
 import uvicorn
 
-app = FastAPI(title='Ai Agent CW', version='1.0.0')
+# The app owns logging setup; LOG_LEVEL=DEBUG turns on the per-stage audio logs
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect to Dialogflow in the background; /readyz reports when it's done
+    start_warm_up(app)
+    yield
+    app.state.warm_up.cancel()
+    shutdown_transcoders()
+
+app = FastAPI(title='Ai Agent CW', version='1.0.0', lifespan=lifespan)
+app.add_middleware(BodySizeLimitMiddleware)
+# Outermost, so 413s from the size limit are counted too
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(ai_agent.router, prefix='/ai-agent')
+app.include_router(metrics.router)
+app.include_router(health.router)
 
 class Model(BaseModel):
     message: str
@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+from google.api_core import exceptions as core_exceptions
+
+from integeration import agents
+from integeration.agents import AgentRegistry, LatencyTracker, call_async
+from integeration.resilience import BudgetExhausted
+
+DEFAULTS = {
+    "project_id": "project",
+    "location": "global",
+    "agent_id": "agent",
+    "language_code": "ar",
+    "api_endpoint": "dialogflow.googleapis.com:443",
+}
+
+
+def build_registry(config):
+    # Each pooled "client" is just the name of its endpoint
+    return AgentRegistry.from_config(config, DEFAULTS, lambda endpoint: endpoint.name)
+
+
+def pair(prefix):
+    return build_registry({"agents": {
+        f"{prefix}-us": {"location": "us-central1", "secondary": f"{prefix}-eu"},
+        f"{prefix}-eu": {"location": "europe-west1"},
+    }}).endpoints[f"{prefix}-us"]
+
+
+def upstream(behaviour):
+    """A call whose behaviour per endpoint is a reply, an exception, or (delay, reply)."""
+    calls = []
+
+    async def call(endpoint, client):
+        calls.append(client)
+        outcome = behaviour[client]
+        if isinstance(outcome, tuple):
+            delay, outcome = outcome
+            await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return call, calls
+
+
+def test_latency_tracker():
+    latency = LatencyTracker(window=20)
+    assert latency.p95() is None and not latency.degraded(0.5)
+    for ms in range(1, 21):
+        latency.observe(ms / 100)
+    assert latency.p95() == 0.2
+    assert latency.degraded(0.15) and not latency.degraded(0.2)
+    assert 0.01 < latency.ewma < 0.2
+
+
+def test_config_fills_in_defaults():
+    endpoint = build_registry({"agents": {"eu": {"location": "europe-west1"}}}).default
+    assert endpoint.api_endpoint == "europe-west1-dialogflow.googleapis.com:443"
+    assert endpoint.session_path("s1") == "projects/project/locations/europe-west1/agents/agent/sessions/s1"
+
+
+def test_resolve_routes():
+    registry = build_registry({
+        "default": "main",
+        "agents": {"main": {}, "acme": {}, "en": {"language_code": "en"}},
+        "routes": {"tenants": {"acme": "acme"}, "languages": {"en": "en"}},
+    })
+    assert registry.resolve().name == "main"
+    assert registry.resolve(agent="en", tenant="acme").name == "en"
+    assert registry.resolve(tenant="acme", language="en").name == "acme"
+    assert registry.resolve(language="en-GB").name == "en"
+    assert registry.resolve(tenant="other", language="fr").name == "main"
+    with pytest.raises(ValueError, match="Unknown agent 'missing'"):
+        registry.resolve(agent="missing")
+
+
+@pytest.mark.parametrize('config, message', [
+    ({"agents": {"us": {"secondary": "eu"}}}, "Unknown agent 'eu'"),
+    ({"agents": {"us": {"secondary": "en"}, "en": {"language_code": "en"}}}, "same language_code"),
+    ({"agents": {"us": {}}, "routes": {"tenants": {"acme": "eu"}}}, "route target"),
+])
+def test_invalid_config(config, message):
+    with pytest.raises(ValueError, match=message):
+        build_registry(config)
+
+
+def test_fails_over_on_transient_errors():
+    endpoint = pair('failover')
+    call, calls = upstream({'failover-us': core_exceptions.ServiceUnavailable("down"), 'failover-eu': 'reply'})
+    assert asyncio.run(call_async(endpoint, call)) == 'reply'
+    assert calls == ['failover-us', 'failover-eu']
+
+
+@pytest.mark.parametrize('error', [core_exceptions.InvalidArgument("bad"), BudgetExhausted("spent")])
+def test_does_not_fail_over_on_other_errors(error):
+    endpoint = pair(f'no-failover-{type(error).__name__}')
+    call, calls = upstream({endpoint.name: error, endpoint.secondary.name: 'reply'})
+    with pytest.raises(type(error)):
+        asyncio.run(call_async(endpoint, call))
+    assert calls == [endpoint.name]
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    monkeypatch.setattr(agents, 'DIALOGFLOW_HEDGING', True)
+    monkeypatch.setattr(agents, 'DIALOGFLOW_HEDGE_P95_MS', 20)
+
+
+def degrade(endpoint):
+    # Well past the p95 threshold, which degraded() takes from the environment
+    for _ in range(10):
+        endpoint.latency.observe(60.0)
+
+
+def test_healthy_endpoint_is_not_hedged(hedging):
+    endpoint = pair('healthy')
+    call, calls = upstream({'healthy-us': (0.05, 'primary'), 'healthy-eu': 'secondary'})
+    assert asyncio.run(call_async(endpoint, call)) == 'primary'
+    assert calls == ['healthy-us']
+
+
+def test_slow_primary_is_hedged(hedging):
+    endpoint = pair('slow')
+    degrade(endpoint)
+    call, calls = upstream({'slow-us': (1.0, 'primary'), 'slow-eu': 'secondary'})
+    assert asyncio.run(call_async(endpoint, call)) == 'secondary'
+    assert calls == ['slow-us', 'slow-eu']
+    # The losing primary was cancelled and released its channel
+    assert endpoint.async_clients.in_flight == [0] * endpoint.async_clients.size
+
+
+def test_primary_answering_within_the_delay_wins(hedging):
+    endpoint = pair('quick')
+    degrade(endpoint)
+    call, calls = upstream({'quick-us': 'primary', 'quick-eu': 'secondary'})
+    assert asyncio.run(call_async(endpoint, call)) == 'primary'
+    assert calls == ['quick-us']
+
+
+def test_failed_primary_is_hedged_at_once(hedging):
+    endpoint = pair('failed')
+    degrade(endpoint)
+    call, calls = upstream({'failed-us': core_exceptions.ServiceUnavailable("down"), 'failed-eu': 'secondary'})
+    assert asyncio.run(call_async(endpoint, call)) == 'secondary'
+
+
+def test_hedge_raises_when_both_fail(hedging):
+    endpoint = pair('both')
+    degrade(endpoint)
+    call, calls = upstream({
+        'both-us': (0.05, core_exceptions.ServiceUnavailable("us")),
+        'both-eu': core_exceptions.ResourceExhausted("eu"),
+    })
+    with pytest.raises(core_exceptions.ResourceExhausted):
+        asyncio.run(call_async(endpoint, call))
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+from google.cloud.dialogflowcx_v3.types.audio_config import AudioEncoding
+
+from integeration.audio import UnsupportedAudioFormat, wav_header
+from integeration.audio_headers import AudioInfo, conversion_reason, parse_flac, parse_wav, wav_data_offset
+from integeration.dialogflow import Dialogflow
+
+
+def chunk(chunk_id, body):
+    return chunk_id + len(body).to_bytes(4, 'little') + body + b'\x00' * (len(body) & 1)
+
+
+def fmt_chunk(channels=1, sample_rate=16000, bits=16, format_tag=1):
+    block_align = channels * bits // 8
+    return chunk(b'fmt ', (
+        format_tag.to_bytes(2, 'little') + channels.to_bytes(2, 'little') + sample_rate.to_bytes(4, 'little')
+        + (sample_rate * block_align).to_bytes(4, 'little') + block_align.to_bytes(2, 'little')
+        + bits.to_bytes(2, 'little')
+    ))
+
+
+def riff(*chunks):
+    body = b'WAVE' + b''.join(chunks)
+    return b'RIFF' + len(body).to_bytes(4, 'little') + body
+
+
+def test_canonical_wav():
+    info = parse_wav(wav_header(3200) + b'\x00' * 3200)
+    assert (info.codec, info.sample_rate, info.channels, info.bits_per_sample) == ('pcm', 16000, 1, 16)
+    assert (info.frames, info.data_offset, info.encoding) == (1600, 44, 'linear16')
+    assert conversion_reason(info) is None
+
+
+def test_wav_with_extra_chunks():
+    # An odd-sized LIST chunk before fmt and a JUNK chunk between fmt and data
+    data = riff(chunk(b'LIST', b'INFOabc'), fmt_chunk(), chunk(b'JUNK', b'\x00' * 28), chunk(b'data', b'\x01\x00' * 10))
+    info = parse_wav(data)
+    assert info.frames == 10
+    assert data[info.data_offset:] == b'\x01\x00' * 10
+
+
+def test_truncated_wav_counts_the_frames_present():
+    data = wav_header(32000) + b'\x00' * 100
+    assert parse_wav(data).frames == 50
+
+
+def test_streamed_wav_without_data_size():
+    data = bytearray(wav_header(0) + b'\x00' * 64)
+    data[40:44] = (0xFFFFFFFF).to_bytes(4, 'little')
+    assert parse_wav(bytes(data)).frames == 32
+
+
+def test_wav_through_memoryview():
+    info = parse_wav(memoryview(wav_header(8) + b'\x00' * 8))
+    assert info.frames == 4
+
+
+@pytest.mark.parametrize('data, message', [
+    (b'RIFF\x00\x00\x00\x00WAVE' + b'fmt \x10\x00\x00\x00\x01\x00', "Truncated WAV fmt chunk"),
+    (riff(fmt_chunk()), "no data chunk"),
+    (riff(chunk(b'data', b'\x00' * 4), fmt_chunk()), "before its fmt chunk"),
+    (riff(chunk(b'LIST', b'')), "no fmt chunk"),
+    (b'RIFX\x00\x00\x00\x00WAVE', "Not a RIFF/WAVE file"),
+])
+def test_malformed_wav(data, message):
+    with pytest.raises(UnsupportedAudioFormat, match=message):
+        parse_wav(data)
+
+
+def test_extensible_wav_uses_the_sub_format():
+    extensible = (
+        (0xFFFE).to_bytes(2, 'little') + (2).to_bytes(2, 'little') + (48000).to_bytes(4, 'little')
+        + (48000 * 6).to_bytes(4, 'little') + (6).to_bytes(2, 'little') + (24).to_bytes(2, 'little')
+        + (22).to_bytes(2, 'little') + (24).to_bytes(2, 'little') + (3).to_bytes(4, 'little')
+        + (1).to_bytes(2, 'little') + b'\x00' * 14
+    )
+    info = parse_wav(riff(chunk(b'fmt ', extensible), chunk(b'data', b'\x00' * 12)))
+    assert (info.codec, info.channels, info.bits_per_sample, info.frames) == ('pcm', 2, 24, 2)
+    assert conversion_reason(info) == 'bit_depth'
+
+
+def test_flac_streaminfo():
+    # 16 kHz, mono, 16-bit, 48000 samples
+    fields = (16000 << 44) | (0 << 41) | (15 << 36) | 48000
+    data = b'fLaC' + b'\x00' + (34).to_bytes(3, 'big') + b'\x00' * 10 + fields.to_bytes(8, 'big') + b'\x00' * 16
+    info = parse_flac(data)
+    assert (info.codec, info.sample_rate, info.channels, info.bits_per_sample, info.frames) == ('flac', 16000, 1, 16, 48000)
+    assert conversion_reason(info) is None
+
+
+@pytest.mark.parametrize('info, reason', [
+    (AudioInfo('pcm', 16000, 2, 16, block_align=4), 'channels'),
+    (AudioInfo('pcm', 16000, 1, 8, block_align=1), 'bit_depth'),
+    (AudioInfo('pcm', 96000, 1, 16, block_align=2), 'sample_rate'),
+    (AudioInfo('vorbis', 44100, 1, 16), 'codec'),
+    (AudioInfo('opus', 48000, 1, 16), None),
+    (AudioInfo('mulaw', 8000, 1, 8, block_align=1), None),
+])
+def test_conversion_reason(info, reason):
+    assert conversion_reason(info) == reason
+
+
+def test_wav_data_offset():
+    data = riff(chunk(b'LIST', b'INFOabc'), fmt_chunk(), chunk(b'data', b'\x00' * 4))
+    assert wav_data_offset(data) == len(data) - 4
+    # Cut inside the data chunk header
+    assert wav_data_offset(data[:len(data) - 8]) is None
+
+
+def stream(data, size=1000):
+    async def chunks():
+        for offset in range(0, len(data), size):
+            yield data[offset:offset + size]
+    return chunks()
+
+
+async def prepare_stream(data):
+    encoding, sample_rate, payload, byte_rate = await Dialogflow()._prepare_audio_stream(stream(data))
+    return encoding, sample_rate, b''.join([chunk async for chunk in payload]), byte_rate
+
+
+def test_streamed_wav_with_a_long_header():
+    samples = b'\x01\x00' * 800
+    data = riff(fmt_chunk(), chunk(b'LIST', b'INFO' + b'x' * 10000), chunk(b'data', samples))
+    encoding, sample_rate, payload, byte_rate = asyncio.run(prepare_stream(data))
+    assert (encoding, sample_rate, byte_rate) == (AudioEncoding.AUDIO_ENCODING_LINEAR_16, 16000, 32000)
+    assert payload == samples
+
+
+def test_streamed_wav_without_a_data_chunk():
+    with pytest.raises(UnsupportedAudioFormat):
+        asyncio.run(prepare_stream(riff(fmt_chunk(), chunk(b'LIST', b'INFO' + b'x' * 10000))))
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from integeration.audio_pool import AudioPool, AudioPoolBusy
+
+
+class Concurrency:
+    """Records the most jobs seen running at once, from threads and the event loop alike."""
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+    def exit(self):
+        with self._lock:
+            self.running -= 1
+
+    def job(self):
+        self.enter()
+        time.sleep(0.02)
+        self.exit()
+
+
+def test_run_and_slot_share_the_workers():
+    pool = AudioPool(workers=2, queue_size=8, kind='thread')
+    concurrency = Concurrency()
+
+    async def slot_job():
+        async with pool.slot():
+            concurrency.enter()
+            await asyncio.sleep(0.02)
+            concurrency.exit()
+
+    async def main():
+        await asyncio.gather(*(pool.run(concurrency.job) for _ in range(4)), *(slot_job() for _ in range(4)))
+
+    try:
+        asyncio.run(main())
+    finally:
+        pool.shutdown()
+    assert concurrency.peak == 2
+    assert pool.pending == 0
+
+
+def test_rejects_beyond_workers_and_queue():
+    pool = AudioPool(workers=1, queue_size=2, kind='thread')
+
+    async def main():
+        return await asyncio.gather(*(pool.run(time.sleep, 0.02) for _ in range(6)), return_exceptions=True)
+
+    try:
+        results = asyncio.run(main())
+    finally:
+        pool.shutdown()
+    assert sum(isinstance(result, AudioPoolBusy) for result in results) == 3
+    assert results[:3] == [None] * 3
+
+
+def test_busy_slot_raises():
+    pool = AudioPool(workers=1, queue_size=0, kind='thread')
+
+    async def main():
+        async with pool.slot():
+            with pytest.raises(AudioPoolBusy):
+                async with pool.slot():
+                    pass
+
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from domain import batch
+from domain.batch import BatchItem, run_batch
+
+
+class FakeAgent:
+    """Stands in for AiAgent: a turn's message is its latency in milliseconds."""
+    running = 0
+    peak = 0
+    calls = []
+
+    def __init__(self, message, session_id, **kwargs):
+        self.message = message
+        self.session_id = session_id
+
+    async def generate_response_async(self):
+        FakeAgent.calls.append(self.message)
+        FakeAgent.running += 1
+        FakeAgent.peak = max(FakeAgent.peak, FakeAgent.running)
+        try:
+            await asyncio.sleep(int(self.message) / 1000)
+        finally:
+            FakeAgent.running -= 1
+        return self.message
+
+
+@pytest.fixture(autouse=True)
+def agent(monkeypatch):
+    monkeypatch.setattr(batch, 'AiAgent', FakeAgent)
+    FakeAgent.running = FakeAgent.peak = 0
+    FakeAgent.calls = []
+
+
+async def items_of(*items):
+    for item in items:
+        yield item
+
+
+def run(items, concurrency=8):
+    async def main():
+        return [result async for result in run_batch(items, concurrency)]
+    return asyncio.run(main())
+
+
+def test_turns_of_a_session_run_in_order():
+    items = items_of(*(BatchItem(index=i, message=str(ms), session_id='s1') for i, ms in enumerate((30, 20, 10))))
+    assert [item.index for item, outcome in run(items)] == [0, 1, 2]
+    assert FakeAgent.peak == 1
+
+
+def test_sessions_run_concurrently_up_to_the_limit():
+    items = items_of(*(BatchItem(index=i, message='20') for i in range(6)))
+    results = run(items, concurrency=3)
+    assert sorted(item.index for item, outcome in results) == list(range(6))
+    assert FakeAgent.peak == 3
+    # Items without a session_id each get their own
+    assert len({item.session_id for item, outcome in results}) == 6
+
+
+def test_results_are_yielded_in_completion_order():
+    items = items_of(BatchItem(index=0, message='40'), BatchItem(index=1, message='0'))
+    assert [item.index for item, outcome in run(items)] == [1, 0]
+
+
+def test_invalid_items_skip_the_agent():
+    error = ValueError("bad item")
+    items = items_of(BatchItem(index=0, message='0', session_id='s1'), BatchItem(index=1, session_id='s1', error=error))
+    assert [outcome for item, outcome in run(items)] == ['0', error]
+    assert FakeAgent.calls == ['0']
+
+
+def test_agent_errors_are_reported_per_item():
+    items = items_of(BatchItem(index=0, message='not a number'), BatchItem(index=1, message='0'))
+    outcomes = dict((item.index, outcome) for item, outcome in run(items))
+    assert isinstance(outcomes[0], ValueError)
+    assert outcomes[1] == '0'
+
+
+def test_read_ahead_is_bounded(monkeypatch):
+    monkeypatch.setattr(batch, 'BATCH_READ_AHEAD', 2)
+    read = []
+
+    async def items():
+        for i in range(20):
+            read.append(i)
+            yield BatchItem(index=i, message='0')
+
+    async def main():
+        results = run_batch(items(), concurrency=1)
+        await results.__anext__()
+        # Give the feeder time to run as far ahead as it may
+        await asyncio.sleep(0.05)
+        await results.aclose()
+
+    asyncio.run(main())
+    # Two read ahead, one more for the consumed result, and one waiting to be admitted
+    assert len(read) == 4
+
+
+def test_items_error_is_raised_after_the_turns_read():
+    async def items():
+        yield BatchItem(index=0, message='20')
+        raise ValueError("broken upload")
+
+    async def main():
+        results = []
+        with pytest.raises(ValueError, match="broken upload"):
+            async for result in run_batch(items()):
+                results.append(result)
+        return results
+
+    assert [item.index for item, outcome in asyncio.run(main())] == [0]
@@ -0,0 +1,70 @@
+from contextlib import ExitStack
+
+import pytest
+
+from integeration.channel_pool import ChannelPool
+
+
+def make_pool(name, size=3, policy='least_in_flight'):
+    built = []
+
+    def factory():
+        built.append(len(built))
+        return built[-1]
+
+    return ChannelPool(name, factory, size=size, policy=policy), built
+
+
+def test_clients_are_built_on_first_use():
+    pool, built = make_pool('test-lazy')
+    assert built == []
+    with pool.acquire():
+        pass
+    with pool.acquire():
+        pass
+    assert built == [0, 1, 2]
+
+
+def test_round_robin_ignores_load():
+    pool, _ = make_pool('test-round-robin', policy='round_robin')
+    with ExitStack() as held:
+        first = held.enter_context(pool.acquire())
+        picked = [first]
+        for _ in range(5):
+            with pool.acquire() as client:
+                picked.append(client)
+    assert picked == [0, 1, 2, 0, 1, 2]
+
+
+def test_least_in_flight_avoids_busy_channels():
+    pool, _ = make_pool('test-least')
+    with ExitStack() as held:
+        busy = {held.enter_context(pool.acquire()), held.enter_context(pool.acquire())}
+        assert len(busy) == 2
+        for _ in range(3):
+            with pool.acquire() as client:
+                assert client not in busy
+        assert sorted(pool.in_flight) == [0, 1, 1]
+    assert pool.in_flight == [0, 0, 0]
+
+
+def test_least_in_flight_spreads_ties():
+    pool, _ = make_pool('test-ties')
+    picked = []
+    for _ in range(3):
+        with pool.acquire() as client:
+            picked.append(client)
+    assert sorted(picked) == [0, 1, 2]
+
+
+def test_in_flight_is_released_on_error():
+    pool, _ = make_pool('test-error', size=1)
+    with pytest.raises(RuntimeError):
+        with pool.acquire():
+            raise RuntimeError("call failed")
+    assert pool.in_flight == [0]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError, match="random"):
+        ChannelPool('test-policy', object, policy='random')
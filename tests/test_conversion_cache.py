@@ -0,0 +1,88 @@
+import os
+
+from integeration.conversion_cache import DISK_SUFFIX, ConversionCache, DiskTier, MemoryTier
+
+
+def files(directory):
+    return sorted(name[:-len(DISK_SUFFIX)] for name in os.listdir(directory) if name.endswith(DISK_SUFFIX))
+
+
+def test_keys_cover_the_input_format_and_target():
+    cache = ConversionCache(max_bytes=1024, directory='')
+    key = cache.key(b'audio', 'mp4', 'linear16')
+    assert key == cache.key(memoryview(b'audio'), 'mp4', 'linear16')
+    assert key != cache.key(b'audio', 'm4a', 'linear16')
+    assert key != cache.key(b'audio', 'mp4', 'ogg_opus')
+    assert key != cache.key(b'other', 'mp4', 'linear16')
+
+
+def test_memory_tier_evicts_by_size():
+    tier = MemoryTier(10)
+    tier.put('a', b'1234')
+    tier.put('b', b'1234')
+    tier.get('a')
+    tier.put('c', b'1234')
+    assert (tier.get('a'), tier.get('b'), tier.get('c')) == (b'1234', None, b'1234')
+    assert tier.bytes == 8
+
+
+def test_memory_tier_skips_oversized_entries_and_replaces_in_place():
+    tier = MemoryTier(10)
+    tier.put('big', b'x' * 11)
+    assert tier.get('big') is None
+    tier.put('a', b'12345678')
+    tier.put('a', b'12')
+    assert tier.bytes == 2
+
+
+def test_disk_tier_round_trip(tmp_path):
+    tier = DiskTier(str(tmp_path), 100)
+    assert tier.get('a') is None
+    tier.put('a', b'converted')
+    view = tier.get('a')
+    assert isinstance(view, memoryview)
+    assert bytes(view) == b'converted'
+    view.release()
+    assert files(tmp_path) == ['a']
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    tier = DiskTier(str(tmp_path), 10)
+    tier.put('a', b'1234')
+    tier.put('b', b'1234')
+    tier.get('a').release()
+    tier.put('c', b'1234')
+    assert files(tmp_path) == ['a', 'c']
+    assert tier.bytes == 8
+
+
+def test_disk_tier_picks_up_earlier_entries(tmp_path):
+    for atime, key in enumerate(('old', 'mid', 'new')):
+        path = tmp_path / (key + DISK_SUFFIX)
+        path.write_bytes(b'1234')
+        os.utime(path, (atime, atime))
+    tier = DiskTier(str(tmp_path), 8)
+    assert tier.bytes == 8
+    assert files(tmp_path) == ['mid', 'new']
+
+
+def test_disk_tier_tracks_other_workers(tmp_path):
+    mine = DiskTier(str(tmp_path), 100)
+    other = DiskTier(str(tmp_path), 100)
+    other.put('a', b'1234')
+    mine.get('a').release()
+    assert mine.bytes == 4
+    os.unlink(tmp_path / ('a' + DISK_SUFFIX))
+    assert mine.get('a') is None
+    assert mine.bytes == 0
+
+
+def test_disk_hits_are_promoted_to_memory(tmp_path):
+    ConversionCache(max_bytes=100, directory=str(tmp_path)).put('a', b'converted')
+    # A restarted worker: empty memory tier, same directory
+    cache = ConversionCache(max_bytes=100, directory=str(tmp_path))
+    assert cache.memory.get('a') is None
+    assert bytes(cache.get('a')) == b'converted'
+    assert bytes(cache.memory.get('a')) == b'converted'
+    assert cache.get('missing') is None
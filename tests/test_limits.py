@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from integeration import audio
+from integeration.audio import AudioTooLong
+from integeration.audio_stream import limit_duration
+from views import limits
+from views.limits import BODY_OVERHEAD_BYTES, BodySizeLimitMiddleware, max_body_bytes
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(limits, 'MAX_AUDIO_BYTES', 1000)
+    app = FastAPI()
+    app.add_middleware(BodySizeLimitMiddleware)
+    app.state.reached = 0
+
+    @app.post('/upload')
+    async def upload(request: Request):
+        app.state.reached += 1
+        return {"received": len(await request.body())}
+
+    return TestClient(app)
+
+
+def test_limit_allows_for_base64_in_json(monkeypatch):
+    monkeypatch.setattr(limits, 'MAX_AUDIO_BYTES', 3000)
+    monkeypatch.setattr(limits, 'MAX_BATCH_BYTES', 10 ** 6)
+    assert max_body_bytes("audio/wav") == 3000 + BODY_OVERHEAD_BYTES
+    assert max_body_bytes("application/json; charset=utf-8") == 4000 + BODY_OVERHEAD_BYTES
+    assert max_body_bytes("application/x-ndjson") == 10 ** 6
+
+
+def test_body_within_the_limit(client):
+    response = client.post('/upload', content=b'x' * 1000, headers={'Content-Type': 'audio/wav'})
+    assert response.json() == {"received": 1000}
+
+
+def test_declared_length_over_the_limit_is_rejected_up_front(client):
+    body = b'x' * (1001 + BODY_OVERHEAD_BYTES)
+    response = client.post('/upload', content=body, headers={'Content-Type': 'audio/wav'})
+    assert response.status_code == 413
+    assert client.app.state.reached == 0
+
+
+def test_streamed_body_is_cut_off_at_the_limit(client):
+    def chunks():
+        for _ in range(100):
+            yield b'x' * 4096
+
+    # No Content-Length: the body arrives chunked
+    response = client.post('/upload', content=chunks(), headers={'Content-Type': 'audio/wav'})
+    assert response.status_code == 413
+    assert "limit" in response.json()["detail"]
+
+
+def test_stream_duration_limit(monkeypatch):
+    monkeypatch.setattr(audio, 'MAX_AUDIO_SECONDS', 2)
+
+    async def chunks():
+        for _ in range(5):
+            yield b'\x00' * 32000
+
+    async def main():
+        received = []
+        with pytest.raises(AudioTooLong):
+            async for chunk in limit_duration(chunks(), 32000):
+                received.append(chunk)
+        return received
+
+    # One second per chunk: the third crosses the two second limit
+    assert len(asyncio.run(main())) == 2
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from integeration.audio import UnsupportedAudioFormat, wav_header
+from integeration.audio_headers import parse_wav
+from integeration.pcm import convert_pcm, pcm_convertible, resample
+from main import app
+
+
+def sine(frequency, rate, seconds, amplitude=0.5):
+    t = np.arange(int(rate * seconds)) / rate
+    return amplitude * np.sin(2 * np.pi * frequency * t)
+
+
+def pcm24(samples):
+    """Little-endian 24-bit bytes of float samples in [-1, 1)."""
+    values = np.rint(samples * 2 ** 23).astype('<i4')
+    return values.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+
+def test_24_bit_stereo_48k_to_16k_mono():
+    left = sine(440, 48000, 0.5)
+    right = sine(440, 48000, 0.5, amplitude=0.25)
+    interleaved = np.empty(2 * len(left))
+    interleaved[0::2] = left
+    interleaved[1::2] = right
+    samples = pcm24(interleaved)
+    wav = wav_header(len(samples), 48000, channels=2, sample_width=3) + samples
+    info = parse_wav(wav)
+    assert pcm_convertible(info)
+
+    converted = convert_pcm(wav, info)
+    out = parse_wav(converted)
+    assert (out.codec, out.sample_rate, out.channels, out.bits_per_sample, out.frames) == ('pcm', 16000, 1, 16, 8000)
+
+    pcm = np.frombuffer(converted, dtype='<i2', offset=out.data_offset).astype(np.float64)
+    expected = sine(440, 16000, 0.5, amplitude=0.375) * 32768
+    # Away from the filter's edge effects the mean of the channels comes through
+    middle = slice(100, -100)
+    assert np.max(np.abs(pcm[middle] - expected[middle])) < 0.01 * 32768
+
+
+def test_8_bit_is_unsigned():
+    wav = wav_header(3, 16000, sample_width=1) + bytes([128, 255, 0])
+    converted = convert_pcm(wav, parse_wav(wav))
+    assert np.frombuffer(converted, dtype='<i2', offset=44).tolist() == [0, 127 * 256, -32768]
+
+
+def test_resample_keeps_a_constant_level():
+    samples = np.full(4410, 1000, dtype=np.float32)
+    resampled = resample(samples, 44100, 16000)
+    assert len(resampled) == 1600
+    assert np.allclose(resampled[100:-100], 1000, atol=1)
+
+
+def test_compressed_wav_is_not_convertible():
+    info = parse_wav(wav_header(4) + b'\x00' * 4)
+    info.codec = 'mulaw'
+    assert not pcm_convertible(info)
+
+
+@pytest.mark.parametrize('sample_rate', [0, 1_000_003, 2 ** 32 - 1])
+def test_implausible_sample_rate_is_rejected(sample_rate):
+    wav = bytearray(wav_header(4, channels=2) + b'\x00' * 4)
+    wav[24:28] = sample_rate.to_bytes(4, 'little')
+    with pytest.raises(UnsupportedAudioFormat, match="sample rate"):
+        parse_wav(bytes(wav))
+
+
+def test_implausible_sample_rate_upload_gets_415():
+    wav = wav_header(2000, 1_000_003, channels=2) + b'\x00' * 2000
+    response = TestClient(app).post('/ai-agent/message/audio', content=wav, headers={'Content-Type': 'audio/wav'})
+    assert response.status_code == 415
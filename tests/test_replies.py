@@ -0,0 +1,52 @@
+from google.cloud.dialogflowcx_v3.types.intent import Intent
+from google.cloud.dialogflowcx_v3.types.response_message import ResponseMessage
+from google.cloud.dialogflowcx_v3.types.session import DetectIntentResponse, Match, QueryResult
+
+from integeration.replies import Reply, extract_reply
+
+
+def text(*lines):
+    return ResponseMessage(text=ResponseMessage.Text(text=list(lines)))
+
+
+def response(messages, match=None, transcript="", output_audio=b""):
+    return DetectIntentResponse(
+        query_result=QueryResult(response_messages=messages, match=match, transcript=transcript),
+        output_audio=output_audio,
+    )
+
+
+def test_all_messages_in_order():
+    reply = extract_reply(response(
+        [
+            text("مرحبا", "كيف أساعدك؟"),
+            ResponseMessage(payload={"quick_replies": ["طلب", "شكوى"]}),
+            text("اختر خدمة"),
+        ],
+        match=Match(intent=Intent(display_name="greeting"), confidence=0.75),
+        transcript="السلام عليكم",
+        output_audio=b"mp3",
+    ))
+    assert reply.messages == ["مرحبا", "كيف أساعدك؟", "اختر خدمة"]
+    assert reply.text == "مرحبا"
+    assert reply.payloads == [{"quick_replies": ["طلب", "شكوى"]}]
+    assert (reply.intent, reply.confidence) == ("greeting", 0.75)
+    assert (reply.transcript, reply.output_audio) == ("السلام عليكم", b"mp3")
+
+
+def test_raw_protobuf():
+    reply = extract_reply(DetectIntentResponse.pb(response([text("a"), text("b")])))
+    assert reply.messages == ["a", "b"]
+
+
+def test_reply_without_a_match():
+    reply = extract_reply(response([]))
+    assert (reply.messages, reply.text, reply.payloads) == ([], "", [])
+    assert reply.intent is reply.confidence is reply.transcript is reply.output_audio is None
+
+
+def test_json_round_trip_leaves_out_the_audio():
+    reply = Reply(["مرحبا", "أهلا"], [{"card": {"title": "x"}}], "greeting", 0.5, output_audio=b"mp3")
+    restored = Reply.from_json(reply.to_json())
+    assert restored.to_dict() == reply.to_dict()
+    assert restored.output_audio is None
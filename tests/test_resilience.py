@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from google.api_core import exceptions as core_exceptions
+
+from integeration import resilience
+from integeration.resilience import CLOSED, HALF_OPEN, OPEN, BudgetExhausted, CircuitBreaker, CircuitOpen, Deadline
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, 'monotonic', clock)
+    return clock
+
+
+def fail(breaker, error=core_exceptions.ServiceUnavailable):
+    with pytest.raises(error):
+        with breaker.guard():
+            raise error("upstream")
+
+
+def succeed(breaker):
+    with breaker.guard():
+        pass
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker('test-open', failure_threshold=3, reset_seconds=30)
+    for _ in range(2):
+        fail(breaker)
+    assert breaker.state == CLOSED
+    fail(breaker)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen) as raised:
+        succeed(breaker)
+    assert raised.value.retry_after == 30
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker('test-reset', failure_threshold=2, reset_seconds=30)
+    fail(breaker)
+    succeed(breaker)
+    fail(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_non_transient_errors_do_not_count(clock):
+    breaker = CircuitBreaker('test-invalid', failure_threshold=1, reset_seconds=30)
+    fail(breaker, core_exceptions.InvalidArgument)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_closes_on_success(clock):
+    breaker = CircuitBreaker('test-probe-ok', failure_threshold=1, reset_seconds=30)
+    fail(breaker)
+    clock.now += 30
+    with breaker.guard():
+        assert breaker.state == HALF_OPEN
+        # Only one probe at a time
+        with pytest.raises(CircuitOpen):
+            succeed(breaker)
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+
+
+def test_half_open_probe_reopens_on_failure(clock):
+    breaker = CircuitBreaker('test-probe-fail', failure_threshold=5, reset_seconds=30)
+    for _ in range(5):
+        fail(breaker)
+    clock.now += 31
+    fail(breaker)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen):
+        succeed(breaker)
+    clock.now += 30
+    succeed(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_spent_budget_releases_the_probe(clock):
+    breaker = CircuitBreaker('test-budget', failure_threshold=1, reset_seconds=30)
+    fail(breaker)
+    clock.now += 30
+    fail(breaker, BudgetExhausted)
+    assert breaker.state == HALF_OPEN
+    succeed(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_deadline_caps_the_call_timeout(clock):
+    deadline = Deadline(budget=10)
+    assert deadline.timeout(cap=5) == 5
+    clock.now += 8
+    assert deadline.timeout(cap=5) == 2
+    clock.now += 2
+    with pytest.raises(BudgetExhausted):
+        deadline.timeout()
+
+
+def test_retry_async_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(resilience, 'backoff', lambda attempt: 0)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) < 3:
+            raise core_exceptions.ServiceUnavailable("upstream")
+        return 'reply'
+
+    assert asyncio.run(resilience.retry_async(call, Deadline(10), 2, 'test')) == 'reply'
+    assert len(calls) == 3
+
+
+def test_retry_async_does_not_retry_an_open_breaker():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        raise CircuitOpen('test', 5)
+
+    with pytest.raises(CircuitOpen):
+        asyncio.run(resilience.retry_async(call, Deadline(10), 2, 'test'))
+    assert len(calls) == 1
+
+
+def test_retry_async_does_not_retry_a_timed_out_turn(monkeypatch):
+    monkeypatch.setattr(resilience, 'backoff', lambda attempt: 0)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        raise core_exceptions.DeadlineExceeded("upstream")
+
+    with pytest.raises(core_exceptions.DeadlineExceeded):
+        asyncio.run(resilience.retry_async(call, Deadline(10), 2, 'test'))
+    assert len(calls) == 1
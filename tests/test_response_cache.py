@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from integeration import response_cache
+from integeration.replies import Reply
+from integeration.response_cache import MemoryCacheBackend, ResponseCache, build_normalizer
+
+
+def test_normalizer_folds_arabic_variants():
+    normalize = build_normalizer()
+    # Harakat, tatweel, hamza forms of alef and extra whitespace
+    assert normalize("  أَهْلاً   وسـهـلاً ") == normalize("اهلا وسهلا") == "اهلا وسهلا"
+    assert normalize("إسلام آمن") == "اسلام امن"
+
+
+def test_normalizer_applies_only_the_configured_steps():
+    assert build_normalizer(('tatweel',))("أهـلاً  ") == "أهلاً  "
+    assert build_normalizer(())("أهـلاً") == "أهـلاً"
+
+
+def test_unknown_normalization_step():
+    with pytest.raises(ValueError, match="lowercase"):
+        build_normalizer(('whitespace', 'lowercase'))
+
+
+def test_keys_separate_agents_and_languages():
+    cache = ResponseCache(MemoryCacheBackend())
+    assert cache.key("مرحبا", "ar") == cache.key("مَرحبا ", "ar")
+    assert cache.key("مرحبا", "ar") != cache.key("مرحبا", "en")
+    assert cache.key("مرحبا", "ar", "us") != cache.key("مرحبا", "ar", "eu")
+
+
+def test_only_allow_listed_intents_are_stored():
+    cache = ResponseCache(MemoryCacheBackend(), allowed_intents=frozenset({'greeting'}))
+
+    async def main():
+        await cache.store("hello", Reply(["Hi!"], intent='greeting'))
+        await cache.store("order", Reply(["Your order is on its way"], intent='order.status'))
+        await cache.store("huh", Reply(["Sorry?"]))
+        return await cache.get("hello"), await cache.get("order"), await cache.get("huh")
+
+    hello, order, unmatched = asyncio.run(main())
+    assert hello.messages == ["Hi!"]
+    assert order is None and unmatched is None
+
+
+def test_speech_is_not_stored_with_the_reply():
+    cache = ResponseCache(MemoryCacheBackend(), allowed_intents=frozenset({'greeting'}))
+
+    async def main():
+        await cache.store("hello", Reply(["Hi!"], intent='greeting', output_audio=b'mp3'))
+        return await cache.get("hello")
+
+    assert asyncio.run(main()).output_audio is None
+
+
+def test_memory_backend_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(response_cache.time, 'monotonic', lambda: now[0])
+    backend = MemoryCacheBackend(ttl=10)
+
+    async def main():
+        await backend.set("k", "v")
+        now[0] += 9
+        fresh = await backend.get("k")
+        now[0] += 2
+        return fresh, await backend.get("k")
+
+    assert asyncio.run(main()) == ("v", None)
+    assert len(backend) == 0
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_entries=2, ttl=60)
+
+    async def main():
+        await backend.set("a", 1)
+        await backend.set("b", 2)
+        await backend.get("a")
+        await backend.set("c", 3)
+        return [await backend.get(key) for key in "abc"]
+
+    assert asyncio.run(main()) == [1, None, 3]
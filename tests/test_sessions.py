@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+from integeration.sessions import SessionStore, build_query_params
+
+US = SimpleNamespace(name='us')
+EU = SimpleNamespace(name='eu')
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_turns_reuse_the_record():
+    clock = Clock()
+    store = SessionStore(idle_seconds=60, max_records=10, clock=clock)
+    record = store.turn('s1', US)
+    clock.now += 30
+    assert store.turn('s1', EU) is record
+    assert (record.agent, record.last_seen) == (EU, 1030.0)
+    assert store.get('s1') is record
+    assert store.get('unknown') is None and store.get(None) is None
+
+
+def test_idle_session_is_forgotten_on_lookup():
+    clock = Clock()
+    store = SessionStore(idle_seconds=60, max_records=10, clock=clock)
+    store.turn('s1', US)
+    clock.now += 60
+    assert store.get('s1') is not None
+    clock.now += 1
+    assert store.get('s1') is None
+    assert len(store) == 0
+
+
+def test_new_turns_evict_idle_sessions():
+    clock = Clock()
+    store = SessionStore(idle_seconds=60, max_records=10, clock=clock)
+    store.turn('old', US)
+    clock.now += 40
+    store.turn('recent', US)
+    clock.now += 30
+    store.turn('new', US)
+    assert len(store) == 2
+    assert store.get('old') is None and store.get('recent') is not None
+
+
+def test_capacity_evicts_the_least_recently_used():
+    store = SessionStore(idle_seconds=60, max_records=2, clock=Clock())
+    store.turn('a', US)
+    store.turn('b', US)
+    store.turn('a', US)
+    store.turn('c', US)
+    assert [store.get(session_id) is not None for session_id in 'abc'] == [True, False, True]
+
+
+def test_query_params():
+    assert build_query_params('', '') is None
+    params = build_query_params('Asia/Riyadh', '')
+    assert params.time_zone == 'Asia/Riyadh' and params.channel == ''
+    assert build_query_params('', 'whatsapp').channel == 'whatsapp'
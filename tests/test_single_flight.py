@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from integeration.single_flight import SingleFlight
+
+
+def run_concurrently(flight, key, call, count):
+    async def main():
+        return await asyncio.gather(*(flight.run(key, call) for _ in range(count)), return_exceptions=True)
+    return asyncio.run(main())
+
+
+class Upstream:
+    """Stands in for the Dialogflow call: counts calls and answers after a yield."""
+
+    def __init__(self, intent='greeting', error=None):
+        self.calls = 0
+        self.intent = intent
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+        return f"reply {call}", self.intent
+
+
+def test_identical_queries_share_one_call():
+    flight = SingleFlight(allowed_intents={'greeting'})
+    upstream = Upstream()
+    replies = run_concurrently(flight, flight.key("Hello", "ar"), upstream, 5)
+    assert upstream.calls == 1
+    assert replies == ["reply 1"] * 5
+    assert not flight._calls
+
+
+def test_keys_normalize_the_query():
+    flight = SingleFlight(allowed_intents={'greeting'})
+    # Extra whitespace and tatweel
+    assert flight.key("مرحبا بك", "ar") == flight.key(" مرحـــبا  بك ", "ar")
+    assert flight.key("Hello", "ar") != flight.key("Hello", "en")
+    assert flight.key("Hello", "ar") != flight.key("Hello", "ar", agent="eu")
+
+
+def test_other_intents_make_their_own_calls():
+    flight = SingleFlight(allowed_intents={'greeting'})
+    upstream = Upstream(intent='order.status')
+    replies = run_concurrently(flight, flight.key("Where is my order", "ar"), upstream, 3)
+    assert upstream.calls == 3
+    assert sorted(replies) == ["reply 1", "reply 2", "reply 3"]
+
+
+def test_leader_error_reaches_the_waiters():
+    flight = SingleFlight(allowed_intents={'greeting'})
+    upstream = Upstream(error=RuntimeError("upstream"))
+    results = run_concurrently(flight, flight.key("Hello", "ar"), upstream, 3)
+    assert upstream.calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelled_leader_lets_waiters_call():
+    flight = SingleFlight(allowed_intents={'greeting'})
+    upstream = Upstream()
+    key = flight.key("Hello", "ar")
+
+    async def main():
+        leader = asyncio.ensure_future(flight.run(key, upstream))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.run(key, upstream))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(main()) == "reply 2"
+    assert upstream.calls == 2
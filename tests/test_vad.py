@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from integeration import vad
+from integeration.audio import NoSpeechDetected, wav_header
+from integeration.audio_headers import parse_wav
+
+RATE = 16000
+
+
+def recording(*parts):
+    """16-bit mono WAV of (seconds, amplitude) parts: amplitude 0 is silence, else a 300 Hz tone."""
+    chunks = []
+    for seconds, amplitude in parts:
+        t = np.arange(int(RATE * seconds)) / RATE
+        chunks.append(amplitude * np.sin(2 * np.pi * 300 * t))
+    pcm = np.rint(np.concatenate(chunks)).astype('<i2').tobytes()
+    return wav_header(len(pcm), RATE) + pcm
+
+
+def test_trims_leading_and_trailing_silence():
+    wav = recording((2, 0), (1, 8000), (3, 0))
+    trimmed, info, outcome = vad.trim_silence(wav, parse_wav(wav))
+    assert outcome == 'trimmed'
+    padding = RATE * vad.SILENCE_PADDING_MS // 1000
+    assert info.frames == RATE + 2 * padding
+    assert parse_wav(trimmed).frames == info.frames
+    assert len(trimmed) == 44 + 2 * info.frames
+
+
+def test_speech_throughout_is_unchanged():
+    wav = recording((1, 8000))
+    result, info, outcome = vad.trim_silence(wav, parse_wav(wav))
+    assert outcome == 'unchanged'
+    assert result is wav
+
+
+def test_quiet_noise_is_no_speech():
+    # About -60 dBFS, under the -45 dBFS threshold
+    wav = recording((1, 30))
+    _, _, outcome = vad.trim_silence(wav, parse_wav(wav))
+    assert outcome == 'no_speech'
+
+
+def test_header_only_wav_is_no_speech():
+    wav = wav_header(0)
+    _, _, outcome = vad.trim_silence(wav, parse_wav(wav))
+    assert outcome == 'no_speech'
+
+
+def test_silent_audio_rejected(monkeypatch):
+    monkeypatch.setattr(vad, 'REJECT_SILENT_AUDIO', True)
+    wav = recording((1, 0))
+    with pytest.raises(NoSpeechDetected):
+        vad.trim_silence(wav, parse_wav(wav))
+
+
+def test_only_16_bit_mono_is_trimmable(monkeypatch):
+    monkeypatch.setattr(vad, 'SILENCE_TRIM', True)
+    assert vad.trimmable(parse_wav(wav_header(4) + b'\x00' * 4))
+    assert not vad.trimmable(parse_wav(wav_header(4, channels=2) + b'\x00' * 4))
+    assert not vad.trimmable(None)
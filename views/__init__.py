@@ -1 +1,3 @@
-from . import ai_agent
\ No newline at end of file
+from . import ai_agent
+from . import health
+from . import metrics
\ No newline at end of file
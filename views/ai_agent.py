@@ -1,19 +1,59 @@
-from domain import ai_agent 
-from fastapi import APIRouter, File, UploadFile, Form, Query, Body, Request, HTTPException
+from domain import ai_agent, batch
+from integeration import AudioPoolBusy, AudioTooLong, CircuitOpen, NoSpeechDetected, UnsupportedAudioFormat, detect_audio_format
+from integeration.metrics import stage
+from fastapi import APIRouter, File, UploadFile, Form, Query, Body, Request, HTTPException, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from google.api_core import exceptions as core_exceptions
 from typing import Optional
 from pydantic import BaseModel
+from multipart.multipart import MultipartParser, parse_options_header
+import asyncio
 import base64
+import contextlib
 import json
 import logging
+import uuid
+from .encoding import dumps, reply_response, wants_speech
+from .limits import MAX_AUDIO_BYTES, RequestTooLarge
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Audio frames buffered per WebSocket voice turn before reads pause
+WS_AUDIO_QUEUE_FRAMES = 64
+# Raw-body content types carrying headerless PCM, which can't be sniffed
+RAW_PCM_CONTENT_TYPES = ("audio/l16", "audio/pcm")
+# Bytes needed before a raw body's format can be sniffed
+SNIFF_BYTES = 12
+# Agent routing hints, read from X-Agent/X-Tenant/X-Language or ?agent=&tenant=&language=
+ROUTE_HINTS = ("agent", "tenant", "language")
+
 class MessageRequest(BaseModel):
     message: Optional[str] = None
     audio_data: Optional[str] = None  # Base64 encoded audio
     session_id: Optional[str] = None
+    # Routing hints, overriding the request's headers/query parameters
+    agent: Optional[str] = None
+    tenant: Optional[str] = None
+    language: Optional[str] = None
+
+
+def _route_hints(connection):
+    """
+    Agent routing hints of a request or WebSocket: the X-Agent, X-Tenant and
+    X-Language headers, or the agent/tenant/language query parameters
+    (browsers can't set headers on a WebSocket).
+    """
+    return {
+        hint: connection.headers.get(f"x-{hint}") or connection.query_params.get(hint)
+        for hint in ROUTE_HINTS
+    }
+
+
+def _body_route_hints(hints, body):
+    """Route hints with those set in a JSON body taking precedence."""
+    return {hint: getattr(body, hint) or hints[hint] for hint in ROUTE_HINTS}
 
 @router.post('/message')
 async def ai_agent_message(
@@ -44,9 +84,17 @@ async def ai_agent_message(
     - session_id can be query parameter
     
     session_id: optional query parameter to maintain conversation context
+
+    The agent is picked by the X-Agent, X-Tenant and X-Language headers (or
+    agent/tenant/language query parameters or JSON fields), see
+    integeration/agents.py.
+
+    With OUTPUT_AUDIO=1, ?output_audio=1 or Accept: audio/* also get the
+    reply spoken, see views/encoding.py.
     """
     from fastapi import HTTPException
     
+    hints = _route_hints(request)
     audio_bytes = None
     audio_file_path = None
     final_message = ""
@@ -58,13 +106,16 @@ async def ai_agent_message(
     # Handle JSON body (for text or base64 audio)
     if "application/json" in content_type:
         try:
-            body = await request.json()
+            with stage('body_read'):
+                body = await request.json()
             json_request = MessageRequest(**body)
+            hints = _body_route_hints(hints, json_request)
             
             # Handle base64 audio data
             if json_request.audio_data:
                 try:
-                    audio_bytes = base64.b64decode(json_request.audio_data)
+                    with stage('base64_decode'):
+                        audio_bytes = base64.b64decode(json_request.audio_data)
                     final_message = json_request.message or ""
                 except Exception as e:
                     raise HTTPException(status_code=400, detail=f"Invalid base64 audio data: {str(e)}")
@@ -77,6 +128,8 @@ async def ai_agent_message(
                 final_session_id = json_request.session_id
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid JSON in request body")
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid request format: {str(e)}")
     
@@ -87,7 +140,8 @@ async def ai_agent_message(
     
     # Handle audio file upload
     if audio_file:
-        audio_bytes = await audio_file.read()
+        with stage('body_read'):
+            audio_bytes = await audio_file.read()
         # If message is not provided, use empty string (audio-only)
         if not final_message:
             final_message = ""
@@ -100,24 +154,502 @@ async def ai_agent_message(
         )
     
     try:
-        return ai_agent.AiAgent(
+        reply = await ai_agent.AiAgent(
             message=final_message,
             session_id=final_session_id,
             audio_bytes=audio_bytes,
-            audio_file_path=audio_file_path
-        ).generate_response()
-    except ValueError as e:
+            audio_file_path=audio_file_path,
+            output_audio=wants_speech(request),
+            **hints
+        ).generate_response_async()
+    except Exception as e:
+        raise _to_http_exception(e)
+    return reply_response(request, reply)
+
+
+@router.post('/message/audio')
+async def ai_agent_message_audio(
+    request: Request,
+    session_id: Optional[str] = Query(None),
+    x_session_id: Optional[str] = Header(None)
+):
+    """
+    Voice message sent as the raw request body, without base64 or multipart.
+
+    Content-Type: audio/* (e.g. audio/wav, audio/mp4) or application/octet-stream
+    session_id: query parameter or X-Session-Id header
+
+    The body is read into a single preallocated buffer and handed to
+    Dialogflow as a memoryview, avoiding the extra copies of the JSON path
+    (request text, pydantic model, base64 decode) and its 33% wire overhead.
+    Accept: audio/* gets the reply back as speech, see views/encoding.py.
+    """
+    content_type = request.headers.get("content-type", "")
+    if not (content_type.startswith("audio/") or content_type.startswith("application/octet-stream")):
+        raise HTTPException(status_code=415, detail="Send audio as the raw body with an audio/* Content-Type")
+
+    with stage('body_read'):
+        audio_bytes = await _read_body(request, sniff=not content_type.startswith(RAW_PCM_CONTENT_TYPES))
+    if not audio_bytes:
+        raise HTTPException(status_code=400, detail="Empty audio body")
+
+    try:
+        reply = await ai_agent.AiAgent(
+            session_id=session_id or x_session_id,
+            audio_bytes=audio_bytes,
+            output_audio=wants_speech(request),
+            **_route_hints(request)
+        ).generate_response_async()
+    except Exception as e:
+        raise _to_http_exception(e)
+    return reply_response(request, reply)
+
+
+async def _read_body(request, sniff=True):
+    """
+    Read the request body into one preallocated buffer and return a memoryview of it.
+
+    With sniff, the first bytes are checked against the known audio magic
+    bytes and unsupported uploads are rejected with 415 before the rest of
+    the body is read.
+    """
+    content_length = request.headers.get("content-length", "")
+    if not content_length.isdigit():
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer += chunk
+            if sniff and len(buffer) >= SNIFF_BYTES:
+                _check_sniffed_format(buffer)
+                sniff = False
+            if len(buffer) > MAX_AUDIO_BYTES:
+                raise RequestTooLarge(MAX_AUDIO_BYTES)
+        return memoryview(buffer)
+
+    if int(content_length) > MAX_AUDIO_BYTES:
+        raise RequestTooLarge(MAX_AUDIO_BYTES)
+    buffer = bytearray(int(content_length))
+    view = memoryview(buffer)
+    received = 0
+    async for chunk in request.stream():
+        end = received + len(chunk)
+        if end > len(buffer):
+            raise HTTPException(status_code=400, detail="Request body is longer than Content-Length")
+        view[received:end] = chunk
+        received = end
+        if sniff and received >= SNIFF_BYTES:
+            _check_sniffed_format(view[:received])
+            sniff = False
+    return view[:received]
+
+
+def _check_sniffed_format(head):
+    if detect_audio_format(head) == 'unknown':
+        raise HTTPException(
+            status_code=415,
+            detail="Unsupported audio format: send WAV, FLAC, OGG/Opus, MP4 or M4A audio, or audio/l16 for raw PCM"
+        )
+
+
+@router.post('/message/stream')
+async def ai_agent_message_stream(
+    request: Request,
+    session_id: Optional[str] = Query(None)
+):
+    """
+    Stream a voice message to Dialogflow while it is still uploading.
+
+    multipart/form-data with an 'audio_file' part. The part's bytes are
+    forwarded to streaming_detect_intent as they arrive (m4a/mp4 is transcoded
+    on the fly), so the reply can come back as soon as speech ends instead of
+    after the whole upload has been buffered.
+
+    session_id: optional query parameter to maintain conversation context
+    """
+    content_type = request.headers.get("content-type", "")
+    if "multipart/form-data" not in content_type:
+        raise HTTPException(status_code=400, detail="Streaming messages must be multipart/form-data with an 'audio_file' part")
+
+    try:
+        reply = await ai_agent.AiAgent(
+            session_id=session_id, output_audio=wants_speech(request), **_route_hints(request)
+        ).generate_streaming_response(
+            _stream_multipart_file(request, content_type, 'audio_file')
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _to_http_exception(e)
+    return reply_response(request, reply)
+
+
+@router.post('/batch')
+async def ai_agent_batch(
+    request: Request,
+    concurrency: Optional[int] = Query(None, ge=1)
+):
+    """
+    Run many turns in one request, e.g. to replay recorded conversations.
+
+    Body, either application/json:
+        {"items": [{"id": "t1", "message": "Hello", "session_id": "s1"}, ...]}
+    or application/x-ndjson, one item per line, processed while it uploads:
+        {"id": "t1", "message": "Hello", "session_id": "s1"}
+        {"id": "t2", "audio_data": "base64-encoded-audio", "session_id": "s1"}
+
+    Different sessions run concurrently (at most 'concurrency' Dialogflow
+    calls, capped by BATCH_MAX_CONCURRENCY); turns sharing a session_id run
+    in order. Items without a session_id each get a new session. Items may
+    set "agent", "tenant" and "language" to override the request's routing
+    hints.
+
+    Results stream back as NDJSON in completion order, tagged with the
+    item's position ("index") and "id", with the fields of /message's reply:
+        {"index": 0, "id": "t1", "response": "...", "session_id": "s1", "messages": [...], "intent": "...", ...}
+        {"index": 1, "id": "t2", "session_id": "s1", "error": {"status": 400, "detail": "..."}}
+    """
+    content_type = request.headers.get("content-type", "")
+    hints = _route_hints(request)
+    body_read = asyncio.Event()
+    if "application/x-ndjson" in content_type:
+        items = _ndjson_batch_items(request, body_read, hints)
+    elif "application/json" in content_type:
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Invalid JSON in request body")
+        entries = body.get("items") if isinstance(body, dict) else body
+        if not isinstance(entries, list):
+            raise HTTPException(status_code=400, detail="Batch body must be {\"items\": [...]} or a JSON array")
+        items = _list_batch_items(entries, hints)
+        body_read.set()
+    else:
+        raise HTTPException(status_code=415, detail="Send a batch as application/json or application/x-ndjson")
+
+    concurrency = min(concurrency or batch.BATCH_MAX_CONCURRENCY, batch.BATCH_MAX_CONCURRENCY)
+    return _BatchResponse(_batch_results(items, concurrency), body_read, media_type="application/x-ndjson")
+
+
+class _BatchResponse(StreamingResponse):
+    """
+    StreamingResponse that leaves receive() to the request body until it has
+    been read: results stream back while NDJSON items are still uploading,
+    and Starlette's disconnect listener would otherwise swallow body chunks.
+    """
+    def __init__(self, content, body_read, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_read = body_read
+
+    async def listen_for_disconnect(self, receive):
+        await self.body_read.wait()
+        await super().listen_for_disconnect(receive)
+
+
+async def _batch_results(items, concurrency):
+    try:
+        async for item, outcome in batch.run_batch(items, concurrency):
+            line = {"index": item.index}
+            if item.id is not None:
+                line["id"] = item.id
+            if isinstance(outcome, Exception):
+                error = _to_http_exception(outcome)
+                line.update(session_id=item.session_id, error={"status": error.status_code, "detail": error.detail})
+            else:
+                line.update(outcome.model_dump())
+            yield dumps(line) + b"\n"
+    except Exception as e:
+        # Headers are already sent, so a failure reading the body ends the stream with an error line
+        error = _to_http_exception(e)
+        yield dumps({"error": {"status": error.status_code, "detail": error.detail}}) + b"\n"
+
+
+async def _list_batch_items(entries, hints):
+    for index, entry in enumerate(entries):
+        yield _batch_item(index, entry, hints)
+
+
+async def _ndjson_batch_items(request, body_read, hints):
+    """Yield batch items from an NDJSON body as its lines arrive."""
+    index = 0
+    buffer = b""
+    try:
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield _parse_batch_line(index, line, hints)
+                    index += 1
+        if buffer.strip():
+            yield _parse_batch_line(index, buffer, hints)
+    finally:
+        body_read.set()
+
+
+def _parse_batch_line(index, line, hints):
+    try:
+        entry = json.loads(line)
+    except json.JSONDecodeError as e:
+        return batch.BatchItem(index=index, error=ValueError(f"Invalid JSON line: {e}"))
+    return _batch_item(index, entry, hints)
+
+
+def _batch_item(index, entry, hints):
+    """Build a BatchItem from one decoded item; invalid items carry their error instead."""
+    if not isinstance(entry, dict):
+        return batch.BatchItem(index=index, error=ValueError("Batch items must be JSON objects"))
+    item_id = entry.get("id")
+    item_id = str(item_id) if item_id is not None else None
+    session_id = entry.get("session_id") if isinstance(entry.get("session_id"), str) else None
+    try:
+        item = MessageRequest(**entry)
+        audio_bytes = base64.b64decode(item.audio_data) if item.audio_data else None
+    except Exception as e:
+        return batch.BatchItem(index=index, id=item_id, session_id=session_id, error=ValueError(f"Invalid batch item: {e}"))
+    if audio_bytes is not None and len(audio_bytes) > MAX_AUDIO_BYTES:
+        return batch.BatchItem(index=index, id=item_id, session_id=session_id, error=RequestTooLarge(MAX_AUDIO_BYTES))
+    if not item.message and not audio_bytes:
+        return batch.BatchItem(index=index, id=item_id, session_id=session_id, error=ValueError("Each item needs a 'message' or 'audio_data'"))
+    return batch.BatchItem(
+        index=index,
+        id=item_id,
+        message=item.message or "",
+        session_id=item.session_id,
+        audio_bytes=audio_bytes,
+        **_body_route_hints(hints, item)
+    )
+
+
+@router.websocket('/ws')
+async def ai_agent_ws(websocket: WebSocket, session_id: Optional[str] = Query(None)):
+    """
+    Persistent voice/text conversation over one WebSocket per session.
+
+    Client -> server:
+        {"type": "start", "format": "linear16", "sample_rate": 16000}
+            begins a voice turn; "format" is optional (sniffed from the
+            first bytes when omitted) and one of linear16, flac, ogg_opus,
+            mulaw, alaw, amr, amr_wb; "output_audio": true asks for the
+            reply spoken (default: the output_audio query parameter)
+        binary frames
+            audio for the current turn, forwarded to Dialogflow as received;
+            frames sent after the turn's reply or error are dropped
+        {"type": "end"}
+            ends the voice turn
+        {"type": "text", "message": "Hello"}
+            a text turn, also taking "output_audio"
+
+    Server -> client:
+        {"type": "interim", "transcript": "...", "is_final": false}
+        {"type": "reply", "response": "...", "session_id": "...", "messages": [...], "payloads": [...], ...}
+        binary frame
+            the reply's speech, right after its "reply" message, when
+            asked for with OUTPUT_AUDIO=1
+        {"type": "error", "detail": "..."}
+
+    The agent is picked once per connection from the agent/tenant/language
+    query parameters (or X-Agent/X-Tenant/X-Language headers).
+    """
+    await websocket.accept()
+    session_id = session_id or str(uuid.uuid4())
+    hints = _route_hints(websocket)
+    speak = wants_speech(websocket)
+    agent = ai_agent.AiAgent(session_id=session_id, **hints)
+    audio_queue = None
+    turn = None
+
+    turn_bytes = 0
+
+    async def run_turn(queue, audio_format, sample_rate_hertz, output_audio):
+        events = agent.model_copy(update={"output_audio": output_audio}).generate_streaming_events(
+            _drain_queue(queue), audio_format=audio_format, sample_rate_hertz=sample_rate_hertz
+        )
+        try:
+            async with contextlib.aclosing(events):
+                async for event in events:
+                    await _send_event(websocket, event)
+                    if event["type"] == "reply":
+                        # The turn is over: closing the stream stops the audio, and
+                        # frames still coming in are dropped
+                        return
+        except Exception as e:
+            await websocket.send_json({"type": "error", "detail": _to_http_exception(e).detail})
+
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                break
+            if frame.get("bytes") is not None:
+                if audio_queue is None:
+                    await websocket.send_json({"type": "error", "detail": "Send a 'start' message before audio frames"})
+                    continue
+                if not turn.done():
+                    turn_bytes += len(frame["bytes"])
+                    if turn_bytes > MAX_AUDIO_BYTES:
+                        turn.cancel()
+                        await websocket.send_json({"type": "error", "detail": RequestTooLarge(MAX_AUDIO_BYTES).detail})
+                        continue
+                    # Bounded queue: a slow upstream pushes back on the client
+                    await _put_while_running(audio_queue, frame["bytes"], turn)
+                continue
+
+            try:
+                control = json.loads(frame.get("text") or "")
+            except json.JSONDecodeError:
+                control = None
+            if not isinstance(control, dict):
+                await websocket.send_json({"type": "error", "detail": "Control messages must be JSON objects"})
+                continue
+
+            if control.get("type") == "start":
+                if turn is not None and not turn.done():
+                    await websocket.send_json({"type": "error", "detail": "A voice turn is already in progress"})
+                    continue
+                sample_rate_hertz = control.get("sample_rate", 16000)
+                if type(sample_rate_hertz) is not int or sample_rate_hertz <= 0:
+                    await websocket.send_json({"type": "error", "detail": "'sample_rate' must be a positive integer"})
+                    continue
+                audio_queue = asyncio.Queue(maxsize=WS_AUDIO_QUEUE_FRAMES)
+                turn_bytes = 0
+                turn = asyncio.create_task(
+                    run_turn(audio_queue, control.get("format"), sample_rate_hertz, bool(control.get("output_audio", speak)))
+                )
+            elif control.get("type") == "end":
+                if audio_queue is not None:
+                    if not turn.done():
+                        await _put_while_running(audio_queue, None, turn)
+                    audio_queue = None
+                    try:
+                        await turn
+                    except asyncio.CancelledError:
+                        pass
+            elif control.get("type") == "text" and control.get("message"):
+                try:
+                    reply = await ai_agent.AiAgent(
+                        message=control["message"], session_id=session_id, output_audio=bool(control.get("output_audio", speak)), **hints
+                    ).generate_response_async()
+                    await _send_event(websocket, {"type": "reply", **reply.model_dump()})
+                except Exception as e:
+                    await websocket.send_json({"type": "error", "detail": _to_http_exception(e).detail})
+            else:
+                await websocket.send_json({"type": "error", "detail": "Unknown message type"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if turn is not None and not turn.done():
+            turn.cancel()
+
+
+async def _send_event(websocket, event):
+    """Send an event as JSON; a reply's speech follows it as a binary frame."""
+    output_audio = event.pop("output_audio", None)
+    await websocket.send_json(event)
+    if output_audio is not None:
+        await websocket.send_bytes(output_audio)
+
+
+async def _put_while_running(queue, item, turn):
+    """
+    Queue an item for a voice turn, waiting for room while the turn runs: a
+    turn that ends early (audio limit, Dialogflow closing the stream) stops
+    draining its queue, and the item is dropped.
+    """
+    if not queue.full():
+        queue.put_nowait(item)
+        return
+    put = asyncio.ensure_future(queue.put(item))
+    await asyncio.wait({put, turn}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+
+
+async def _drain_queue(queue):
+    while True:
+        chunk = await queue.get()
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def _stream_multipart_file(request, content_type, field_name):
+    """Yield the bytes of one multipart file field as they arrive, without buffering the body."""
+    _, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Missing boundary in multipart request")
+
+    part = {"header_field": b"", "header_value": b"", "name": None}
+    pending = []
+
+    def on_part_begin():
+        part["name"] = None
+
+    def on_header_field(data, start, end):
+        part["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["header_value"] += data[start:end]
+
+    def on_header_end():
+        if part["header_field"].lower() == b"content-disposition":
+            _, options = parse_options_header(part["header_value"])
+            part["name"] = options.get(b"name", b"").decode("latin-1")
+        part["header_field"] = b""
+        part["header_value"] = b""
+
+    def on_part_data(data, start, end):
+        if part["name"] == field_name:
+            pending.append(bytes(data[start:end]))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_part_data": on_part_data,
+    })
+    async for chunk in request.stream():
+        parser.write(chunk)
+        if pending:
+            yield b"".join(pending)
+            pending.clear()
+    parser.finalize()
+
+
+def _to_http_exception(e):
+    """Map errors raised while generating a reply to HTTP errors."""
+    if isinstance(e, AudioPoolBusy):
+        # Transcode pool saturated: shed load fast instead of queueing more audio
+        return HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    if isinstance(e, CircuitOpen):
+        return HTTPException(status_code=503, detail=e.message, headers={"Retry-After": str(e.retry_after)})
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, AudioTooLong):
+        return HTTPException(status_code=413, detail=str(e))
+    if isinstance(e, UnsupportedAudioFormat):
+        return HTTPException(status_code=415, detail=str(e))
+    if isinstance(e, NoSpeechDetected):
+        return HTTPException(status_code=422, detail=str(e))
+    if isinstance(e, core_exceptions.DeadlineExceeded):
+        return HTTPException(status_code=504, detail=f"Dialogflow did not answer in time: {e.message}")
+    if isinstance(e, core_exceptions.ServiceUnavailable):
+        return HTTPException(status_code=503, detail=f"Dialogflow is unavailable: {e.message}")
+    if isinstance(e, ValueError):
         # Handle audio conversion errors
         error_message = str(e)
         if "conversion" in error_message.lower() or "ffmpeg" in error_message.lower() or "pydub" in error_message.lower():
-            raise HTTPException(
+            return HTTPException(
                 status_code=500,
                 detail=f"Audio processing error: {error_message}. Please ensure the audio file is in a supported format (WAV, FLAC, OGG) or that the server has audio conversion tools installed."
             )
-        raise HTTPException(status_code=400, detail=error_message)
-    except Exception as e:
-        logger.error(f"Unexpected error processing request: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Internal server error: {str(e)}"
-        )
\ No newline at end of file
+        return HTTPException(status_code=400, detail=error_message)
+    logger.error(f"Unexpected error processing request: {str(e)}")
+    return HTTPException(
+        status_code=500,
+        detail=f"Internal server error: {str(e)}"
+    )
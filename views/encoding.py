@@ -0,0 +1,64 @@
+"""
+Encoding of reply bodies.
+
+JSON is written with orjson when it is installed (replies.dumps), straight
+from the model's dict instead of through FastAPI's jsonable_encoder walk. Clients
+that send Accept: application/msgpack get MessagePack instead when msgpack
+is installed: a smaller body for replies with custom payloads.
+
+Spoken replies (OUTPUT_AUDIO=1, see integeration/speech.py) are asked for
+with ?output_audio=1, and come back in the reply's output_audio field
+(base64 in JSON, raw bytes in MessagePack), or with an Accept: audio/*
+header, and come back as the audio itself: the session ID, intent and
+text messages are then in the X-Session-Id, X-Intent and X-Reply-Text
+(percent-encoded, one message per line) headers.
+"""
+from urllib.parse import quote
+
+from fastapi.responses import Response
+
+from integeration.replies import dumps
+from integeration.speech import OUTPUT_MEDIA_TYPE
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def wants_msgpack(request):
+    accept = request.headers.get("accept", "")
+    return MSGPACK_AVAILABLE and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)
+
+
+def wants_audio(connection):
+    return "audio/" in connection.headers.get("accept", "")
+
+
+def wants_speech(connection):
+    """True if a request or WebSocket asks for spoken replies."""
+    return wants_audio(connection) or connection.query_params.get("output_audio") in ("1", "true")
+
+
+def model_response(request, model):
+    """Response for a pydantic model, as MessagePack when the client asks for it, else JSON."""
+    if wants_msgpack(request):
+        return Response(msgpack.packb(model.model_dump()), media_type=MSGPACK_MEDIA_TYPES[0])
+    # JSON mode writes bytes fields as the model configures them (base64 for spoken replies)
+    return Response(dumps(model.model_dump(mode="json")), media_type="application/json")
+
+
+def reply_response(request, reply):
+    """
+    Response for an AiAgentResponse: its speech for Accept: audio/* when
+    there is any, else model_response().
+    """
+    if reply.output_audio is None or not wants_audio(request):
+        return model_response(request, reply)
+    headers = {"X-Session-Id": reply.session_id, "X-Reply-Text": quote("\n".join(reply.messages))}
+    if reply.intent:
+        headers["X-Intent"] = quote(reply.intent)
+    return Response(reply.output_audio, media_type=OUTPUT_MEDIA_TYPE, headers=headers)
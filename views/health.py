@@ -0,0 +1,48 @@
+"""
+Liveness and readiness probes.
+
+/healthz answers as soon as the app is serving. /readyz answers 200 once the
+startup warm-up (ffmpeg probe, Dialogflow credentials and channel) has
+finished, and 503 while it is still running; a failed warm-up is reported
+and retried on the next probe.
+"""
+import asyncio
+import os
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from domain.ai_agent import warm_up
+
+# Seconds the warm-up waits for the Dialogflow channel to connect
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "10"))
+
+router = APIRouter()
+
+
+def start_warm_up(app):
+    """Run the warm-up in the background so the server can accept requests meanwhile."""
+    task = app.state.warm_up = asyncio.create_task(warm_up(WARMUP_TIMEOUT))
+    # Failures are logged by warm_up and reported by /readyz
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+@router.get('/healthz', include_in_schema=False)
+def healthz():
+    return {"status": "ok"}
+
+
+@router.get('/readyz', include_in_schema=False)
+async def readyz(request: Request):
+    task = getattr(request.app.state, "warm_up", None)
+    if task is None or not task.done():
+        return JSONResponse({"status": "starting"}, status_code=503)
+    if task.cancelled() or task.exception() is not None:
+        error = task.exception() if not task.cancelled() else None
+        start_warm_up(request.app)
+        return JSONResponse(
+            {"status": "failed", "detail": str(error or "cancelled") or type(error).__name__},
+            status_code=503
+        )
+    return {"status": "ready"}
@@ -0,0 +1,60 @@
+"""
+Upload limits enforced while the request body streams in.
+
+BodySizeLimitMiddleware rejects a request with 413 as soon as its
+Content-Length, or the bytes received so far, cross the limit, so oversized
+uploads are never fully buffered by the JSON, form or raw-body parsers.
+"""
+import os
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+MAX_AUDIO_BYTES = int(os.environ.get("MAX_AUDIO_BYTES", str(10 * 1024 * 1024)))
+# NDJSON batches carry many base64 items in one body
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES", str(100 * 1024 * 1024)))
+# Room for form fields, JSON keys and multipart boundaries around the audio
+BODY_OVERHEAD_BYTES = 64 * 1024
+
+
+class RequestTooLarge(HTTPException):
+    def __init__(self, limit):
+        super().__init__(status_code=413, detail=f"Request body exceeds the {limit} byte limit")
+
+
+def max_body_bytes(content_type):
+    """Body limit for a request: JSON carries audio base64-encoded (4/3 larger)."""
+    if "application/x-ndjson" in content_type:
+        return MAX_BATCH_BYTES
+    if "application/json" in content_type:
+        return MAX_AUDIO_BYTES * 4 // 3 + BODY_OVERHEAD_BYTES
+    return MAX_AUDIO_BYTES + BODY_OVERHEAD_BYTES
+
+
+class BodySizeLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        limit = max_body_bytes(headers.get(b"content-type", b"").decode("latin-1"))
+        content_length = headers.get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": RequestTooLarge(limit).detail}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise RequestTooLarge(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,95 @@
+"""
+/metrics endpoint and the middleware feeding its HTTP metrics and the
+per-request log line.
+"""
+import json
+import logging
+import os
+import random
+import time
+
+from fastapi import APIRouter, Response
+
+from integeration.metrics import (
+    HTTP_ERRORS, HTTP_IN_FLIGHT, HTTP_RESPONSES, HTTP_SECONDS, end_request_record, render_metrics,
+    start_request_record,
+)
+
+# One structured line per request; route it separately from the app's own logs
+request_logger = logging.getLogger("ai_agent.requests")
+
+# Fraction of successful requests logged; errors are always logged
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get("REQUEST_LOG_SAMPLE_RATE", "0.1"))
+
+router = APIRouter()
+
+
+@router.get('/metrics', include_in_schema=False)
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, headers={"Content-Type": content_type})
+
+
+class MetricsMiddleware:
+    """
+    Count in-flight requests, latency and responses by route and status, and
+    log one sampled JSON line per request with its stage timings, detected
+    format and sizes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._paths = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        if self._paths is None:
+            self._paths = frozenset(getattr(route, "path", None) for route in scope["app"].router.routes)
+        # Label by known route paths only, so unknown URLs can't blow up label cardinality
+        route = scope["path"] if scope["path"] in self._paths else "unmatched"
+        status = 500
+        request_bytes = 0
+        response_bytes = 0
+
+        async def counting_receive():
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes += len(message.get("body", b""))
+            return message
+
+        async def send_with_status(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        gauge = HTTP_IN_FLIGHT.labels(route)
+        gauge.inc()
+        record, token = start_request_record()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            end_request_record(token)
+            HTTP_SECONDS.labels(route).observe(elapsed)
+            gauge.dec()
+            HTTP_RESPONSES.labels(route, str(status)).inc()
+            if status >= 400:
+                HTTP_ERRORS.labels(str(status)).inc()
+            if (status >= 400 or random.random() < REQUEST_LOG_SAMPLE_RATE) and request_logger.isEnabledFor(logging.INFO):
+                record["stages"] = {name: round(seconds * 1000, 2) for name, seconds in record["stages"].items()}
+                request_logger.info(json.dumps({
+                    "method": scope["method"],
+                    "route": route,
+                    "status": status,
+                    "ms": round(elapsed * 1000, 2),
+                    "request_bytes": request_bytes,
+                    "response_bytes": response_bytes,
+                    **record,
+                }))